@@ -1,57 +1,86 @@
 from flask import Flask, request, jsonify
 from flask_cors import CORS # added cors to deal with issues from the frontend and backend being served from separate domains
-import torch
 from torch_geometric.data import Data
-from torch_geometric.utils import to_undirected
-import json
-import copy
+import argparse
+import itertools
+import logging
+import os
 import sys
-import math
-import random
+import time
+from collections import deque
+
+import numpy as np
 
 sys.path.append("../model")
 
-from game import Game
-from model import GCN
+from bellman_ford import find_negative_cycle
+from rollout import RolloutConfig, batched_rollouts
+from serving import InferenceBatcher
+from sessions import MarketSession, SessionStore
+from ingest import loads
+from inference import load_model
+
+# Loaded and warmed up once at import, every request's model calls then go through the batcher
+# - ARBITRAGE_MODEL is an exported artifact (model/inference.py) or a pickled GCN checkpoint
+model = load_model(os.environ.get('ARBITRAGE_MODEL', 'model_b3.pth'))
+batcher = InferenceBatcher(model, window_ms=float(os.environ.get('ARBITRAGE_BATCH_WINDOW_MS', 1.0)))
+batcher.warmup()
+
+# Route the model fallback's forwards through the batcher, off: each request runs its own (GCNEngine) forwards
+MICRO_BATCHING = True
+
+# Try the exact Bellman-Ford solver on the market rates first, the model is only used when it finds no arbitrage
+USE_BELLMAN_FORD = True
 
-model = torch.load('model_b3.pth')
+# Model fallback: 16 seeded rollouts per batched forward, at most 64 forwards or 0.5s per request
+ROLLOUT = RolloutConfig(k=16, max_steps=64, time_budget=0.5)
+
+# latencies (ms) of recent requests, for /metrics' p50/p99
+# - p50/p99 are also printed every LATENCY_PRINT_EVERY requests (0 for never) and logged after each one at debug level
+LATENCIES = deque(maxlen=1000)
+LATENCY_PRINT_EVERY = 100
+_requests = itertools.count(1)
+logger = logging.getLogger(__name__)
+
+# market graphs kept between requests, see /sessions
+sessions = SessionStore()
 
 app = Flask(__name__)
 CORS(app, origins=['*']) # Change this before deployment!
 
-def arbitrage_path(edge_index, edge_attr, x, ea):
-    
-    G = Data(x, edge_index, edge_attr)
-    print(edge_index.t())
-    game = Game(G)
-    print(game.graph.edge_index.t())
-    path = [copy.deepcopy(game.current_node)]
-    try:
-        while not game.is_terminal:
-            policy, value = model(game)
-            model_decision = torch.multinomial(policy, 1)
-            a = torch.cat((torch.tensor([game.current_node]), model_decision), 0)
-            print(a)
-            _, model_reward, _ = game.step(a)
-
-            path.append(model_decision.item())
-    except Exception as e:
-        print(policy)
-        print(e)
-        return False
-
-    for i, node in enumerate(path):
-        path[i] = node + 1
-    
-    if len(path) == 2:
-        path = arbitrage_path(edge_index, edge_attr, x, ea)
-    if path[-1] == path[-3]:
-        path = arbitrage_path(edge_index, edge_attr, x, ea)
-    
-    path = path[path.index(path[-1]):]
-    
+def arbitrage_path(G: Data):
+    """Best cycle (node indices, closed) of the model's batched rollouts, or None if none closed within the budget"""
+    if MICRO_BATCHING:
+        with batcher.session():
+            path, reward, steps = batched_rollouts(batcher, G, ROLLOUT)
+    else:
+        path, reward, steps = batched_rollouts(model, G, ROLLOUT)
     return path
 
+def solve(session: MarketSession):
+    """Arbitrage cycle (closed, as the client's node ids) in a session's market, or False"""
+    # Fast path: negative cycle of -log(rate)
+    cycle = find_negative_cycle(session.market_graph()) if USE_BELLMAN_FORD else None
+    path = cycle.nodes if cycle is not None else None
+
+    #Run through model, get output
+    if path is None:
+        path = arbitrage_path(session.model_graph())
+    if path is None:
+        return False
+    return session.nodes.ids[path].tolist()
+
+def record_latency(route: str, start: float):
+    LATENCIES.append(1000*(time.perf_counter() - start))
+    n = next(_requests)
+    report = LATENCY_PRINT_EVERY and n % LATENCY_PRINT_EVERY == 0
+    if report or logger.isEnabledFor(logging.DEBUG):
+        p50, p99 = np.percentile(LATENCIES.copy(), [50, 99]) # copy, other request threads may be appending
+        summary = f"{route}: {LATENCIES[-1]:.1f}ms (p50 {p50:.1f}ms, p99 {p99:.1f}ms over {len(LATENCIES)} requests)"
+        logger.debug(summary)
+        if report:
+            print(summary)
+
 def get_model_score(graph):
     return graph
 
@@ -62,46 +91,87 @@ def index():
 @app.route('/process-graph', methods=['GET', 'POST'])
 def process_data():
     if request.method == 'POST':
-        # get json graph from request
-        graph_data = request.json
-        tensor_arr = [[], []]
-        edge_weights = []
-        ea = []
-        x_arr = []
-
-        for link in graph_data[0]:
-            tensor_arr[0].append(int(link['source']['id'])-1)
-            tensor_arr[1].append(int(link['target']['id'])-1)
-            # edge_weights.append(math.log(float(link['weight'])+0.001))
-            edge_weights.append(random.uniform(-1, 1)) # Demo test edges
-            ea.append([float(link['weight'])])
-
-        for link in graph_data[0]:
-            tensor_arr[0].append(int(link['target']['id'])-1)
-            tensor_arr[1].append(int(link['source']['id'])-1)
-            # edge_weights.append(math.log(1/(float(link['weight'])+0.1)+0.1))
-            edge_weights.append(random.uniform(-1, 1)) # Demo test edges
-            ea.append([1 / (float(link['weight']) + 0.0001)])
-
-        x_arr = [[0]]*int(len(graph_data[1])) # Creates an array of [0]s the length of the total number of nodes
-
-        # Formatting for the model
-        edge_index = torch.tensor(tensor_arr, dtype=torch.long)
-        edge_attr = torch.tensor(edge_weights, dtype=torch.float).view(-1, 1)
-        print(edge_index)
-        x = torch.tensor(x_arr, dtype=torch.float)
-        
-        #Run through model, get output
-        path = arbitrage_path(edge_index, edge_attr, x, torch.tensor(ea))
+        start = time.perf_counter()
 
+        # get json graph from request, [links, nodes]
+        session = MarketSession.from_payload(loads(request.get_data()))
+        path = solve(session)
+
+        record_latency('process-graph', start)
         return jsonify(path)
         # return path as json
     else:
         return "method is get"
 
+@app.route('/sessions', methods=['POST'])
+def create_session():
+    """Post the full graph once (same body as /process-graph), returns the session id and its path"""
+    start = time.perf_counter()
+    session = MarketSession.from_payload(loads(request.get_data()))
+    with session.lock:
+        path = solve(session)
+    session_id = sessions.create(session)
+
+    record_latency('sessions', start)
+    return jsonify({"session": session_id, "path": path})
+
+@app.route('/sessions/<session_id>', methods=['PATCH'])
+def update_session(session_id):
+    """
+    Apply a delta and re-solve, body {"rates": [{source, target, weight}, ...], "removed": [{source, target}, ...]}
+    where rates holds the changed (or new) pairs only, both keys are optional
+    """
+    start = time.perf_counter()
+    session = sessions.get(session_id)
+    if session is None:
+        return jsonify({"error": f"unknown session {session_id}"}), 404
+
+    delta = loads(request.get_data() or b'{}')
+    with session.lock:
+        session.update(rates=delta.get('rates', ()), removed=delta.get('removed', ()))
+        path = solve(session)
+
+    record_latency('sessions', start)
+    return jsonify({"session": session_id, "path": path})
+
+@app.route('/sessions/<session_id>', methods=['DELETE'])
+def delete_session(session_id):
+    if not sessions.delete(session_id):
+        return jsonify({"error": f"unknown session {session_id}"}), 404
+    return jsonify({"session": session_id})
+
+@app.route('/health')
+def health():
+    return jsonify({"status": "ok" if batcher.thread.is_alive() else "batcher down", "model": type(model).__name__})
+
+@app.route('/metrics')
+def metrics():
+    latency_p50, latency_p99 = map(float, np.percentile(LATENCIES.copy(), [50, 99])) if LATENCIES else (0., 0.)
+    return jsonify({
+        "requests": len(LATENCIES),
+        "sessions": len(sessions),
+        "latency_ms": {"p50": latency_p50, "p99": latency_p99},
+        "batcher": batcher.metrics(),
+    })
+
 @app.route('/evaluate-model')
 def score_model():
     return jsonify(get_model_score())
 
 if __name__ == '__main__':
-    app.run(debug=True)
\ No newline at end of file
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--serve', action='store_true', help='multi-threaded server without the debugger/reloader')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--threads', type=int, default=16)
+    args = parser.parse_args()
+
+    if not args.serve:
+        app.run(debug=True)
+    else:
+        try:
+            from waitress import serve
+            serve(app, host=args.host, port=args.port, threads=args.threads)
+        except ImportError:
+            # werkzeug's threaded server, one thread per request
+            app.run(host=args.host, port=args.port, threaded=True)
\ No newline at end of file
@@ -0,0 +1,247 @@
+'''
+backtest - replay recorded rate snapshots through a solver, offline
+
+Snapshots are read lazily from local files, one market state each:
+
+    {"time": 1700000000.0, "rates": {"XBT/ETH": 18.25, "ETH/USDT": 2240.1, ...}}
+
+either one per line (.jsonl, optionally .gz) or one per .json file, files taken in name order.  Raw Kraken
+/0/public/Ticker responses ({"result": {"XXBTZUSD": {"c": ["price", "volume"], ...}}}) are accepted as well when
+an /0/public/AssetPairs response is given to name their pairs.
+
+The pipeline is a chain of generators, so memory stays bounded however long the replay is:
+
+    read_snapshots -> market_ticks (one MarketSession patched by each snapshot's delta) -> run_backtest (solve, score)
+
+Every solver gets the session and returns (closed path of node indices or None, log return of that path), the
+log return being the sum of log(rate) along the cycle, i.e. a cycle multiplies money by exp(log return).
+
+usage (from the repo root):
+    python api/backtest.py snapshots.jsonl.gz --solver bellman-ford
+    python api/backtest.py recordings/ --solver rollout --model api/model_b3.pth --out report.json
+'''
+
+import argparse
+import gzip
+import json
+import math
+import os
+import sys
+import time
+
+import numpy as np
+import torch
+
+sys.path.insert(1, os.path.join(os.path.dirname(__file__), '..', 'model'))
+sys.path.insert(1, os.path.join(os.path.dirname(__file__), '..', 'utils'))
+
+from game import Game
+from bellman_ford import find_negative_cycle
+from rollout import RolloutConfig, batched_rollouts
+from mcts import MCTSConfig, mcts
+from ingest import loads
+from sessions import MarketSession
+from inference import load_model
+
+def _open(path: str):
+    return gzip.open(path, 'rb') if path.endswith('.gz') else open(path, 'rb')
+
+def read_snapshots(path: str):
+    """Snapshots of a .jsonl(.gz) / .json(.gz) file, or of every such file in a directory (in name order)"""
+    if os.path.isdir(path):
+        for name in sorted(os.listdir(path)):
+            if name.endswith(('.json', '.jsonl', '.json.gz', '.jsonl.gz')):
+                yield from read_snapshots(os.path.join(path, name))
+        return
+
+    with _open(path) as f:
+        if '.jsonl' in os.path.basename(path):
+            for line in f:
+                if line.strip():
+                    yield loads(line)
+        else:
+            yield loads(f.read())
+
+def kraken_rates(ticker: dict, asset_pairs: dict) -> dict:
+    """{"BASE/QUOTE": last trade price} of a Ticker response, pairs named by the AssetPairs response's wsname"""
+    names = {key: info['wsname'] for key, info in asset_pairs.get('result', asset_pairs).items() if 'wsname' in info}
+    return {names[key]: float(info['c'][0]) for key, info in ticker['result'].items() if key in names}
+
+def market_ticks(snapshots, asset_pairs: dict = None, exclude=()):
+    """
+    Yields (time, session, n_changed) per snapshot, where session is one MarketSession patched in place by the
+    pairs added, re-rated or gone since the previous snapshot and n_changed the size of that delta
+    :param exclude: currencies left out of the graph, e.g. ("USD", "EUR") as the UI does
+    """
+    session = MarketSession()
+    currencies = {} # currency -> node id
+    last = {} # pair -> rate as last applied
+
+    def node(currency):
+        if currency not in currencies:
+            currencies[currency] = len(currencies) + 1
+        return currencies[currency]
+
+    for i, snapshot in enumerate(snapshots):
+        if 'result' in snapshot:
+            rates, t = kraken_rates(snapshot, asset_pairs), float(i)
+        else:
+            rates, t = snapshot['rates'], float(snapshot.get('time', i))
+
+        rates = {pair: rate for pair, rate in rates.items() if not any(c in exclude for c in pair.split('/'))}
+        changed = [(pair, rate) for pair, rate in rates.items() if last.get(pair) != rate]
+        removed = [pair for pair in last if pair not in rates]
+
+        session.update(
+            rates=[{"source": node(pair.split('/')[0]), "target": node(pair.split('/')[1]), "weight": rate} for pair, rate in changed],
+            removed=[{"source": currencies[pair.split('/')[0]], "target": currencies[pair.split('/')[1]]} for pair in removed],
+        )
+        for pair in removed:
+            del last[pair]
+        last.update(changed)
+        yield t, session, len(changed) + len(removed)
+
+# -- solvers: session -> (closed path of node indices or None, log return) --
+
+def bellman_ford_solver():
+    def solve(session: MarketSession):
+        cycle = find_negative_cycle(session.market_graph())
+        return (cycle.nodes, -cycle.cost) if cycle is not None else (None, 0.)
+    return solve
+
+def rollout_solver(model, config: RolloutConfig = None):
+    config = config or RolloutConfig()
+    def solve(session: MarketSession):
+        path, reward, _ = batched_rollouts(model, session.rate_graph(), config)
+        return (path, reward) if path is not None else (None, 0.)
+    return solve
+
+def mcts_solver(model, config: MCTSConfig = None, max_moves: int = 32, seed: int = 0):
+    """Plays the game greedily on the MCTS policy from a (seeded) random start node until a node repeats"""
+    config = config or MCTSConfig(10, logging=False)
+    rng = np.random.default_rng(seed)
+    def solve(session: MarketSession):
+        if session.n_edges == 0:
+            return None, 0.
+        game = Game(session.rate_graph(), int(rng.integers(session.n_nodes)))
+        path, returns, tree = [game.current_node], [0.], None
+        while not game.is_terminal and len(path) <= max_moves and game.get_out_degree() > 0:
+            pi, tree = mcts(config, game, model, tree=tree, return_tree=True)
+            action = int(torch.argmax(pi))
+            tree = tree.subtree(action)
+            _, reward, _ = game.step(torch.tensor([game.current_node, action]))
+            path.append(action)
+            returns.append(returns[-1] + reward)
+        if not game.is_terminal:
+            return None, 0.
+        first = path.index(path[-1])
+        return path[first:], returns[-1] - returns[first]
+    return solve
+
+class Reservoir:
+    """Uniform sample of at most size values out of a stream, for percentiles in bounded memory"""
+    def __init__(self, size: int = 10000, seed: int = 0):
+        self.values = np.zeros(size)
+        self.count = 0
+        self.rng = np.random.default_rng(seed)
+
+    def add(self, value: float):
+        if self.count < len(self.values):
+            self.values[self.count] = value
+        else:
+            j = self.rng.integers(self.count + 1)
+            if j < len(self.values):
+                self.values[j] = value
+        self.count += 1
+
+    def percentiles(self, q):
+        sample = self.values[:min(self.count, len(self.values))]
+        return np.percentile(sample, q).tolist() if len(sample) else [float('nan')]*len(q)
+
+def run_backtest(ticks, solve, log_every: int = 0):
+    """
+    Run solve on every tick and accumulate running statistics
+    - latency (solve only, and ingest: applying the snapshot's delta), cycles found, profitable cycles (log
+      return > 0) and simulated profit, compounding one unit through every profitable cycle found
+    """
+    solve_ms, ingest_ms = Reservoir(), Reservoir()
+    stats = {"ticks": 0, "cycles": 0, "profitable": 0, "log_return": 0., "best_log_return": float('-inf'), "changes": 0}
+
+    start = time.perf_counter()
+    ingest_start = start
+    for t, session, n_changed in ticks:
+        ingest_ms.add(1000*(time.perf_counter() - ingest_start))
+
+        solve_start = time.perf_counter()
+        path, log_return = solve(session)
+        solve_ms.add(1000*(time.perf_counter() - solve_start))
+
+        stats["ticks"] += 1
+        stats["changes"] += n_changed
+        if path is not None:
+            stats["cycles"] += 1
+            stats["best_log_return"] = max(stats["best_log_return"], log_return)
+            if log_return > 0:
+                stats["profitable"] += 1
+                stats["log_return"] += log_return
+
+        if log_every and stats["ticks"] % log_every == 0:
+            elapsed = time.perf_counter() - start
+            print(f"tick {stats['ticks']} (t={t:.0f}): {60*stats['ticks']/elapsed:.0f} ticks/min, "
+                  f"{stats['cycles']} cycles, {stats['profitable']} profitable, log return {stats['log_return']:.4f}")
+        ingest_start = time.perf_counter()
+
+    elapsed = time.perf_counter() - start
+    (solve_p50, solve_p99), (ingest_p50, ingest_p99) = solve_ms.percentiles([50, 99]), ingest_ms.percentiles([50, 99])
+    stats.update({
+        "seconds": elapsed,
+        "ticks_per_minute": 60*stats["ticks"]/elapsed if elapsed > 0 else float('nan'),
+        "solve_ms": {"p50": solve_p50, "p99": solve_p99},
+        "ingest_ms": {"p50": ingest_p50, "p99": ingest_p99},
+        "profit": math.exp(stats["log_return"]) - 1,
+    })
+    return stats
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('snapshots', help='.jsonl(.gz) / .json(.gz) file or directory of them')
+    parser.add_argument('--solver', choices=['bellman-ford', 'rollout', 'mcts'], default='bellman-ford')
+    parser.add_argument('--model', help='model for the rollout / mcts solvers, an exported artifact or a checkpoint (see inference.load_model)')
+    parser.add_argument('--asset-pairs', help='Kraken AssetPairs response, for snapshots that are raw Ticker responses')
+    parser.add_argument('--exclude', nargs='*', default=[], help='currencies to leave out, e.g. USD EUR')
+    parser.add_argument('--limit', type=int, default=None, help='stop after this many snapshots')
+    parser.add_argument('--move-budget', type=float, help='mcts solver: seconds per move (anytime search) instead of c_iter=10')
+    parser.add_argument('--log-every', type=int, default=1000)
+    parser.add_argument('--out', help='write the final statistics as JSON')
+    args = parser.parse_args()
+
+    if args.solver == 'bellman-ford':
+        solve = bellman_ford_solver()
+    else:
+        if not args.model:
+            parser.error(f"--solver {args.solver} needs --model")
+        model = load_model(args.model)
+        if args.solver == 'rollout':
+            solve = rollout_solver(model)
+        elif args.move_budget is not None:
+            solve = mcts_solver(model, MCTSConfig(None, logging=False, time_budget=args.move_budget, early_stop=True))
+        else:
+            solve = mcts_solver(model)
+
+    asset_pairs = None
+    if args.asset_pairs:
+        with open(args.asset_pairs, 'rb') as f:
+            asset_pairs = loads(f.read())
+
+    snapshots = read_snapshots(args.snapshots)
+    if args.limit is not None:
+        snapshots = (snapshot for _, snapshot in zip(range(args.limit), snapshots))
+
+    stats = run_backtest(market_ticks(snapshots, asset_pairs, set(args.exclude)), solve, args.log_every)
+    print(json.dumps(stats, indent=2))
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(stats, f, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+'''
+ingest - request body to solver arrays
+
+The market graph arrives as JSON [links, nodes] on every UI refresh, so this path is kept to one pass over the
+decoded links plus NumPy array ops:
+
+- bodies are decoded with orjson when it is installed, the standard json module otherwise
+- links are read into (source id, target id, weight) arrays one flat column at a time, converted straight into
+  the array by np.fromiter (ids and weights may be numbers or numeric strings)
+- node ids are mapped to dense indices through a NodeIndex, which never renumbers an id it has seen
+- both edge directions of every pair are built with array ops, interleaved (forward, backward) per pair
+'''
+
+import json
+
+import numpy as np
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+def loads(body):
+    """Decode a JSON request body (bytes or str)"""
+    if orjson is not None:
+        return orjson.loads(body)
+    return json.loads(body)
+
+def _column(values, convert, dtype) -> np.ndarray:
+    # values are numbers or numeric strings (e.g. Kraken's prices), int / float handle both and are much faster
+    # than NumPy's string to number casts
+    return np.fromiter(map(convert, values), dtype=dtype, count=len(values))
+
+def parse_links(links):
+    """
+    (source ids, target ids, weights) arrays of a link list of {source, target, weight}, where the endpoints are
+    either node ids or node objects ({id, ...}) as the UI's links hold them
+    """
+    if not links:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0)
+    if isinstance(links[0]['source'], dict):
+        source = [link['source']['id'] for link in links]
+        target = [link['target']['id'] for link in links]
+    else:
+        source = [link['source'] for link in links]
+        target = [link['target'] for link in links]
+    weight = [link['weight'] for link in links]
+    return _column(source, int, np.int64), _column(target, int, np.int64), _column(weight, float, np.float64)
+
+def pair_edges(u: np.ndarray, v: np.ndarray, rate: np.ndarray):
+    """
+    Both directed edges of every pair, forward (u -> v at the rate) at 2i and backward (v -> u at 1/(rate + 0.0001))
+    at 2i + 1, as (src, dst, rate) arrays
+    """
+    src = np.stack((u, v), axis=1).reshape(-1)
+    dst = np.stack((v, u), axis=1).reshape(-1)
+    rate = np.stack((rate, 1/(rate + 0.0001)), axis=1).reshape(-1)
+    return src, dst, rate
+
+def log_costs(rate: np.ndarray) -> np.ndarray:
+    """-log(rate), +inf for rates <= 0"""
+    cost = np.full(rate.shape, np.inf)
+    np.negative(np.log(rate, out=cost, where=rate > 0), out=cost, where=rate > 0)
+    return cost
+
+class NodeIndex:
+    """
+    Stable node id -> dense index map: ids are numbered in the order they are first seen and keep their index for
+    the lifetime of the map, so cached arrays indexed by node stay valid as the market changes
+    """
+    def __init__(self, ids=()):
+        self.ids = np.zeros(0, dtype=np.int64) # index -> id
+        # sorted ids and their indices, for vectorized lookups
+        self._sorted = np.zeros(0, dtype=np.int64)
+        self._order = np.zeros(0, dtype=np.int64)
+        self.lookup(np.asarray(ids, dtype=np.int64))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def lookup(self, ids: np.ndarray) -> np.ndarray:
+        """Indices of ids, unseen ids are appended (in order of first appearance)"""
+        ids = np.asarray(ids, dtype=np.int64)
+        pos = np.searchsorted(self._sorted, ids)
+        known = pos < len(self._sorted)
+        known[known] = self._sorted[pos[known]] == ids[known]
+        if not known.all():
+            new, first = np.unique(ids[~known], return_index=True)
+            self.ids = np.concatenate((self.ids, new[np.argsort(first)]))
+            self._order = np.argsort(self.ids, kind='stable')
+            self._sorted = self.ids[self._order]
+            pos = np.searchsorted(self._sorted, ids)
+        return self._order[pos]
+
+    def find(self, ids: np.ndarray) -> np.ndarray:
+        """Indices of ids without adding any, -1 for the ids not seen yet"""
+        ids = np.asarray(ids, dtype=np.int64)
+        if not len(self._sorted):
+            return np.full(ids.shape, -1, dtype=np.int64)
+        pos = np.minimum(np.searchsorted(self._sorted, ids), len(self._sorted) - 1)
+        return np.where(self._sorted[pos] == ids, self._order[pos], -1)
+
+    def index(self, node_id: int) -> int:
+        return int(self.lookup(np.array([node_id]))[0])
@@ -0,0 +1,183 @@
+'''
+serving - request micro-batching for the backend's model
+
+Every /process-graph request that falls back to the model runs batched_rollouts in its own request thread.  Instead
+of calling the GCN directly, the rollouts call an InferenceBatcher, which queues the call and blocks.  A single
+background thread takes whatever calls are queued (waiting up to window_ms for more) and evaluates them together:
+their graphs are joined into one disjoint graph with a GCNEngine built over it, and their state stacks are padded to
+the same K and laid side by side along the node dimension, so the batch costs one sparse matmul per layer.
+Concurrent requests then share forwards instead of contending for the CPU one small forward at a time.
+'''
+
+import queue
+import threading
+import time
+from contextlib import contextmanager
+from collections import Counter, OrderedDict, deque
+
+import numpy as np
+import torch
+from torch_geometric.data import Data
+
+from model import GCN
+from engine import GCNEngine
+
+class _Call:
+    def __init__(self, x, edge_index, edge_attr, current_nodes):
+        self.x = x
+        self.edge_index = edge_index
+        self.edge_attr = edge_attr
+        self.current_nodes = current_nodes
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+class InferenceBatcher:
+    """
+    Thread-safe stand-in for a GCN evaluated on (K, # of nodes, n_features) state stacks, as called by
+    batched_rollouts, that coalesces concurrent calls (possibly on different graphs) into one forward
+    :param max_states: stop adding calls to a forward once it holds this many states
+    :param window_ms: how long to wait for more calls after the first one, while fewer calls than open sessions are
+                      queued (there is no point waiting for callers that are not running)
+    """
+    def __init__(self, model, max_states=256, window_ms=1.0, cache_size=16):
+        self.model = model
+        self.max_states = max_states
+        self.window = window_ms/1000
+        self.queue = queue.Queue()
+
+        # callers currently between calls (see session), so a lone caller never waits out the window
+        self.sessions = 0
+        self._lock = threading.Lock()
+
+        # union graphs (and their GCNEngine) of recent sets of calls, a request passes the same edge_index on every
+        # step, so while the same requests are in flight their union is reused instead of rebuilt every forward
+        self.cache_size = cache_size
+        self._unions = OrderedDict()
+
+        # metrics
+        self.n_forwards = 0
+        self.n_calls = 0
+        self.batch_sizes = Counter() # calls per forward, bucketed by powers of 2
+        self.forward_ms = deque(maxlen=1000)
+
+        self.thread = threading.Thread(target=self._run, name='inference-batcher', daemon=True)
+        self.thread.start()
+
+    @contextmanager
+    def session(self):
+        """Marks a caller (e.g. one request's rollouts) as about to make more calls"""
+        with self._lock:
+            self.sessions += 1
+        try:
+            yield self
+        finally:
+            with self._lock:
+                self.sessions -= 1
+
+    def __call__(self, x, edge_index, edge_attr, current_nodes):
+        call = _Call(x, edge_index, edge_attr, current_nodes)
+        self.queue.put(call)
+        call.done.wait()
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+    def warmup(self, n_nodes=16, k=4):
+        """One forward through the batcher on a small random graph, so the first request doesn't pay for torch's lazy init"""
+        src, dst = torch.meshgrid(torch.arange(n_nodes), torch.arange(n_nodes), indexing='ij')
+        keep = src != dst
+        edge_index = torch.stack((src[keep], dst[keep]))
+        edge_attr = torch.rand(edge_index.shape[1], 1)
+        self(torch.zeros(k, n_nodes, 1), edge_index, edge_attr, torch.zeros(k, dtype=torch.long))
+
+    def _run(self):
+        while True:
+            calls = [self.queue.get()]
+            n_states = calls[0].x.shape[0]
+            deadline = time.perf_counter() + self.window
+            while n_states < self.max_states:
+                wait = deadline - time.perf_counter() if len(calls) < self.sessions else 0
+                try:
+                    call = self.queue.get(timeout=wait) if wait > 0 else self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                calls.append(call)
+                n_states += call.x.shape[0]
+
+            start = time.perf_counter()
+            try:
+                self._forward(calls)
+            except Exception as e:
+                for call in calls:
+                    call.error = e
+            self.forward_ms.append(1000*(time.perf_counter() - start))
+            self.n_forwards += 1
+            self.n_calls += len(calls)
+            self.batch_sizes[1 << (len(calls) - 1).bit_length()] += 1
+
+            for call in calls:
+                call.done.set()
+
+    def _union(self, calls):
+        # disjoint union of the calls' graphs: (engine, node offsets, call of each edge, call of each node)
+        key = tuple(id(call.edge_index) for call in calls)
+        if key in self._unions:
+            self._unions.move_to_end(key)
+            return self._unions[key][1:]
+
+        sizes = [call.x.shape[1] for call in calls]
+        offsets = np.concatenate(([0], np.cumsum(sizes)))
+        n_edges = [call.edge_index.shape[1] for call in calls]
+        graph = Data(
+            x=torch.zeros(int(offsets[-1]), calls[0].x.shape[2]),
+            edge_index=torch.cat([call.edge_index + int(offset) for call, offset in zip(calls, offsets)], 1),
+            edge_attr=torch.cat([call.edge_attr.view(-1, 1) for call in calls]),
+        )
+        edge_call = torch.repeat_interleave(torch.arange(len(calls)), torch.tensor(n_edges))
+        node_call = torch.repeat_interleave(torch.arange(len(calls)), torch.tensor(sizes))
+        union = (GCNEngine(self.model, graph), offsets, edge_call, node_call)
+
+        # the edge_index tensors are kept alive with the entry, so their ids can't be reused while it is cached
+        self._unions[key] = ([call.edge_index for call in calls],) + union
+        if len(self._unions) > self.cache_size:
+            self._unions.popitem(last=False)
+        return union
+
+    @torch.no_grad()
+    def _forward(self, calls):
+        # state i of every call becomes row i of one (K, # of nodes, F) stack over the union of their graphs
+        engine, offsets, edge_call, node_call = self._union(calls)
+        k = max(call.x.shape[0] for call in calls)
+        x = torch.zeros(k, engine.n_nodes, calls[0].x.shape[2])
+        # current node of row i of each call, -1 (no legal moves) for the padding rows of calls with fewer states
+        current = torch.full((k, len(calls)), -1, dtype=torch.long)
+        for j, (call, offset) in enumerate(zip(calls, offsets)):
+            x[:call.x.shape[0], offset:offset + call.x.shape[1]] = call.x
+            current[:call.x.shape[0], j] = call.current_nodes + int(offset)
+
+        p, v = engine.conv(x)
+
+        # legal moves of (row, call) pairs, and one softmax per pair
+        src, dst = engine.edge_index
+        rows, cols = (src.unsqueeze(0) == current[:, edge_call]).nonzero(as_tuple=True)
+        legal = torch.zeros(k, engine.n_nodes, dtype=torch.bool)
+        legal[rows, dst[cols]] = True
+        segment = (torch.arange(k).unsqueeze(1)*len(calls) + node_call).view(-1)
+        p = GCN._masked_softmax(p.reshape(-1), legal.view(-1), segment, k*len(calls)).view(k, -1)
+        v = v*legal
+
+        for call, lo, hi in zip(calls, offsets[:-1], offsets[1:]):
+            call.result = p[:call.x.shape[0], lo:hi], v[:call.x.shape[0], lo:hi]
+
+    def metrics(self):
+        forward_p50, forward_p99 = map(float, np.percentile(self.forward_ms, [50, 99])) if self.forward_ms else (0., 0.)
+        return {
+            "queue_depth": self.queue.qsize(),
+            "sessions": self.sessions,
+            "forwards": self.n_forwards,
+            "calls": self.n_calls,
+            "calls_per_forward": self.n_calls/max(self.n_forwards, 1),
+            "batch_size_histogram": {str(size): count for size, count in sorted(self.batch_sizes.items())},
+            "forward_ms": {"p50": forward_p50, "p99": forward_p99},
+        }
@@ -0,0 +1,194 @@
+'''
+sessions - market graphs kept between requests and patched in place by rate deltas
+
+A client posts its full market graph once, then only sends the pairs whose rate changed (or that were added or
+removed).  Every array the solvers need lives in a MarketSession and is updated slot by slot, so the work per tick is
+proportional to the number of changed rates, not the size of the market.
+'''
+
+import threading
+import uuid
+from collections import OrderedDict
+
+import numpy as np
+import torch
+from torch_geometric.data import Data
+
+from ingest import NodeIndex, log_costs, pair_edges, parse_links
+
+def demo_weights(source_ids: np.ndarray, target_ids: np.ndarray) -> np.ndarray:
+    """
+    The model's (demo) edge weights, uniform-looking on [-1, 1) but a fixed function of the edge's (source id,
+    target id) (a splitmix64 hash), so a market gets the same weights in every session and request
+    """
+    with np.errstate(over='ignore'):
+        z = source_ids.astype(np.uint64)*np.uint64(0x9E3779B97F4A7C15) ^ target_ids.astype(np.uint64)
+        z = (z ^ (z >> np.uint64(30)))*np.uint64(0xBF58476D1CE4E5B9)
+        z = (z ^ (z >> np.uint64(27)))*np.uint64(0x94D049BB133111EB)
+        z = z ^ (z >> np.uint64(31))
+    return ((z >> np.uint64(40)).astype(np.float32)/(1 << 24))*2 - 1
+
+class MarketSession:
+    """
+    Market graph whose edges live in preallocated arrays
+    - a pair (source, target, rate) is stored as two directed edges in adjacent slots, source -> target at the rate
+      and target -> source at 1/(rate + 0.0001), as /process-graph always built them
+    - node ids on the wire are mapped to array indices by a NodeIndex (nodes.ids maps them back)
+    - removing a pair moves the last pair into its slots, so the edges stay contiguous and every array can be handed
+      to torch / the solvers as a zero-copy view of its first n_edges entries
+    """
+    def __init__(self, node_ids=(), capacity: int = 64):
+        self.nodes = NodeIndex(node_ids)
+        self.n_edges = 0
+        self.src = np.zeros(capacity, dtype=np.int64)
+        self.dst = np.zeros(capacity, dtype=np.int64)
+        self.rate = np.zeros(capacity, dtype=np.float64)
+        self.cost = np.zeros(capacity, dtype=np.float64) # -log(rate), what Bellman-Ford runs on
+        self.demo = np.zeros(capacity, dtype=np.float32) # the model's (demo) edge weights, see demo_weights
+
+        # (source, target) of each pair -> slot of its forward edge, the backward edge is the next slot
+        self.slots = {}
+        self.version = 0
+
+        # held while a delta is applied and solved, requests on one session are serialized
+        self.lock = threading.Lock()
+
+    @property
+    def n_nodes(self) -> int:
+        return len(self.nodes)
+
+    @classmethod
+    def from_payload(cls, graph_data):
+        """Session for a /process-graph body, [links, nodes] with links of {source, target, weight} and nodes of {id}"""
+        links, nodes = graph_data
+        session = cls([node['id'] for node in nodes], capacity=max(2*len(links), 64))
+
+        source, target, weight = parse_links(links)
+        u, v = session.nodes.lookup(source), session.nodes.lookup(target)
+
+        # a pair listed twice keeps its last rate, as if the links had been applied one by one
+        keys = u*session.n_nodes + v
+        _, last = np.unique(keys[::-1], return_index=True)
+        keep = np.sort(len(keys) - 1 - last)
+        u, v, weight = u[keep], v[keep], weight[keep]
+
+        n = 2*len(keep)
+        session.src[:n], session.dst[:n], session.rate[:n] = pair_edges(u, v, weight)
+        session.cost[:n] = log_costs(session.rate[:n])
+        session.demo[:n] = demo_weights(session.nodes.ids[session.src[:n]], session.nodes.ids[session.dst[:n]])
+        session.n_edges = n
+        session.slots = dict(zip(zip(u.tolist(), v.tolist()), range(0, n, 2)))
+        session.version += 1
+        return session
+
+    def _grow(self, size: int):
+        capacity = len(self.src)
+        if size <= capacity:
+            return
+        capacity = max(size, 2*capacity)
+        for name in ('src', 'dst', 'rate', 'cost', 'demo'):
+            old = getattr(self, name)
+            new = np.zeros(capacity, dtype=old.dtype)
+            new[:self.n_edges] = old[:self.n_edges]
+            setattr(self, name, new)
+
+    def update(self, rates=(), removed=()):
+        """
+        Apply a delta: add or re-rate the pairs in rates ({source, target, weight}) and drop the pairs in removed
+        ({source, target}), unknown pairs in removed are ignored
+        """
+        if removed:
+            source, target, _ = parse_links([dict(link, weight=0) for link in removed])
+            # find rather than lookup, the ids of an unknown pair must not become nodes
+            for pair in zip(self.nodes.find(source).tolist(), self.nodes.find(target).tolist()):
+                if -1 not in pair:
+                    self._remove(pair)
+
+        if rates:
+            source, target, weight = parse_links(rates)
+            u, v = self.nodes.lookup(source), self.nodes.lookup(target)
+
+            # slot of every pair, new pairs are appended
+            slots = np.empty(len(u), dtype=np.int64)
+            for i, pair in enumerate(zip(u.tolist(), v.tolist())):
+                slot = self.slots.get(pair)
+                if slot is None:
+                    slot = self.slots[pair] = self.n_edges
+                    self._grow(slot + 2)
+                    self.n_edges += 2
+                    self.demo[slot:slot + 2] = demo_weights(self.nodes.ids[[u[i], v[i]]], self.nodes.ids[[v[i], u[i]]])
+                slots[i] = slot
+
+            slots = np.stack((slots, slots + 1), axis=1).reshape(-1)
+            self.src[slots], self.dst[slots], self.rate[slots] = pair_edges(u, v, weight)
+            self.cost[slots] = log_costs(self.rate[slots])
+
+        self.version += 1
+
+    def _remove(self, pair):
+        slot = self.slots.pop(pair, None)
+        if slot is None:
+            return
+        last = self.n_edges - 2
+        if slot != last:
+            for name in ('src', 'dst', 'rate', 'cost', 'demo'):
+                array = getattr(self, name)
+                array[slot:slot + 2] = array[last:last + 2]
+            self.slots[(int(self.src[slot]), int(self.dst[slot]))] = slot
+        self.n_edges = last
+
+    def market_graph(self) -> Data:
+        """Data with the edge costs (-log(rate)) as edge_attr, for find_negative_cycle"""
+        return Data(
+            x=torch.zeros(self.n_nodes, 1),
+            edge_index=torch.from_numpy(np.stack((self.src[:self.n_edges], self.dst[:self.n_edges]))),
+            edge_attr=torch.from_numpy(self.cost[:self.n_edges]).view(-1, 1),
+        )
+
+    def rate_graph(self) -> Data:
+        """Data with log(rate) as edge_attr, so a game's reward along a cycle is its log return"""
+        # rates <= 0 (cost +inf) are floored instead of -inf, which the GCN would turn into nans
+        log_rate = np.maximum(-self.cost[:self.n_edges], -50.).astype(np.float32)
+        return Data(
+            x=torch.zeros(self.n_nodes, 1),
+            edge_index=torch.from_numpy(np.stack((self.src[:self.n_edges], self.dst[:self.n_edges]))),
+            edge_attr=torch.from_numpy(log_rate).view(-1, 1),
+        )
+
+    def model_graph(self) -> Data:
+        """Data with the model's edge weights as edge_attr"""
+        return Data(
+            x=torch.zeros(self.n_nodes, 1),
+            edge_index=torch.from_numpy(np.stack((self.src[:self.n_edges], self.dst[:self.n_edges]))),
+            edge_attr=torch.from_numpy(self.demo[:self.n_edges]).view(-1, 1),
+        )
+
+class SessionStore:
+    """Thread-safe id -> MarketSession map, the least recently used sessions are dropped past max_sessions"""
+    def __init__(self, max_sessions: int = 64):
+        self.max_sessions = max_sessions
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def create(self, session: MarketSession) -> str:
+        session_id = uuid.uuid4().hex
+        with self._lock:
+            self._sessions[session_id] = session
+            if len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+        return session_id
+
+    def get(self, session_id: str) -> MarketSession:
+        """The session, or None if it does not exist (or was evicted)"""
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is not None:
+                self._sessions.move_to_end(session_id)
+            return session
+
+    def delete(self, session_id: str) -> bool:
+        with self._lock:
+            return self._sessions.pop(session_id, None) is not None
+
+    def __len__(self):
+        return len(self._sessions)
@@ -0,0 +1,88 @@
+'''
+bench_game - steps per second of Game's edge lookups, the old O(|E|) edge_index scan against the GraphIndex CSR
+
+usage (from the repo root): python benchmarks/bench_game.py --nodes 10 50 100 200 --density 0.5
+'''
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import torch
+
+sys.path.insert(1, os.path.join(os.path.dirname(__file__), '..', 'model'))
+sys.path.insert(1, os.path.join(os.path.dirname(__file__), '..', 'utils'))
+
+from game import Game
+from graphutils import create_random_graph
+
+def scan_simulate_step(game: Game, action: torch.Tensor):
+    # simulate_step as it was before the adjacency index, kept here as the baseline
+    next_state = action[1].item()
+    terminal = next_state in game.visited and next_state == game.start_node
+    edge_idx = (game.graph.edge_index.t() == action).all(dim=1)
+    reward = game.graph.edge_attr[edge_idx].item() if edge_idx.any() else 0
+    return next_state, reward, terminal
+
+def scan_step(game: Game, action: torch.Tensor):
+    # step as it was before the adjacency index, kept here as the baseline
+    if not (game.graph.edge_index.t() == action).all(dim=1).any().item():
+        raise ValueError(f"Invalid action {action}")
+    game.current_node = action[1].item()
+    if game.current_node in game.visited:
+        game.is_terminal = True
+    game.graph.x[game.current_node] = 1.
+    game.visited.add(game.current_node)
+    reward = game.graph.edge_attr[(game.graph.edge_index.t() == action).all(dim=1)].item()
+    return game.current_node, reward, game.is_terminal
+
+def walk(step, game: Game, n_steps: int):
+    """Random walks along legal edges, restarting from a fresh game whenever one terminates"""
+    scratch = game.clone()
+    done = 0
+    start = time.perf_counter()
+    while done < n_steps:
+        targets, _ = scratch.index.neighbours(scratch.current_node)
+        if scratch.is_terminal or not len(targets):
+            scratch = game.clone()
+            continue
+        step(scratch, torch.tensor([scratch.current_node, int(np.random.choice(targets))]))
+        done += 1
+    return n_steps/(time.perf_counter() - start)
+
+def simulate(simulate_step, game: Game, n_steps: int):
+    """simulate_step over every possible action from the start node, as an MCTS expansion would"""
+    actions = game.get_total_action_space()
+    done = 0
+    start = time.perf_counter()
+    while done < n_steps:
+        for action in actions:
+            simulate_step(game, action)
+        done += len(actions)
+    return done/(time.perf_counter() - start)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--nodes', type=int, nargs='+', default=[10, 50, 100, 200])
+    parser.add_argument('--density', type=float, default=0.5, help='fraction of the n(n-1) possible edges')
+    parser.add_argument('--steps', type=int, default=2000)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    print(f"{'nodes':>6} {'edges':>7} | {'step/s scan':>12} {'step/s csr':>12} {'x':>6} | {'sim/s scan':>12} {'sim/s csr':>12} {'x':>6}")
+    for n in args.nodes:
+        np.random.seed(args.seed)
+        torch.manual_seed(args.seed)
+        n_edges = max(n, int(args.density*n*(n - 1)))
+        game = Game(create_random_graph(n, n_edges), 0)
+
+        step_scan = walk(scan_step, game, args.steps)
+        step_csr = walk(Game.step, game, args.steps)
+        sim_scan = simulate(scan_simulate_step, game, args.steps)
+        sim_csr = simulate(Game.simulate_step, game, args.steps)
+        print(f"{n:>6} {n_edges:>7} | {step_scan:>12.0f} {step_csr:>12.0f} {step_csr/step_scan:>6.1f} | {sim_scan:>12.0f} {sim_csr:>12.0f} {sim_csr/sim_scan:>6.1f}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+'''
+bench_ingest - /process-graph body to solver tensors, the old per-link Python loops against the vectorized ingest path
+
+usage (from the repo root): python benchmarks/bench_ingest.py --pairs 5000
+'''
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+import numpy as np
+import torch
+from torch_geometric.data import Data
+
+sys.path.insert(1, os.path.join(os.path.dirname(__file__), '..', 'api'))
+
+import ingest
+from sessions import MarketSession
+
+def market_body(n_pairs: int, seed: int) -> bytes:
+    """JSON body as the UI posts it: [links, nodes] with node objects as link endpoints"""
+    rng = random.Random(seed)
+    n_nodes = int(np.ceil(np.sqrt(2*n_pairs))) + 1
+    pairs = rng.sample([(u, v) for u in range(1, n_nodes + 1) for v in range(u + 1, n_nodes + 1)], n_pairs)
+    nodes = [{"id": i, "label": f"C{i}"} for i in range(1, n_nodes + 1)]
+    links = [{"source": {"id": u, "label": f"C{u}", "index": u - 1}, "target": {"id": v, "label": f"C{v}", "index": v - 1},
+              "weight": str(rng.uniform(0.01, 100))} for u, v in pairs]
+    return json.dumps([links, nodes]).encode()
+
+def legacy_ingest(body: bytes):
+    # process_data's parsing as it was before the ingest module, kept here as the baseline
+    graph_data = json.loads(body)
+    tensor_arr = [[], []]
+    edge_weights = []
+    ea = []
+    for link in graph_data[0]:
+        tensor_arr[0].append(int(link['source']['id'])-1)
+        tensor_arr[1].append(int(link['target']['id'])-1)
+        edge_weights.append(random.uniform(-1, 1))
+        ea.append([float(link['weight'])])
+    for link in graph_data[0]:
+        tensor_arr[0].append(int(link['target']['id'])-1)
+        tensor_arr[1].append(int(link['source']['id'])-1)
+        edge_weights.append(random.uniform(-1, 1))
+        ea.append([1 / (float(link['weight']) + 0.0001)])
+    x_arr = [[0]]*int(len(graph_data[1]))
+
+    edge_index = torch.tensor(tensor_arr, dtype=torch.long)
+    edge_attr = torch.tensor(edge_weights, dtype=torch.float).view(-1, 1)
+    x = torch.tensor(x_arr, dtype=torch.float)
+    ea = torch.tensor(ea)
+    return Data(x, edge_index, edge_attr), -torch.log(ea)
+
+def session_ingest(body: bytes, decode=ingest.loads):
+    session = MarketSession.from_payload(decode(body))
+    return session.model_graph(), session.market_graph()
+
+def timed(f, *args, repeat: int = 20):
+    f(*args)
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        f(*args)
+        times.append(1000*(time.perf_counter() - start))
+    return np.median(times)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--pairs', type=int, nargs='+', default=[5000])
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    print(f"{'pairs':>6} {'body KB':>8} | {'decode json':>12} {'decode orjson':>14} | {'legacy ms':>10} {'ingest ms':>10} {'ingest+orjson ms':>17}")
+    for n_pairs in args.pairs:
+        body = market_body(n_pairs, args.seed)
+        decode_json = timed(json.loads, body, repeat=args.repeat)
+        decode_orjson = timed(ingest.orjson.loads, body, repeat=args.repeat) if ingest.orjson else float('nan')
+        legacy = timed(legacy_ingest, body, repeat=args.repeat)
+        vectorized = timed(session_ingest, body, json.loads, repeat=args.repeat)
+        vectorized_orjson = timed(session_ingest, body, repeat=args.repeat) if ingest.orjson else float('nan')
+        print(f"{n_pairs:>6} {len(body)/1024:>8.0f} | {decode_json:>12.2f} {decode_orjson:>14.2f} | {legacy:>10.2f} {vectorized:>10.2f} {vectorized_orjson:>17.2f}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+'''
+bench_mcts_batch - MCTS simulations per second as the leaf batch size K (MCTSConfig.batch_size) varies
+
+usage (from the repo root): python benchmarks/bench_mcts_batch.py --nodes 20 60 100 --batch-sizes 1 4 16 64
+'''
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import torch
+
+sys.path.insert(1, os.path.join(os.path.dirname(__file__), '..', 'model'))
+sys.path.insert(1, os.path.join(os.path.dirname(__file__), '..', 'utils'))
+
+from game import Game
+from model import GCN
+from mcts import MCTSConfig, mcts
+from engine import GCNEngine
+from graphutils import create_random_graph
+
+class CountingNetwork:
+    """Wraps a network (GCN or GCNEngine) to count forward passes and evaluated leaves"""
+    def __init__(self, network):
+        self.network = network
+        self.calls = 0
+        self.leaves = 0
+
+    def __call__(self, data, *args):
+        self.calls += 1
+        self.leaves += data.shape[0] if isinstance(data, torch.Tensor) else 1
+        return self.network(data, *args)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--nodes', type=int, nargs='+', default=[20, 60, 100])
+    parser.add_argument('--density', type=float, default=0.3, help='fraction of the n(n-1) possible edges')
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 4, 16, 64])
+    parser.add_argument('--c-iter', type=int, default=10)
+    parser.add_argument('--virtual-loss', type=int, default=3)
+    parser.add_argument('--no-precompute', action='store_true', help='evaluate with the plain GCN instead of a GCNEngine')
+    parser.add_argument('--no-transpositions', action='store_true', help='no cache of network evaluations by game state')
+    parser.add_argument('--share-stats', action='store_true', help='merge the tree nodes of transposed states')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    torch.set_num_threads(1)
+
+    print(f"{'nodes':>6} {'edges':>7} {'K':>4} | {'sims':>6} {'sims/s':>8} {'net calls':>10} {'leaves/call':>12} {'tree nodes':>11} {'tt hits':>8}")
+    for n in args.nodes:
+        np.random.seed(args.seed)
+        torch.manual_seed(args.seed)
+        n_edges = max(n, int(args.density*n*(n - 1)))
+        graph = create_random_graph(n, n_edges)
+        model = GCN(1, 1)
+
+        for k in args.batch_sizes:
+            config = MCTSConfig(args.c_iter, logging=False, batch_size=k, virtual_loss=args.virtual_loss,
+                                transpositions=not args.no_transpositions, share_stats=args.share_stats)
+            game = Game(graph.clone(), 0)
+            n_simulations = config.c_iter*game.get_n_actions()
+
+            # built here rather than inside mcts so its calls can be counted, includes the setup cost all the same
+            start = time.perf_counter()
+            network = CountingNetwork(model if args.no_precompute else GCNEngine(model, game.graph))
+            _, tree = mcts(config, game, network, return_tree=True)
+            elapsed = time.perf_counter() - start
+
+            per_call = network.leaves/max(network.calls, 1)
+            hits = tree.table.hits if tree.table is not None else 0
+            print(f"{n:>6} {n_edges:>7} {k:>4} | {n_simulations:>6} {n_simulations/elapsed:>8.1f} {network.calls:>10} {per_call:>12.1f} {len(tree):>11} {hits:>8}")
+
+if __name__ == '__main__':
+    main()
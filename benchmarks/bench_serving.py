@@ -0,0 +1,76 @@
+'''
+bench_serving - /process-graph throughput and latency of the model fallback against the number of concurrent clients,
+with and without the backend's micro-batching
+
+Requests go through Flask's test client from one thread per client, so only the server side is measured.
+
+usage (from the repo root): python benchmarks/bench_serving.py --model api/model_b3.pth --clients 1 2 4 8
+'''
+
+import argparse
+import os
+import random
+import sys
+import threading
+import time
+
+import numpy as np
+
+def market(n_nodes: int, density: float, seed: int):
+    """A /process-graph payload ([links, nodes], as the UI posts it) over n_nodes currencies"""
+    rng = random.Random(seed)
+    nodes = [{"id": i + 1} for i in range(n_nodes)]
+    links = [{"source": {"id": i + 1}, "target": {"id": j + 1}, "weight": rng.uniform(0.5, 2)}
+             for i in range(n_nodes) for j in range(i + 1, n_nodes) if rng.random() < density]
+    return [links, nodes]
+
+def run(client, payload, n_clients: int, n_requests: int):
+    latencies = []
+    def worker():
+        for _ in range(n_requests):
+            start = time.perf_counter()
+            client.post('/process-graph', json=payload)
+            latencies.append(1000*(time.perf_counter() - start))
+
+    threads = [threading.Thread(target=worker) for _ in range(n_clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return len(latencies)/(time.perf_counter() - start), np.percentile(latencies, [50, 99])
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--model', required=True, help='checkpoint for the backend to load')
+    parser.add_argument('--nodes', type=int, default=30)
+    parser.add_argument('--density', type=float, default=0.3)
+    parser.add_argument('--clients', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--requests', type=int, default=8, help='requests per client')
+    args = parser.parse_args()
+
+    os.environ['ARBITRAGE_MODEL'] = os.path.abspath(args.model)
+    sys.path.insert(1, os.path.join(os.path.dirname(__file__), '..', 'api'))
+    sys.path.insert(1, os.path.join(os.path.dirname(__file__), '..', 'model'))
+    import backend
+
+    # the model fallback is what gets batched, skip the Bellman-Ford fast path
+    backend.USE_BELLMAN_FORD = False
+    # every request runs the full step budget, so req/s compares equal amounts of work
+    backend.ROLLOUT.time_budget = None
+    client = backend.app.test_client()
+    payload = market(args.nodes, args.density, seed=0)
+
+    print(f"{'clients':>8} | {'batched req/s':>14} {'p50 ms':>8} {'p99 ms':>8} | {'direct req/s':>13} {'p50 ms':>8} {'p99 ms':>8}")
+    for n_clients in args.clients:
+        results = []
+        for batched in (True, False):
+            backend.MICRO_BATCHING = batched
+            backend.LATENCIES.clear()
+            results.append(run(client, payload, n_clients, args.requests))
+        (b_rps, (b_p50, b_p99)), (d_rps, (d_p50, d_p99)) = results
+        print(f"{n_clients:>8} | {b_rps:>14.1f} {b_p50:>8.1f} {b_p99:>8.1f} | {d_rps:>13.1f} {d_p50:>8.1f} {d_p99:>8.1f}")
+    print(backend.batcher.metrics())
+
+if __name__ == '__main__':
+    main()
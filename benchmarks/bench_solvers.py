@@ -0,0 +1,86 @@
+'''
+bench_solvers - latency and cycle profit of the Bellman-Ford solver against the GCN policy rollout the backend uses
+
+The game's reward for an edge is its edge_attr, so Bellman-Ford is run on costs of -edge_attr and both solvers
+are scored by the summed edge_attr of the cycle they return (the log of the cycle's rate product).
+
+usage (from the repo root): python benchmarks/bench_solvers.py --nodes 50 100 200 500 --model api/model_b3.pth
+'''
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import torch
+
+sys.path.insert(1, os.path.join(os.path.dirname(__file__), '..', 'model'))
+sys.path.insert(1, os.path.join(os.path.dirname(__file__), '..', 'utils'))
+
+from game import Game
+from model import GCN
+from bellman_ford import find_negative_cycle
+from graphutils import create_random_graph
+
+@torch.no_grad()
+def model_rollout(model: GCN, graph, start: int):
+    """Sample moves from the policy until a node repeats, as arbitrage_path does, returns the closing cycle or None"""
+    game = Game(graph.clone(), start)
+    path, reward = [start], [0.]
+    try:
+        while not game.is_terminal:
+            policy, _ = model(game)
+            move = torch.multinomial(policy, 1)
+            _, r, _ = game.step(torch.cat((torch.tensor([game.current_node]), move)))
+            path.append(move.item())
+            reward.append(r)
+    except RuntimeError:
+        # dead end, the policy has no legal move to sample
+        return None
+    first = path.index(path[-1])
+    return path[first:], sum(reward[first + 1:])
+
+def timed(f, *args):
+    start = time.perf_counter()
+    out = f(*args)
+    return out, 1000*(time.perf_counter() - start)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--nodes', type=int, nargs='+', default=[50, 100, 200, 500])
+    parser.add_argument('--density', type=float, default=0.1, help='fraction of the n(n-1) possible edges')
+    parser.add_argument('--graphs', type=int, default=10, help='graphs per size')
+    parser.add_argument('--model', default=None, help='checkpoint to load, a freshly initialized GCN otherwise')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    model = torch.load(args.model, weights_only=False) if args.model else GCN(1, 1)
+    model.eval()
+
+    print(f"{'nodes':>6} {'edges':>7} | {'bf ms':>8} {'bf found':>9} {'bf profit':>10} | {'gcn ms':>8} {'gcn found':>10} {'gcn profit':>11}")
+    for n in args.nodes:
+        np.random.seed(args.seed)
+        torch.manual_seed(args.seed)
+        n_edges = max(n, int(args.density*n*(n - 1)))
+
+        bf_ms, bf_profit, gcn_ms, gcn_profit = [], [], [], []
+        for _ in range(args.graphs):
+            graph = create_random_graph(n, n_edges)
+
+            cycle, ms = timed(find_negative_cycle, graph, -graph.edge_attr)
+            bf_ms.append(ms)
+            if cycle is not None:
+                bf_profit.append(-cycle.cost)
+
+            out, ms = timed(model_rollout, model, graph, np.random.randint(n))
+            gcn_ms.append(ms)
+            if out is not None:
+                gcn_profit.append(out[1])
+
+        mean = lambda xs: np.mean(xs) if xs else float('nan')
+        print(f"{n:>6} {n_edges:>7} | {np.median(bf_ms):>8.2f} {len(bf_profit):>4}/{args.graphs:<4} {mean(bf_profit):>10.3f} | "
+              f"{np.median(gcn_ms):>8.2f} {len(gcn_profit):>5}/{args.graphs:<4} {mean(gcn_profit):>11.3f}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,261 @@
+'''
+bench_suite - reproducible timings of the hot paths over a grid of graph sizes and densities, written to JSON and
+optionally compared against a saved baseline run
+
+Benchmarks (ms per operation):
+    game.step           one step along a random legal edge (a fresh clone is taken whenever a walk terminates)
+    game.simulate_step  one simulated step, over every possible action from the start node
+    game.clone          one Game.clone
+    gcn.forward         one GCN forward pass on the game
+    mcts.select_edge    one select_edge at the root of an MCTSConfig(1) search tree
+    mcts.move           one full mcts() call from the start node (MCTSConfig(--c-iter))
+    train.generate_data one self-play game (graphs of at most --datagen-max-nodes nodes, the game runs 1000
+                        simulations per action)
+    api.process_graph   one /process-graph request through Flask's test client, end to end (needs --model)
+
+Every case reseeds random / NumPy / torch with --seed before building its graph and network, so a case times the
+same work whichever other cases run.  Graphs have round(density*n(n-1)) edges (at least n).
+
+usage (from the repo root):
+    python benchmarks/bench_suite.py --out baseline.json
+    python benchmarks/bench_suite.py --nodes 10 50 --baseline baseline.json --tolerance 0.25
+the comparison exits with status 1 when a benchmark's fastest repetition is more than tolerance slower than in the
+baseline.
+'''
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+
+import numpy as np
+import torch
+
+sys.path.insert(1, os.path.join(os.path.dirname(__file__), '..', 'model'))
+sys.path.insert(1, os.path.join(os.path.dirname(__file__), '..', 'utils'))
+
+from game import Game
+from model import GCN
+from mcts import MCTSConfig, mcts, select_edge
+from train import generate_data
+from graphutils import create_random_graph
+
+BENCHMARKS = ('game.step', 'game.simulate_step', 'game.clone', 'gcn.forward', 'mcts.select_edge', 'mcts.move',
+              'train.generate_data', 'api.process_graph')
+
+def seed_all(seed: int):
+    random.seed(seed)
+    np.random.seed(seed)
+    torch.manual_seed(seed)
+
+def measure(run, repeat: int):
+    """run() does some operations and returns how many, ms per operation over repeat runs (after one warm-up run)"""
+    run()
+    per_op = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        n_ops = run()
+        per_op.append(1000*(time.perf_counter() - start)/n_ops)
+    return {"ms": float(np.median(per_op)), "min_ms": float(np.min(per_op)), "repeat": repeat}
+
+# -- benchmarks: (game, network, args) -> run --
+
+def bench_step(game: Game, network, args, n_steps: int = 200):
+    rng = np.random.default_rng(args.seed)
+    def run():
+        scratch = game.clone()
+        for _ in range(n_steps):
+            targets, _ = scratch.index.neighbours(scratch.current_node)
+            if scratch.is_terminal or not len(targets):
+                scratch = game.clone()
+                targets, _ = scratch.index.neighbours(scratch.current_node)
+            scratch.step(torch.tensor([scratch.current_node, int(targets[rng.integers(len(targets))])]))
+        return n_steps
+    return run
+
+def bench_simulate_step(game: Game, network, args):
+    actions = game.get_total_action_space()
+    def run():
+        for action in actions:
+            game.simulate_step(action)
+        return len(actions)
+    return run
+
+def bench_clone(game: Game, network, args, n_clones: int = 100):
+    def run():
+        for _ in range(n_clones):
+            game.clone()
+        return n_clones
+    return run
+
+def bench_forward(game: Game, network, args):
+    def run():
+        with torch.no_grad():
+            network(game)
+        return 1
+    return run
+
+def bench_select_edge(game: Game, network, args, n_selects: int = 100):
+    config = MCTSConfig(1, logging=False)
+    _, tree = mcts(config, game, network, return_tree=True)
+    def run():
+        for _ in range(n_selects):
+            select_edge(tree, tree.root, config)
+        return n_selects
+    return run
+
+def bench_move(game: Game, network, args):
+    config = MCTSConfig(args.c_iter, logging=False)
+    def run():
+        mcts(config, game, network)
+        return 1
+    return run
+
+def bench_generate_data(game: Game, network, args):
+    if game.graph.num_nodes > args.datagen_max_nodes:
+        return None
+    def run():
+        seed_all(args.seed)
+        with contextlib.redirect_stdout(io.StringIO()):
+            generate_data(network, game.graph.clone())
+        return 1
+    return run
+
+def bench_process_graph(game: Game, network, args):
+    backend = load_backend(args.model)
+    if backend is None:
+        return None
+    # both directions of a pair come from the one link, so every (u < v) pair with an edge either way is a link
+    edges = game.graph.edge_index.t().tolist()
+    rates = np.exp(game.graph.edge_attr.view(-1).numpy()).tolist()
+    pairs = {}
+    for (u, v), rate in zip(edges, rates):
+        pairs.setdefault((min(u, v), max(u, v)), rate if u < v else 1/rate)
+    payload = [[{"source": {"id": u + 1}, "target": {"id": v + 1}, "weight": rate} for (u, v), rate in pairs.items()],
+               [{"id": i + 1} for i in range(game.graph.num_nodes)]]
+    client = backend.app.test_client()
+    def run():
+        seed_all(args.seed)
+        with contextlib.redirect_stdout(io.StringIO()):
+            client.post('/process-graph', json=payload)
+        return 1
+    return run
+
+_backend = None
+
+def load_backend(model_path: str):
+    """The backend module serving model_path (imported once), None without a model"""
+    global _backend
+    if model_path is None:
+        return None
+    if _backend is None:
+        os.environ['ARBITRAGE_MODEL'] = os.path.abspath(model_path)
+        sys.path.insert(1, os.path.join(os.path.dirname(__file__), '..', 'api'))
+        import backend
+        _backend = backend
+    return _backend
+
+RUNNERS = {
+    'game.step': bench_step,
+    'game.simulate_step': bench_simulate_step,
+    'game.clone': bench_clone,
+    'gcn.forward': bench_forward,
+    'mcts.select_edge': bench_select_edge,
+    'mcts.move': bench_move,
+    'train.generate_data': bench_generate_data,
+    'api.process_graph': bench_process_graph,
+}
+
+def run_suite(args):
+    results = []
+    for n in args.nodes:
+        for density in args.density:
+            n_edges = min(max(n, round(density*n*(n - 1))), n*(n - 1))
+            for name in args.only or BENCHMARKS:
+                seed_all(args.seed)
+                game = Game(create_random_graph(n, n_edges), 0)
+                network = GCN(1, 1)
+                network.eval()
+
+                run = RUNNERS[name](game, network, args)
+                if run is None:
+                    continue
+                result = {"name": name, "nodes": n, "density": density, "edges": n_edges}
+                result.update(measure(run, args.repeat))
+                results.append(result)
+                print(f"{name:>20} {n:>5} {density:>6} {n_edges:>7} | {result['ms']:>10.4f} ms {result['min_ms']:>10.4f} min")
+    return results
+
+def key(result: dict) -> str:
+    return f"{result['name']}/n{result['nodes']}/d{result['density']}"
+
+def compare(results, baseline, tolerance: float):
+    """
+    Print every result against its baseline, returns the keys of the regressions
+    - compared on the fastest repetition (min_ms), which is much less sensitive to load on the machine than the median
+    """
+    base = {key(result): result for result in baseline["results"]}
+    regressions = []
+    print(f"\n{'benchmark':>32} | {'baseline min ms':>16} {'min ms':>10} {'ratio':>7}")
+    for result in results:
+        old = base.get(key(result))
+        if old is None:
+            print(f"{key(result):>32} | {'-':>16} {result['min_ms']:>10.4f} {'new':>7}")
+            continue
+        ratio = result['min_ms']/old['min_ms'] if old['min_ms'] > 0 else float('inf')
+        flag = ''
+        if ratio > 1 + tolerance:
+            regressions.append(key(result))
+            flag = '  REGRESSION'
+        print(f"{key(result):>32} | {old['min_ms']:>16.4f} {result['min_ms']:>10.4f} {ratio:>7.2f}{flag}")
+    return regressions
+
+def environment():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {"commit": commit, "python": platform.python_version(), "torch": torch.__version__, "numpy": np.__version__,
+            "platform": platform.platform(), "cpus": os.cpu_count(), "torch_threads": torch.get_num_threads()}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--nodes', type=int, nargs='+', default=[10, 50, 100, 200, 500])
+    parser.add_argument('--density', type=float, nargs='+', default=[0.05, 0.5], help='fractions of the n(n-1) possible edges')
+    parser.add_argument('--only', nargs='+', choices=BENCHMARKS, help='run these benchmarks only')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--c-iter', type=int, default=1, help='MCTSConfig.c_iter of mcts.move')
+    parser.add_argument('--datagen-max-nodes', type=int, default=10)
+    parser.add_argument('--model', help='checkpoint for the backend, api.process_graph is skipped without one')
+    parser.add_argument('--threads', type=int, default=1, help='torch threads')
+    parser.add_argument('--out', help='write the results as JSON')
+    parser.add_argument('--baseline', help='results JSON of an earlier run to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='slowdown (fraction) counted as a regression')
+    args = parser.parse_args()
+
+    torch.set_num_threads(args.threads)
+
+    print(f"{'benchmark':>20} {'nodes':>5} {'dens.':>6} {'edges':>7} | {'median':>13} {'':>14}")
+    results = run_suite(args)
+    report = {"environment": environment(), "config": vars(args), "results": results}
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) over {args.tolerance:.0%}: {', '.join(regressions)}")
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
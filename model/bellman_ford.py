@@ -0,0 +1,123 @@
+'''
+bellman_ford - classical negative-cycle (arbitrage) solver on the same PyG graphs the GCN plays on
+
+With edge costs w(u, v) = -log(rate(u, v)) a cycle is profitable exactly when its total cost is negative, since
+exp(-cost) is the product of the rates along it.  Bellman-Ford from a virtual source connected to every node
+(all distances start at 0) finds such a cycle whenever one exists:
+
+- each round relaxes every out-edge of the nodes improved in the previous round at once (SPFA's frontier, without
+  the queue), as NumPy gather / scatter-min over edge_index
+- the predecessor graph is checked for cycles every few rounds by pointer doubling, any cycle in it has negative
+  cost, so the search usually stops long before the n + 1 rounds plain Bellman-Ford needs to prove one exists
+
+The cycle returned is the cheapest of the ones found in the predecessor graph.  That is a heuristic, finding the
+most negative simple cycle is NP-hard, but every cycle reported is exact (a real cycle with its true cost).
+'''
+
+import math
+
+import numpy as np
+import torch
+from torch_geometric.data import Data
+
+class Cycle:
+    """A negative cycle: nodes as a closed path (first == last), the edge_index columns it uses and its total cost"""
+    def __init__(self, nodes, edges, cost: float):
+        self.nodes = nodes
+        self.edges = edges
+        self.cost = cost
+
+    @property
+    def profit(self) -> float:
+        """Product of the rates along the cycle, for costs of -log(rate)"""
+        return math.exp(-self.cost)
+
+    def __len__(self):
+        return len(self.edges)
+
+    def __repr__(self):
+        return f"Cycle({self.nodes}, cost={self.cost:.6g})"
+
+def rates_to_costs(rates: torch.Tensor) -> torch.Tensor:
+    """-log(rate), the edge costs whose negative cycles are the arbitrage opportunities (rates <= 0 cost +inf)"""
+    return -torch.log(rates.clamp_min(0))
+
+def _pred_cycles(pred_edge: np.ndarray, src: np.ndarray):
+    # cycles of the predecessor graph (node -> src of its predecessor edge) as lists of edge ids
+    n = len(pred_edge)
+
+    # pointer doubling: after >= n steps every node whose chain does not end at the source (n) sits on a cycle
+    parent = np.append(np.where(pred_edge >= 0, src[np.maximum(pred_edge, 0)], n), n)
+    for _ in range(max(int(n).bit_length(), 1)):
+        parent = parent[parent]
+
+    cycles = []
+    seen = np.zeros(n, dtype=bool)
+    for start in np.unique(parent[:n]):
+        if start == n or seen[start]:
+            continue
+        edges, v = [], start
+        while not seen[v]:
+            seen[v] = True
+            edges.append(int(pred_edge[v]))
+            v = int(src[pred_edge[v]])
+        cycles.append(edges[::-1])
+    return cycles
+
+def bellman_ford(edge_index: np.ndarray, cost: np.ndarray, n_nodes: int, max_rounds: int = None, check_every: int = 8,
+                 tol: float = 1e-12):
+    """
+    Vectorized Bellman-Ford from a virtual source at distance 0 to every node
+    Returns (dist, pred_edge, cycles), stopping as soon as the predecessor graph contains a cycle, in which case the
+    distances are meaningless and cycles is a non-empty list of negative cycles (lists of edge ids)
+    :param check_every: rounds between predecessor graph cycle checks
+    :param tol: minimum improvement for a relaxation to count, so float noise on zero-cost cycles cannot loop forever
+    """
+    src, dst = edge_index
+    max_rounds = n_nodes + 1 if max_rounds is None else max_rounds
+
+    dist = np.zeros(n_nodes)
+    pred_edge = np.full(n_nodes, -1, dtype=np.int64)
+    frontier = np.arange(len(src))
+
+    for i in range(1, max_rounds + 1):
+        candidate = dist[src[frontier]] + cost[frontier]
+        best = dist.copy()
+        np.minimum.at(best, dst[frontier], candidate)
+
+        improved = best < dist - tol
+        if not improved.any():
+            return dist, pred_edge, []
+
+        # predecessor of each improved node, one of the frontier edges achieving its new distance
+        tight = frontier[improved[dst[frontier]] & (candidate == best[dst[frontier]])]
+        pred_edge[dst[tight]] = tight
+        dist = np.where(improved, best, dist)
+
+        if i % check_every == 0 or i == max_rounds:
+            cycles = _pred_cycles(pred_edge, src)
+            if cycles:
+                return dist, pred_edge, cycles
+
+        # next round only relaxes the out-edges of the nodes that just improved
+        frontier = np.flatnonzero(improved[src])
+
+    return dist, pred_edge, []
+
+def find_negative_cycle(graph: Data, cost: torch.Tensor = None, **kwargs):
+    """
+    Cheapest negative cycle found in the graph, or None if it has none
+    :param cost: per edge cost, defaults to graph.edge_attr (i.e. already -log(rate))
+    """
+    cost = graph.edge_attr if cost is None else cost
+    edge_index = graph.edge_index.numpy()
+    cost = cost.view(-1).to(torch.float64).numpy()
+
+    _, _, cycles = bellman_ford(edge_index, cost, graph.num_nodes, **kwargs)
+    if not cycles:
+        return None
+
+    costs = [cost[edges].sum() for edges in cycles]
+    edges = cycles[int(np.argmin(costs))]
+    nodes = [int(edge_index[0, e]) for e in edges] + [int(edge_index[0, edges[0]])]
+    return Cycle(nodes, edges, float(min(costs)))
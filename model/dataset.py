@@ -0,0 +1,210 @@
+'''
+dataset - append-only, sharded storage for self-play records
+
+A dataset is a directory of fixed-size shard files plus a small manifest:
+
+    root/
+        manifest.json       {"version": 1, "shard_size": ..., "shards": [{"file": ..., "games": ..., "records": ...}, ...]}
+        shard-00000.pth
+        shard-00001.pth
+        ...
+
+Shards are written once and never touched again, so adding data costs O(new records) and a crash can at most lose
+the shard being written (shards and the manifest are written to a temporary file and renamed into place).
+
+Within a shard every game's graph topology (edge_index, edge_attr) is stored once, and each record only keeps
+(state, action, pi, z') plus the visited bitmap of the graph at that step, packed 8 nodes per byte.  Full Data
+objects are only materialized when a record is read.
+'''
+
+import json
+import os
+
+import numpy as np
+import torch
+from torch_geometric.data import Data
+
+MANIFEST = 'manifest.json'
+
+def _atomic_save(obj, path: str):
+    tmp = path + '.tmp'
+    torch.save(obj, tmp)
+    os.replace(tmp, path)
+
+def _atomic_write_json(obj, path: str):
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(obj, f, indent=2)
+    os.replace(tmp, path)
+
+def _ptr(sizes) -> torch.Tensor:
+    # offsets of consecutive variable sized chunks, len(sizes) + 1 entries
+    ptr = np.zeros(len(sizes) + 1, dtype=np.int64)
+    np.cumsum(sizes, out=ptr[1:])
+    return torch.from_numpy(ptr)
+
+def materialize(graph: Data, visited) -> Data:
+    """Data for one state of a game: the game's shared topology with x set from the state's visited bitmap"""
+    x = torch.as_tensor(np.asarray(visited), dtype=torch.float).view(-1, 1)
+    return Data(x=x, edge_index=graph.edge_index, edge_attr=graph.edge_attr)
+
+class ShardWriter:
+    """Appends self-play games to a sharded dataset directory"""
+    def __init__(self, root: str, shard_size: int = 4096):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+        manifest_path = os.path.join(root, MANIFEST)
+        if os.path.exists(manifest_path):
+            with open(manifest_path) as f:
+                self.manifest = json.load(f)
+        else:
+            self.manifest = {"version": 1, "shard_size": shard_size, "shards": []}
+        self.shard_size = self.manifest["shard_size"]
+
+        self._games = []
+        self._n_records = 0
+
+    def add_game(self, graph: Data, records, visited):
+        """
+        Buffer one game, the buffer is written out as a shard once it holds shard_size records
+        :param graph: the game's graph, only its topology (edge_index, edge_attr) is kept
+        :param records: (s, a, π, z') tuples as returned by generate_data
+        :param visited: the visited bitmap (bool array over nodes) of the state each record was taken in
+        """
+        if len(records) != len(visited):
+            raise ValueError(f"Got {len(records)} records but {len(visited)} visited bitmaps")
+        if not records:
+            return
+
+        self._games.append((graph.edge_index, graph.edge_attr.view(-1), graph.num_nodes, records, visited))
+        self._n_records += len(records)
+        if self._n_records >= self.shard_size:
+            self.flush()
+
+    def flush(self):
+        """Write all buffered games as a new shard (possibly smaller than shard_size) and update the manifest"""
+        if not self._games:
+            return
+
+        n_nodes = [n for _, _, n, _, _ in self._games]
+        n_edges = [edge_index.shape[1] for edge_index, _, _, _, _ in self._games]
+
+        game, state, action, z, pi, bitmaps, pi_sizes, bitmap_sizes = [], [], [], [], [], [], [], []
+        for g, (_, _, n, records, visited) in enumerate(self._games):
+            for (s, a, p, z_prime), v in zip(records, visited):
+                bits = np.packbits(np.asarray(v, dtype=bool))
+                game.append(g)
+                state.append(int(s))
+                action.append(int(a))
+                z.append(float(z_prime))
+                pi.append(torch.as_tensor(p, dtype=torch.float).view(-1))
+                bitmaps.append(bits)
+                pi_sizes.append(n)
+                bitmap_sizes.append(len(bits))
+
+        shard = {
+            # per game
+            "n_nodes": torch.tensor(n_nodes, dtype=torch.long),
+            "edge_ptr": _ptr(n_edges),
+            "edge_index": torch.cat([edge_index for edge_index, _, _, _, _ in self._games], dim=1),
+            "edge_attr": torch.cat([edge_attr for _, edge_attr, _, _, _ in self._games]),
+
+            # per record
+            "game": torch.tensor(game, dtype=torch.long),
+            "state": torch.tensor(state, dtype=torch.long),
+            "action": torch.tensor(action, dtype=torch.long),
+            "z": torch.tensor(z, dtype=torch.float),
+            "pi_ptr": _ptr(pi_sizes),
+            "pi": torch.cat(pi),
+            "visited_ptr": _ptr(bitmap_sizes),
+            "visited": torch.from_numpy(np.concatenate(bitmaps)),
+        }
+
+        name = f"shard-{len(self.manifest['shards']):05d}.pth"
+        _atomic_save(shard, os.path.join(self.root, name))
+
+        self.manifest["shards"].append({"file": name, "games": len(self._games), "records": len(game)})
+        _atomic_write_json(self.manifest, os.path.join(self.root, MANIFEST))
+
+        self._games = []
+        self._n_records = 0
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class ShardReader:
+    """
+    Reads records back out of a sharded dataset, usable directly as a torch Dataset
+    - shards are memory-mapped (mmap=True) so only the records actually touched are paged in
+    - each record is materialized as a PyG Data with x = the visited bitmap, plus state, action, pi and z attributes
+    """
+    def __init__(self, root: str, mmap: bool = True):
+        self.root = root
+        self.mmap = mmap
+        with open(os.path.join(root, MANIFEST)) as f:
+            self.manifest = json.load(f)
+
+        sizes = [shard["records"] for shard in self.manifest["shards"]]
+        self.offsets = np.zeros(len(sizes) + 1, dtype=np.int64)
+        np.cumsum(sizes, out=self.offsets[1:])
+
+        # shards opened so far, memory-mapped ones only cost address space
+        self._shards = {}
+
+    def __len__(self):
+        return int(self.offsets[-1])
+
+    def shard(self, i: int):
+        if i not in self._shards:
+            path = os.path.join(self.root, self.manifest["shards"][i]["file"])
+            self._shards[i] = torch.load(path, mmap=self.mmap, weights_only=True)
+        return self._shards[i]
+
+    def __getitem__(self, idx: int) -> Data:
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError(f"Record {idx} out of range for dataset of {len(self)} records")
+        i = int(np.searchsorted(self.offsets, idx, side='right')) - 1
+        return self.record(self.shard(i), idx - int(self.offsets[i]))
+
+    def __iter__(self):
+        # stream shard by shard
+        for i in range(len(self.manifest["shards"])):
+            shard = self.shard(i)
+            for r in range(shard["game"].shape[0]):
+                yield self.record(shard, r)
+
+    @staticmethod
+    def record(shard, r: int) -> Data:
+        g = int(shard["game"][r])
+        n = int(shard["n_nodes"][g])
+        e0, e1 = int(shard["edge_ptr"][g]), int(shard["edge_ptr"][g + 1])
+        p0, p1 = int(shard["pi_ptr"][r]), int(shard["pi_ptr"][r + 1])
+        b0, b1 = int(shard["visited_ptr"][r]), int(shard["visited_ptr"][r + 1])
+
+        visited = np.unpackbits(shard["visited"][b0:b1].numpy(), count=n)
+        return Data(
+            x=torch.from_numpy(visited).float().view(-1, 1),
+            edge_index=shard["edge_index"][:, e0:e1],
+            edge_attr=shard["edge_attr"][e0:e1].view(-1, 1),
+            state=int(shard["state"][r]),
+            action=int(shard["action"][r]),
+            pi=shard["pi"][p0:p1],
+            z=float(shard["z"][r]),
+        )
+
+def import_legacy_dset(path: str, root: str, shard_size: int = 4096):
+    """Convert an old single-file dataset ({"X": [graphs], "Y": [(s, a, π, z')]}) into shards"""
+    dset = torch.load(path, weights_only=False)
+    with ShardWriter(root, shard_size) as writer:
+        # the old format does not keep game boundaries, so every record is stored with its own graph
+        for G, R in zip(dset["X"], dset["Y"]):
+            writer.add_game(G, [R], [(G.x[:, 0] > 0).numpy()])
@@ -0,0 +1,125 @@
+'''
+engine - GCN inference with the graph-dependent work done once per graph
+
+Within one search (or one self-play game) every GCN evaluation sees the same edge_index and edge_attr, only the
+visited column of x changes.  GCNEngine builds the weighted adjacency once as a sparse CSR matrix A, where
+A[i, j] is the weight of edge j -> i, so each GraphConv layer becomes
+
+    lin_rel(A @ x) + lin_root(x)
+
+i.e. one SpMM per layer.  The first layer's aggregation A @ x is additionally updated incrementally: it is cached
+for a reference state, and for any other state only the out-edges of the nodes whose visited flag differs from
+the reference are touched.
+'''
+
+import warnings
+
+import torch
+import torch.nn.functional as F
+from torch_geometric.data import Data
+
+from game import Game
+from model import GCN
+
+class GCNEngine:
+    """
+    Drop-in replacement for a GCN's forward on one fixed graph (e.g. the network argument of mcts)
+    - accepts a Game on that graph, or a (K, # of nodes, n_features) stack of its states with their current nodes
+    - the wrapped model's weights are used as they are, so later updates to the model are picked up
+    - model can be a GCN or anything with its four GraphConv layers, e.g. an exported inference model
+    """
+    LAYERS = ('conv_in', 'conv_hidden', 'value_conv', 'policy_conv')
+
+    @staticmethod
+    def supports(network) -> bool:
+        """Whether network has GCN's layers (lin_rel and lin_root each), i.e. can be wrapped"""
+        return all(hasattr(getattr(network, name, None), 'lin_rel') and hasattr(getattr(network, name, None), 'lin_root')
+                   for name in GCNEngine.LAYERS)
+
+    def __init__(self, model: GCN, graph: Data):
+        self.model = model
+        self.n_nodes = graph.x.shape[0]
+        self.edge_index = graph.edge_index
+        self.edge_attr = graph.edge_attr
+
+        src, dst = graph.edge_index
+        weight = graph.edge_attr.view(-1).to(torch.float)
+
+        # A[dst, src] = w, duplicate edges are summed like GraphConv's "add" aggregation
+        with warnings.catch_warnings():
+            warnings.filterwarnings('ignore', message='Sparse CSR tensor support is in beta')
+            A = torch.sparse_coo_tensor(torch.stack((dst, src)), weight, (self.n_nodes, self.n_nodes), check_invariants=False)
+            self.A = A.coalesce().to_sparse_csr()
+
+        # out-edges grouped by source, for the incremental first layer
+        order = torch.argsort(src, stable=True)
+        self.out_dst = dst[order]
+        self.out_weight = weight[order]
+        self.out_ptr = torch.zeros(self.n_nodes + 1, dtype=torch.long)
+        self.out_ptr[1:] = torch.cumsum(torch.bincount(src, minlength=self.n_nodes), 0)
+
+        self.set_reference(graph.x)
+
+    def set_reference(self, x: torch.Tensor):
+        """Cache the first layer's aggregation for state x, the closer later states are to it the cheaper they get"""
+        self.x_ref = x.detach().clone()
+        self.agg_ref = self.A @ self.x_ref
+
+    def _aggregate_first(self, x: torch.Tensor):
+        # A @ x for x of shape (K, n, F), returned as (n, K, F)
+        k, n, f = x.shape
+        delta = x - self.x_ref.unsqueeze(0)
+        state, node = delta.abs().sum(-1).nonzero(as_tuple=True)
+
+        # touching the out-edges of every flipped node vs. a full SpMM over all K states
+        degree = self.out_ptr[node + 1] - self.out_ptr[node]
+        if int(degree.sum()) >= k*self.out_dst.numel():
+            return (self.A @ x.permute(1, 0, 2).reshape(n, k*f)).view(n, k, f)
+
+        agg = self.agg_ref.unsqueeze(1).repeat(1, k, 1)
+        edge = torch.repeat_interleave(self.out_ptr[node], degree) + self._ranges(degree)
+        owner = torch.repeat_interleave(torch.arange(len(node)), degree)
+        contribution = self.out_weight[edge].unsqueeze(-1)*delta[state[owner], node[owner]]
+        agg.view(n*k, f).index_add_(0, self.out_dst[edge]*k + state[owner], contribution)
+        return agg
+
+    @staticmethod
+    def _ranges(sizes: torch.Tensor):
+        # concatenation of arange(s) for s in sizes
+        starts = torch.cumsum(sizes, 0) - sizes
+        return torch.arange(int(sizes.sum())) - torch.repeat_interleave(starts, sizes)
+
+    def _layer(self, conv, x: torch.Tensor, agg: torch.Tensor = None):
+        # GraphConv on (n, K, F) features: lin_rel(A @ x) + lin_root(x)
+        n, k, f = x.shape
+        if agg is None:
+            agg = (self.A @ x.reshape(n, k*f)).view(n, k, f)
+        return conv.lin_rel(agg) + conv.lin_root(x)
+
+    def conv(self, x: torch.Tensor):
+        """Same as GCN.conv for a (K, n, F) stack of states, returns raw p and v of shape (K, n)"""
+        model = self.model
+        h = F.relu(self._layer(model.conv_in, x.permute(1, 0, 2), self._aggregate_first(x)))
+        h = F.relu(self._layer(model.conv_hidden, h))
+
+        # both output layers aggregate the same hidden features
+        n, k, f = h.shape
+        agg = (self.A @ h.reshape(n, k*f)).view(n, k, f)
+        p = self._layer(model.policy_conv, h, agg)
+        v = self._layer(model.value_conv, h, agg)
+        return p[..., 0].t(), v[..., 0].t()
+
+    @torch.no_grad
+    def __call__(self, data, edge_index=None, edge_attr=None, current_nodes=None):
+        if isinstance(data, Game):
+            x = data.graph.x.unsqueeze(0)
+            current_nodes = torch.tensor([data.current_node])
+        else:
+            x = data
+
+        p, v = self.conv(x)
+        p, v = GCN.mask_states(p, v, self.edge_index, current_nodes)
+
+        if isinstance(data, Game):
+            return p[0], v[0]
+        return p, v
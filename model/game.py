@@ -7,11 +7,64 @@ from torch_geometric.data import Data
 import networkx as nx
 #import matplotlib.pyplot as plt
 
+class GraphIndex:
+    """
+    Read-only adjacency index over a PyG graph, built once and shared by every Game (and clone) on that graph
+
+    Edges are stored in CSR form sorted by (source, target): the out-edges of node u are
+    col[row_ptr[u]:row_ptr[u+1]] with weights weight[row_ptr[u]:row_ptr[u+1]].  Single edge lookups go through a
+    dense n x n table of CSR positions on small graphs, or a binary search over the sorted edge keys u*n + v otherwise.
+    """
+    # largest n*n lookup table we are willing to allocate per graph (int32, so 4MB, graphs of up to 1024 nodes)
+    DENSE_LIMIT = 1024*1024
+
+    def __init__(self, graph: Data):
+        self.n_nodes = graph.x.shape[0]
+        src, dst = graph.edge_index.numpy()
+        weight = graph.edge_attr.view(-1).numpy()
+
+        order = np.lexsort((dst, src))
+        self.col = dst[order]
+        self.weight = weight[order]
+        self.edge_id = order # CSR position -> column of the original edge_index
+        self.row_ptr = np.zeros(self.n_nodes + 1, dtype=np.int64)
+        np.cumsum(np.bincount(src, minlength=self.n_nodes), out=self.row_ptr[1:])
+
+        if self.n_nodes*self.n_nodes <= self.DENSE_LIMIT:
+            self.lookup = np.full((self.n_nodes, self.n_nodes), -1, dtype=np.int32)
+            self.lookup[src[order], self.col] = np.arange(len(order), dtype=np.int32)
+            self.keys = None
+        else:
+            # CSR order is (source, target) order, so the keys come out sorted
+            self.lookup = None
+            self.keys = src[order].astype(np.int64)*self.n_nodes + self.col
+
+    def find(self, u: int, v: int) -> int:
+        """CSR position of the edge u -> v, or -1 if it does not exist"""
+        if not (0 <= u < self.n_nodes and 0 <= v < self.n_nodes):
+            return -1
+        if self.lookup is not None:
+            return int(self.lookup[u, v])
+        key = u*self.n_nodes + v
+        pos = int(self.keys.searchsorted(key))
+        return pos if pos < len(self.keys) and self.keys[pos] == key else -1
+
+    def neighbours(self, u: int):
+        """Targets (ascending) and weights of every out-edge of u"""
+        lo, hi = self.row_ptr[u], self.row_ptr[u + 1]
+        return self.col[lo:hi], self.weight[lo:hi]
+
+    def out_degree(self, u: int) -> int:
+        return int(self.row_ptr[u + 1] - self.row_ptr[u])
+
 class Game:
     """ Game object (named as conventionally MCTS interacts with games) wraps and manages our rl environment """
-    def __init__(self, graph: Data, state: int=-1):
+    def __init__(self, graph: Data, state: int=-1, index: GraphIndex=None):
         self.graph: Data = graph
 
+        # adjacency index for O(1) edge lookups, pass one in to share it between games on the same graph
+        self.index: GraphIndex = index if index is not None else GraphIndex(graph)
+
         if state == -1:
             # HACK: for now, let's start the state as a (uniform) random node
             # - In reality, this is a (potentially very) bad idea
@@ -34,8 +87,9 @@ class Game:
 
     def get_action_space(self):
         # Return all outward edges from the current node as action space
-        edges_from_current = self.graph.edge_index[0] == self.current_node
-        return self.graph.edge_index[:, edges_from_current]
+        targets, _ = self.index.neighbours(self.current_node)
+        targets = torch.from_numpy(targets)
+        return torch.stack((torch.full_like(targets, self.current_node), targets))
     
     def get_total_action_space(self):
         # Returns all possible nodes
@@ -44,8 +98,8 @@ class Game:
 
     def step(self, action: torch.Tensor):
         # Move along the edge if it's a valid action
-        exists = (self.graph.edge_index.t() == action).all(dim=1).any().item()
-        if exists:
+        pos = self.index.find(int(action[0]), int(action[1]))
+        if pos != -1:
             self.current_node = action[1].item()
             
             # Update visited nodes and check for terminal state
@@ -57,13 +111,7 @@ class Game:
             self.visited.add(self.current_node)
 
             # Reward is the weight of the edge
-            edge_idx = (self.graph.edge_index.t() == action).all(dim=1)
-
-            # print(f"Action: {action}")
-            # print(f"Edge Index: {edge_idx}")
-            # print(f"Edge Attr: {self.graph.edge_attr}")
-
-            reward = self.graph.edge_attr[edge_idx].item()
+            reward = self.index.weight[pos].item()
             return self.get_state(), reward, self.is_terminal
         else:
             raise ValueError(f''' 
@@ -80,9 +128,9 @@ class Game:
             terminal = True
 
         # Reward is the weight of the edge
-        edge_idx: torch.Tensor = (self.graph.edge_index.t() == action).all(dim=1)
-        if edge_idx.any():
-            reward = self.graph.edge_attr[edge_idx].item()
+        pos = self.index.find(int(action[0]), next_state)
+        if pos != -1:
+            reward = self.index.weight[pos].item()
         else:
             reward = 0 # HACK: used to be -inf but that causes errors...
         return next_state, reward, terminal
@@ -92,19 +140,18 @@ class Game:
         return self.is_terminal
 
     def get_reward(self, edge: torch.Tensor):
-        # Find the index of the edge in the edge_index tensor
-        edge_idx: torch.Tensor = (self.graph.edge_index.t() == edge).all(dim=1).nonzero(as_tuple=True)[0]
-        if edge_idx.nelement() == 0:
+        # Find the edge in the adjacency index
+        pos = self.index.find(int(edge[0]), int(edge[1]))
+        if pos == -1:
             raise ValueError("Edge not found in graph")
 
         # Return the weight of the edge
-        return self.graph.edge_attr[edge_idx].item()
+        return self.index.weight[pos].item()
 
     def render(self):
         # Convert PyG graph to NetworkX for visualization
         G = nx.DiGraph()
-        for source, target in self.graph.edge_index.t().tolist():
-            weight = self.graph.edge_attr[(self.graph.edge_index.t() == torch.tensor([source, target])).all(dim=1)].item()
+        for source, target, weight in zip(self.graph.edge_index[0].tolist(), self.graph.edge_index[1].tolist(), self.graph.edge_attr.view(-1).tolist()):
             G.add_edge(source, target, weight=weight)
 
         pos = nx.spring_layout(G)  # Positioning of nodes
@@ -114,8 +161,27 @@ class Game:
         plt.show()
     
     def get_n_actions(self):
+        # NOTE: the length of the (2, # of out-edges) action space, i.e. always 2, the mcts budgets
+        # (c_iter*get_n_actions() simulations) are set with that in mind; get_out_degree counts the legal moves
         return len(self.get_action_space())
 
+    def get_out_degree(self):
+        # Number of outward edges (legal moves) from the current node, 0 at a dead end
+        return self.index.out_degree(self.current_node)
+
     def clone(self):
-        return copy.deepcopy(self)
+        """
+        Copy of the game that shares the (immutable) graph topology
+        - edge_index, edge_attr and the adjacency index are never modified by a game, so only x (the visited flags),
+          the visited set and the current node are copied, making a clone O(n) instead of a deep copy of the graph
+        """
+        game = Game.__new__(Game)
+        game.graph = copy.copy(self.graph)
+        game.graph.x = self.graph.x.clone()
+        game.index = self.index
+        game.start_node = self.start_node
+        game.current_node = self.current_node
+        game.visited = set(self.visited)
+        game.is_terminal = self.is_terminal
+        return game
     
\ No newline at end of file
@@ -0,0 +1,232 @@
+'''
+inference - the GCN for inference only, in plain torch, and its exported artifacts
+
+InferenceGCN computes what GCN does (three GraphConv layers, then the legal-move mask, the softmax over legal moves
+and the masked value) with plain torch ops, so it needs neither torch_geometric nor this repo's model / game modules,
+and it can be compiled with TorchScript.  Its layers have GCN's names and parameters, a GCN state dict loads as is
+and GCNEngine can wrap either.
+
+Two artifact formats, written by export and read by load_model:
+    script       TorchScript module, torch.jit.load needs no Python source at all
+    state_dict   {"format": "arbitrage-gcn", "state_dict": ...}, read with torch.load(weights_only=True) into an
+                 InferenceGCN, so loading never unpickles code
+
+load_model also accepts a bare GCN state dict (torch.save(model.state_dict())) and the pickled GCN checkpoints
+torch.save(model) writes (which need model/ importable).
+
+usage (from the repo root):
+    python model/inference.py api/model_b3.pth --out api/model_b3.ts
+    python model/inference.py api/model_b3.pth --out api/model_b3.sd --format state_dict --benchmark
+'''
+
+import argparse
+import os
+import subprocess
+import sys
+import time
+import zipfile
+
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+FORMAT = 'arbitrage-gcn'
+
+class GraphConvLayer(nn.Module):
+    """torch_geometric's GraphConv with sum aggregation, lin_rel(A @ x) + lin_root(x) for A[dst, src] the edge weights"""
+    def __init__(self, in_channels: int, out_channels: int):
+        super().__init__()
+        self.lin_rel = nn.Linear(in_channels, out_channels)
+        self.lin_root = nn.Linear(in_channels, out_channels, bias=False)
+
+    def forward(self, x: torch.Tensor, A: torch.Tensor) -> torch.Tensor:
+        # x is (K, # of nodes, F), A is (# of nodes, # of nodes)
+        return self.lin_rel(torch.matmul(A, x)) + self.lin_root(x)
+
+class InferenceGCN(nn.Module):
+    def __init__(self, n_features: int, output_size: int, hidden_size: int = 32):
+        super().__init__()
+        self.n_features = n_features
+        self.output_size = output_size
+        self.hidden_size = hidden_size
+
+        self.conv_in = GraphConvLayer(n_features, hidden_size)
+        self.conv_hidden = GraphConvLayer(hidden_size, hidden_size)
+        self.value_conv = GraphConvLayer(hidden_size, output_size)
+        self.policy_conv = GraphConvLayer(hidden_size, output_size)
+
+    def forward(self, x: torch.Tensor, edge_index: torch.Tensor, edge_attr: torch.Tensor, current_nodes: torch.Tensor):
+        """
+        Masked policy and value of K states of one graph, as GCNEngine returns them
+        :param x: (K, # of nodes, n_features) stack of states
+        :param current_nodes: (K,) current node of each state
+        :return: p, v of shape (K, # of nodes), p a softmax over each state's legal moves, both 0 elsewhere
+        """
+        src, dst = edge_index[0], edge_index[1]
+        n = x.shape[1]
+
+        # dense weighted adjacency, duplicate edges summed, the market graphs are small enough that one matmul per
+        # layer beats gathering every edge's features
+        A = torch.zeros(n*n, dtype=x.dtype, device=x.device)
+        A = A.index_add_(0, dst*n + src, edge_attr.view(-1).to(x.dtype)).view(n, n)
+
+        h = F.relu(self.conv_in(x, A))
+        h = F.relu(self.conv_hidden(h, A))
+        p = self.policy_conv(h, A)[..., 0]
+        v = self.value_conv(h, A)[..., 0]
+
+        # legal moves: the targets of the edges leaving each state's current node
+        hits = (src.unsqueeze(0) == current_nodes.view(-1, 1)).nonzero()
+        legal = torch.zeros(p.shape, dtype=torch.bool, device=p.device)
+        legal[hits[:, 0], dst[hits[:, 1]]] = True
+
+        # states without legal moves get all zeros instead of the nans of a softmax over nothing
+        p = torch.softmax(p.masked_fill(~legal, float('-inf')), dim=-1)
+        p = torch.where(legal, p, torch.zeros_like(p))
+        return p, v*legal
+
+    @classmethod
+    def from_state_dict(cls, state_dict: dict):
+        hidden_size, n_features = state_dict['conv_in.lin_rel.weight'].shape
+        model = cls(n_features, state_dict['value_conv.lin_rel.weight'].shape[0], hidden_size)
+        model.load_state_dict(state_dict)
+        return model.eval()
+
+def export(model: nn.Module, path: str, format: str = 'script'):
+    """Write a GCN's (or InferenceGCN's) weights as an inference artifact, see the module docstring"""
+    model = InferenceGCN.from_state_dict({name: tensor.detach().cpu() for name, tensor in model.state_dict().items()})
+    tmp = path + '.tmp'
+    if format == 'script':
+        torch.jit.save(torch.jit.script(model), tmp)
+    elif format == 'state_dict':
+        torch.save({"format": FORMAT, "state_dict": model.state_dict()}, tmp)
+    else:
+        raise ValueError(f"unknown format {format}, expected 'script' or 'state_dict'")
+    os.replace(tmp, path)
+
+def load_model(path: str):
+    """Model for inference from an artifact of either format, or from a pickled GCN checkpoint, in eval mode"""
+    with open(path, 'rb') as f:
+        is_zip = zipfile.is_zipfile(f)
+    if is_zip:
+        with zipfile.ZipFile(path) as archive:
+            scripted = any(name.endswith('/constants.pkl') or name == 'constants.pkl' for name in archive.namelist())
+        if scripted:
+            return torch.jit.load(path, map_location='cpu').eval()
+
+    try:
+        checkpoint = torch.load(path, map_location='cpu', weights_only=True)
+    except Exception:
+        # a pickled GCN, unpickling it imports model.py
+        checkpoint = torch.load(path, map_location='cpu', weights_only=False)
+    if isinstance(checkpoint, dict) and checkpoint.get('format') == FORMAT:
+        return InferenceGCN.from_state_dict(checkpoint['state_dict'])
+    if isinstance(checkpoint, dict) and 'conv_in.lin_rel.weight' in checkpoint:
+        # a bare GCN state dict, torch.save(model.state_dict())
+        return InferenceGCN.from_state_dict(checkpoint)
+    if not isinstance(checkpoint, nn.Module):
+        raise ValueError(f"{path} is not a model: expected a TorchScript or state_dict artifact, a GCN state dict or "
+                         f"a pickled GCN, got a {type(checkpoint).__name__}")
+    return checkpoint.eval()
+
+# -- before / after measurements --
+
+_COLD_START = '''
+import sys, time
+start = time.perf_counter()
+import torch
+sys.path.insert(0, {model_dir!r})
+{load}
+x, edge_index, edge_attr, current = torch.load({inputs!r})
+with torch.no_grad():
+    {forward}
+print(time.perf_counter() - start)
+'''
+
+def cold_start(path: str, inputs: str, via: str) -> float:
+    """Seconds for a fresh interpreter to import torch, load path and run one forward of the saved inputs"""
+    forward = "model(x, edge_index, edge_attr, current)"
+    if via == 'pickle':
+        # the pickled GCN takes one state at a time, its stacked forward goes through a GCNEngine as in mcts
+        load = (f"model = torch.load({path!r}, weights_only=False).eval()\n"
+                "from engine import GCNEngine\nfrom torch_geometric.data import Data")
+        forward = "GCNEngine(model, Data(x=x[0], edge_index=edge_index, edge_attr=edge_attr))(x, edge_index, edge_attr, current)"
+    elif via == 'script':
+        load = f"model = torch.jit.load({path!r}).eval()"
+    else:
+        load = f"from inference import load_model\nmodel = load_model({path!r})"
+    code = _COLD_START.format(model_dir=os.path.dirname(os.path.abspath(__file__)), load=load, inputs=inputs, forward=forward)
+    result = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True)
+    return float(result.stdout.strip().splitlines()[-1])
+
+def latency(model, inputs, repeat: int = 20) -> float:
+    """Median ms per call"""
+    times = []
+    with torch.no_grad():
+        model(*inputs)
+        for _ in range(repeat):
+            start = time.perf_counter()
+            model(*inputs)
+            times.append(1000*(time.perf_counter() - start))
+    return sorted(times)[len(times)//2]
+
+def benchmark(checkpoint: str, artifact: str, n_nodes: int = 100, density: float = 0.3, k: int = 16):
+    from engine import GCNEngine
+    from torch_geometric.data import Data
+
+    gen = torch.Generator().manual_seed(0)
+    edge_index = torch.randint(n_nodes, (2, int(density*n_nodes*(n_nodes - 1))), generator=gen)
+    edge_index = edge_index[:, edge_index[0] != edge_index[1]]
+    edge_attr = torch.rand(edge_index.shape[1], 1, generator=gen)*2 - 1
+    x = (torch.rand(k, n_nodes, 1, generator=gen) < 0.2).float()
+    current = torch.randint(n_nodes, (k,), generator=gen)
+    inputs = (x, edge_index, edge_attr, current)
+    inputs_path = artifact + '.inputs.pt'
+    torch.save(inputs, inputs_path)
+
+    try:
+        gcn = torch.load(checkpoint, weights_only=False).eval()
+        exported = load_model(artifact)
+        graph = Data(x=x[0], edge_index=edge_index, edge_attr=edge_attr)
+        with torch.no_grad():
+            p_ref, v_ref = GCNEngine(gcn, graph)(*inputs)
+            p, v = exported(*inputs)
+        print(f"max |p - p_gcn| {float((p - p_ref).abs().max()):.2e}, max |v - v_gcn| {float((v - v_ref).abs().max()):.2e}")
+
+        via = 'script' if isinstance(exported, torch.jit.ScriptModule) else 'state_dict'
+        print(f"cold start (import torch, load, first forward): pickled GCN {cold_start(checkpoint, inputs_path, 'pickle'):.2f}s, "
+              f"{via} artifact {cold_start(artifact, inputs_path, via):.2f}s")
+
+        # per-call latency, K states of one graph
+        gcn_flat = lambda x, edge_index, edge_attr, current: [gcn(x[i], edge_index, edge_attr, current[i:i + 1]) for i in range(len(x))]
+        rows = [("GCN, eager PyG, one call per state", latency(gcn_flat, inputs)),
+                ("GCN through GCNEngine", latency(GCNEngine(gcn, graph), inputs)),
+                (f"{via} artifact", latency(exported, inputs)),
+                (f"{via} artifact through GCNEngine", latency(GCNEngine(exported, graph), inputs))]
+        print(f"per call, {n_nodes} nodes, {edge_index.shape[1]} edges, K={k}:")
+        for name, ms in rows:
+            print(f"    {name:>40}: {ms:.2f}ms")
+    finally:
+        os.remove(inputs_path)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('checkpoint', help='pickled GCN (torch.save(model)) or a GCN state dict')
+    parser.add_argument('--out', required=True)
+    parser.add_argument('--format', choices=['script', 'state_dict'], default='script')
+    parser.add_argument('--benchmark', action='store_true', help='compare outputs, cold start and latency with the checkpoint')
+    parser.add_argument('--nodes', type=int, default=100)
+    parser.add_argument('--k', type=int, default=16)
+    args = parser.parse_args()
+
+    checkpoint = torch.load(args.checkpoint, map_location='cpu', weights_only=False)
+    if isinstance(checkpoint, dict):
+        checkpoint = InferenceGCN.from_state_dict(checkpoint)
+    export(checkpoint, args.out, args.format)
+    print(f"wrote {args.format} artifact {args.out}")
+
+    if args.benchmark:
+        benchmark(args.checkpoint, args.out, n_nodes=args.nodes, k=args.k)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,178 @@
+'''
+instrument - what a search spends its time on
+
+A SearchStats passed to mcts(..., stats=stats) is filled in as the search runs: wall time per phase (setup of the
+tree / GCNEngine, select, expand, evaluate i.e. the network calls, backup), simulations, network calls and the leaves they evaluated, tree size and
+the deepest search path.  Searches without one only pay an `is not None` check per phase.  One SearchStats can be
+passed to several searches (e.g. every move of a game) to accumulate over them.
+
+profile_search runs one search under cProfile or torch.profiler on top of that.
+
+usage (from the repo root):
+    python model/instrument.py --nodes 10 50 100 --json stats.json --trace trace.json
+    python model/instrument.py --nodes 100 --profile cprofile
+'''
+
+import argparse
+import cProfile
+import io
+import json
+import os
+import pstats
+import sys
+import time
+
+import torch
+
+class SearchStats:
+    """
+    Counters of one or more searches
+    :param trace: also keep one event per phase lap, for to_chrome_trace (costs memory proportional to the search)
+    """
+    PHASES = ('setup', 'select', 'expand', 'evaluate', 'backup')
+
+    def __init__(self, trace: bool = False):
+        self.trace = trace
+        self.origin = time.perf_counter()
+        self.events = []
+
+        self.phase_seconds = dict.fromkeys(self.PHASES, 0.)
+        self.phase_laps = dict.fromkeys(self.PHASES, 0)
+        self.searches = 0
+        self.seconds = 0.
+        self.simulations = 0
+        self.network_calls = 0
+        self.leaves_evaluated = 0
+        self.tree_nodes = 0
+        self.tree_edges = 0
+        self.max_depth = 0
+        self.table_hits = 0
+        self.table_misses = 0
+        self.stop_reasons = {} # reason -> searches stopped for it, see mcts.stop_reason
+
+    def lap(self, phase: str, start: float) -> float:
+        """Count the time since start towards phase, returns now (the start of the next lap)"""
+        now = time.perf_counter()
+        self.phase_seconds[phase] += now - start
+        self.phase_laps[phase] += 1
+        if self.trace:
+            self.events.append((phase, start, now))
+        return now
+
+    def end_search(self, start: float, tree):
+        self.searches += 1
+        self.seconds += time.perf_counter() - start
+        self.tree_nodes = len(tree)
+        self.tree_edges = tree.n_edges_total
+        if tree.table is not None:
+            self.table_hits, self.table_misses = tree.table.hits, tree.table.misses
+        if tree.stop_reason is not None:
+            self.stop_reasons[tree.stop_reason] = self.stop_reasons.get(tree.stop_reason, 0) + 1
+        if self.trace:
+            self.events.append(('search', start, time.perf_counter()))
+
+    def to_dict(self) -> dict:
+        return {
+            "searches": self.searches,
+            "seconds": self.seconds,
+            "simulations": self.simulations,
+            "simulations_per_second": self.simulations/self.seconds if self.seconds > 0 else 0.,
+            "phases": {phase: {"seconds": self.phase_seconds[phase], "laps": self.phase_laps[phase]} for phase in self.PHASES},
+            "network_calls": self.network_calls,
+            "leaves_evaluated": self.leaves_evaluated,
+            "tree_nodes": self.tree_nodes,
+            "tree_edges": self.tree_edges,
+            "max_depth": self.max_depth,
+            "table": {"hits": self.table_hits, "misses": self.table_misses},
+            "stop_reasons": self.stop_reasons,
+        }
+
+    def to_json(self, path: str):
+        with open(path, 'w') as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+    def to_chrome_trace(self, path: str):
+        """Write the traced laps in the Chrome trace event format (chrome://tracing, Perfetto)"""
+        events = [{"name": name, "ph": "X", "pid": os.getpid(), "tid": 0,
+                   "ts": 1e6*(start - self.origin), "dur": 1e6*(end - start)} for name, start, end in self.events]
+        with open(path, 'w') as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+
+    def __repr__(self):
+        total = sum(self.phase_seconds.values()) or 1.
+        phases = ', '.join(f"{phase} {100*self.phase_seconds[phase]/total:.0f}%" for phase in self.PHASES)
+        return (f"SearchStats({self.simulations} simulations in {self.seconds*1000:.1f}ms, "
+                f"{self.simulations/max(self.seconds, 1e-9):.0f}/s, {self.network_calls} network calls, "
+                f"{self.tree_nodes} nodes, depth {self.max_depth}; {phases})")
+
+def profile_search(config, game, network, profiler: str = 'cprofile', sort: str = 'cumulative', limit: int = 25,
+                   trace_path: str = None):
+    """
+    One mcts() search under a profiler, returns (policy, SearchStats, report)
+    :param profiler: 'cprofile' (Python functions) or 'torch' (torch.profiler, operators)
+    :param trace_path: torch only, also export the profiler's Chrome trace
+    """
+    from mcts import mcts
+
+    stats = SearchStats()
+    if profiler == 'cprofile':
+        profile = cProfile.Profile()
+        profile.enable()
+        policy = mcts(config, game, network, stats=stats)
+        profile.disable()
+        report = io.StringIO()
+        pstats.Stats(profile, stream=report).sort_stats(sort).print_stats(limit)
+        return policy, stats, report.getvalue()
+
+    if profiler == 'torch':
+        with torch.profiler.profile(activities=[torch.profiler.ProfilerActivity.CPU]) as profile:
+            policy = mcts(config, game, network, stats=stats)
+        if trace_path:
+            profile.export_chrome_trace(trace_path)
+        return policy, stats, profile.key_averages().table(sort_by='self_cpu_time_total', row_limit=limit)
+
+    raise ValueError(f"unknown profiler {profiler}, expected 'cprofile' or 'torch'")
+
+def main():
+    sys.path.insert(1, os.path.join(os.path.dirname(__file__), '..', 'utils'))
+    from graphutils import create_random_graph
+    from game import Game
+    from model import GCN
+    from mcts import MCTSConfig, mcts
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--nodes', type=int, nargs='+', default=[10, 50, 100])
+    parser.add_argument('--density', type=float, default=0.3, help='fraction of the n(n-1) possible edges')
+    parser.add_argument('--c-iter', type=int, default=10)
+    parser.add_argument('--batch-size', type=int, default=1)
+    parser.add_argument('--profile', choices=['cprofile', 'torch'], help='profile the search instead')
+    parser.add_argument('--json', help='write the stats of every graph size as JSON')
+    parser.add_argument('--trace', help='write a Chrome trace per graph size, <trace>.<nodes>.json')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    config = MCTSConfig(args.c_iter, logging=False, batch_size=args.batch_size)
+    results = {}
+    for n in args.nodes:
+        torch.manual_seed(args.seed)
+        graph = create_random_graph(n, max(n, int(args.density*n*(n - 1))), seed=args.seed)
+        game = Game(graph, 0)
+        network = GCN(1, 1)
+
+        if args.profile:
+            _, stats, report = profile_search(config, game, network, args.profile)
+            print(f"--- {n} nodes ---\n{report}")
+        else:
+            stats = SearchStats(trace=args.trace is not None)
+            mcts(config, game, network, stats=stats)
+            if args.trace:
+                stats.to_chrome_trace(f"{os.path.splitext(args.trace)[0]}.{n}.json")
+        print(f"{n} nodes: {stats}")
+        results[n] = stats.to_dict()
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -4,8 +4,11 @@ import networkx as nx
 import torch
 import torch.nn.functional as F
 
-from copy import deepcopy
+import copy
 import logging
+import math
+import time
+from collections import OrderedDict
 from typing import List
 import sys
 import os
@@ -14,57 +17,269 @@ sys.path.insert(1, 'utils')
 
 from model import GCN
 from game import Game
+from engine import GCNEngine
+from instrument import SearchStats
+from parallel import get_pool
 
 from graphutils import create_random_graph
 
-class MCTSNode:
-    """Monte Carlo Tree Search Tree Node"""
-    def __init__(self, parent_edge, node, edges=None):
-        if edges is None:
-            self.edges: List[MCTSEdge] = []
-        else:
-            self.edges: List[MCTSEdge] = edges
-
-        self.parent_edge: MCTSEdge = parent_edge
-        self.node = node
-        
-        self.expanded = 0
-        self.visits = 0
-        
-        self.mu: float = 0.0
-        self.sigma: float = 0.0
-
-class MCTSEdge:
-    """Monte Carlo Tree Search Tree Edge"""
-    def __init__(self, p: float, parent: MCTSNode, next_: MCTSNode, reward: float):
-        # Number of visits
-        self.N: int = 0
-        
-        # Cumulative action value (sorta like reward)
-        self.W = 0.0
-        
-        # Average action value
-        self.Q = 0.0
-        
-        # Probability
-        self.P: float = p
-        
-        # Parent MCTSNode
-        self.parent_node: MCTSNode = parent
-        
-        # Next MCTSNode
-        self.next: MCTSNode = next_
-        
-        # Reward (i.e. edge weight)
-        self.r: float = reward
+class MCTSTree:
+    """
+    Struct-of-arrays Monte Carlo Tree Search tree
+
+    Tree nodes and edges live in preallocated NumPy arrays (indexed by int ids) instead of one Python object each,
+    every array grows geometrically when it runs out of room.  An expanded node owns a contiguous block of edges
+    [first_edge, first_edge + n_edges), one per LEGAL action, so the block doubles as the node's cached legal-move
+    mask.  Child nodes are only allocated the first time their edge is selected.
+    """
+    def __init__(self, root_state: int, capacity: int = 256):
+        self.n_nodes = 0
+        self.n_edges_total = 0
+
+        # --- node arrays --- #
+        self.state = np.zeros(capacity, dtype=np.int64)             # graph node this tree node represents
+        self.parent_edge = np.full(capacity, -1, dtype=np.int64)    # edge leading into this node (-1 for the root)
+        self.expanded = np.zeros(capacity, dtype=bool)
+        self.visits = np.zeros(capacity, dtype=np.int64)
+        self.mu = np.zeros(capacity, dtype=np.float64)
+        self.sigma = np.zeros(capacity, dtype=np.float64)
+        self.first_edge = np.full(capacity, -1, dtype=np.int64)
+        self.n_edges = np.zeros(capacity, dtype=np.int64)
+
+        # --- edge arrays --- #
+        edge_capacity = capacity*4
+        self.N = np.zeros(edge_capacity, dtype=np.int64)            # number of visits
+        self.W = np.zeros(edge_capacity, dtype=np.float64)          # cumulative action value
+        self.Q = np.zeros(edge_capacity, dtype=np.float64)          # average action value
+        self.P = np.zeros(edge_capacity, dtype=np.float32)          # prior probability
+        self.r = np.zeros(edge_capacity, dtype=np.float32)          # reward (i.e. edge weight)
+        self.parent = np.full(edge_capacity, -1, dtype=np.int64)    # tree node the edge leaves from
+        self.child = np.full(edge_capacity, -1, dtype=np.int64)     # tree node the edge leads to (-1 until allocated)
+        self.action = np.zeros(edge_capacity, dtype=np.int64)       # graph node the edge moves to
+
+        # transposition links, state key -> tree node, and the evaluation cache (see TranspositionTable), set by mcts
+        self.transposed = {}
+        self.table = None
+
+        # network calls made for this tree, and the simulations run / why the last search on it stopped
+        self.network_calls = 0
+        self.simulations = 0
+        self.stop_reason = None
+
+        self.root = self.add_node(root_state)
+
+    _NODE_FIELDS = ('state', 'parent_edge', 'expanded', 'visits', 'mu', 'sigma', 'first_edge', 'n_edges')
+    _EDGE_FIELDS = ('N', 'W', 'Q', 'P', 'r', 'parent', 'child', 'action')
+
+    def __len__(self):
+        return self.n_nodes
+
+    def _grow(self, fields, needed: int):
+        # double capacity until `needed` entries fit, padding with each array's "empty" value
+        old = getattr(self, fields[0]).shape[0]
+        capacity = max(old, 1)
+        while capacity < needed:
+            capacity *= 2
+        for name in fields:
+            arr = getattr(self, name)
+            fill = -1 if name in ('parent_edge', 'first_edge', 'parent', 'child') else 0
+            grown = np.full(capacity, fill, dtype=arr.dtype)
+            grown[:old] = arr
+            setattr(self, name, grown)
+
+    def add_node(self, state: int, parent_edge: int = -1) -> int:
+        if self.n_nodes == self.state.shape[0]:
+            self._grow(self._NODE_FIELDS, self.n_nodes + 1)
+        idx = self.n_nodes
+        self.state[idx] = state
+        self.parent_edge[idx] = parent_edge
+        self.n_nodes += 1
+        return idx
+
+    def expand(self, node: int, actions: np.ndarray, priors: np.ndarray, rewards: np.ndarray, mu: float, sigma: float):
+        """Allocate one edge per legal action for `node`, along with the node's reward statistics"""
+        k = len(actions)
+        if self.n_edges_total + k > self.N.shape[0]:
+            self._grow(self._EDGE_FIELDS, self.n_edges_total + k)
+        lo, hi = self.n_edges_total, self.n_edges_total + k
+        self.P[lo:hi] = priors
+        self.r[lo:hi] = rewards
+        self.parent[lo:hi] = node
+        self.action[lo:hi] = actions
+        self.n_edges_total = hi
+
+        self.first_edge[node] = lo
+        self.n_edges[node] = k
+
+        self.mu[node] = mu
+        self.sigma[node] = sigma
+        self.expanded[node] = True
+
+    def edges(self, node: int) -> slice:
+        lo = self.first_edge[node]
+        return slice(lo, lo + self.n_edges[node])
+
+    def subtree(self, action: int):
+        """
+        Re-root on the root's child for `action` (a graph node): returns a compacted copy of that child's subtree,
+        statistics included, or None if the child was never visited
+        """
+        root_edges = self.edges(self.root)
+        hit = np.nonzero(self.action[root_edges] == action)[0]
+        if not len(hit) or self.child[root_edges.start + hit[0]] == -1:
+            return None
+        new_root = self.child[root_edges.start + hit[0]]
+
+        # collect the subtree breadth first, the new root becomes node 0
+        # - with transpositions a node can be reached along several edges, it is only collected once
+        nodes = [new_root]
+        seen = {new_root}
+        i = 0
+        while i < len(nodes):
+            node = nodes[i]
+            i += 1
+            if self.expanded[node]:
+                children = self.child[self.edges(node)]
+                for child in children[children != -1].tolist():
+                    if child not in seen:
+                        seen.add(child)
+                        nodes.append(child)
+        nodes = np.array(nodes, dtype=np.int64)
+        node_map = np.full(self.n_nodes, -1, dtype=np.int64)
+        node_map[nodes] = np.arange(len(nodes))
+
+        # keep each expanded node's edge block contiguous, laid out in the new node order
+        counts = self.n_edges[nodes]
+        new_first = np.zeros(len(nodes), dtype=np.int64)
+        np.cumsum(counts[:-1], out=new_first[1:])
+        old_edges = np.repeat(self.first_edge[nodes] - new_first, counts) + np.arange(counts.sum())
+        edge_map = np.full(self.n_edges_total, -1, dtype=np.int64)
+        edge_map[old_edges] = np.arange(len(old_edges))
+
+        tree = MCTSTree(self.state[new_root], capacity=len(nodes))
+        if len(old_edges) > tree.N.shape[0]:
+            tree._grow(self._EDGE_FIELDS, len(old_edges))
+        for name in self._NODE_FIELDS:
+            getattr(tree, name)[:len(nodes)] = getattr(self, name)[nodes]
+        for name in self._EDGE_FIELDS:
+            getattr(tree, name)[:len(old_edges)] = getattr(self, name)[old_edges]
+        tree.n_nodes = len(nodes)
+        tree.n_edges_total = len(old_edges)
+
+        # translate the indices into the new layout
+        tree.first_edge[:len(nodes)] = np.where(self.expanded[nodes], new_first, -1)
+        tree.parent_edge[0] = -1
+        # (a transposed node keeps the edge it was first reached by, -1 if that edge is not part of the subtree)
+        parent_edge = self.parent_edge[nodes[1:]]
+        tree.parent_edge[1:len(nodes)] = np.where(parent_edge != -1, edge_map[parent_edge], -1)
+        tree.parent[:len(old_edges)] = node_map[tree.parent[:len(old_edges)]]
+        children = tree.child[:len(old_edges)]
+        tree.child[:len(old_edges)] = np.where(children != -1, node_map[children], -1)
+
+        tree.transposed = {key: int(node_map[node]) for key, node in self.transposed.items() if node_map[node] != -1}
+        tree.table = self.table
+
+        return tree
+
+    def get_child(self, edge: int, key=None) -> int:
+        # children are created lazily, the first time their edge is traversed
+        # - given the key of the state the edge leads to, an existing node for that state is linked instead
+        child = self.child[edge]
+        if child == -1:
+            if key is not None:
+                child = self.transposed.get(key, -1)
+            if child == -1:
+                child = self.add_node(self.action[edge], edge)
+                if key is not None:
+                    self.transposed[key] = child
+            self.child[edge] = child
+        return child
+
+def state_key(game: Game):
+    """A game state is the current node and the set of visited nodes, as (current node, packed visited bitmap)"""
+    return game.current_node, np.packbits(game.graph.x[:, 0].numpy() > 0).tobytes()
+
+class TranspositionTable:
+    """
+    LRU cache of network evaluations keyed by state_key
+    - the network only sees the visited flags and the current node, so every path to a state gets the same priors and
+      value, a state reached along another path (or again in a later search on the same graph) skips the network
+    - an entry holds the priors of the state's legal actions and max(v), about n/8 + 12*out-degree + 150 bytes
+    """
+    def __init__(self, capacity: int = 1 << 16):
+        self.capacity = capacity
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry
+
+    def put(self, key, priors: np.ndarray, v_max: float):
+        self.entries[key] = (priors, v_max)
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
 
 class MCTSConfig:
-    def __init__(self, c_iter: int, logging=True, c_puct=1.5, tau=1):
+    def __init__(self, c_iter: int, logging=True, c_puct=1.5, tau=1, batch_size=1, virtual_loss=3, precompute=True,
+                 transpositions=True, tt_capacity=1 << 16, share_stats=False, time_budget=None, node_budget=None,
+                 call_budget=None, early_stop=False, workers=1, worker_noise=0.25, root_noise=None):
+        # simulations per search are c_iter * game.get_n_actions() (see there), None for no such cap (anytime search)
         self.c_iter = c_iter
         self.c_puct = c_puct
         self.tau = tau
         self.logging = logging
 
+        # number of leaves selected (and evaluated in one network call) per round of the search
+        self.batch_size = batch_size
+
+        # visits, each counted as a loss, temporarily added along a selected path while its leaf awaits evaluation
+        self.virtual_loss = virtual_loss
+
+        # evaluate a GCN through a GCNEngine built once per search (sparse adjacency reused by every leaf)
+        self.precompute = precompute
+
+        # cache network evaluations by game state in a TranspositionTable of at most tt_capacity states, it lives with
+        # the tree (and its subtrees) so later searches on the same game reuse it
+        self.transpositions = transpositions
+        self.tt_capacity = tt_capacity
+
+        # also merge the tree nodes of transposed states, the search becomes a DAG whose nodes pool the visit
+        # statistics of every path into them (fewer nodes and network calls, but the search itself changes)
+        self.share_stats = share_stats
+
+        # anytime search: stop at the first of c_iter * n_actions simulations, time_budget seconds (from the start of
+        # the mcts call), a tree of node_budget nodes or call_budget network calls, the policy is the one so far
+        self.time_budget = time_budget
+        self.node_budget = node_budget
+        self.call_budget = call_budget
+        if c_iter is None and time_budget is None:
+            raise ValueError("a search without c_iter needs a time_budget to end it")
+
+        # also stop once the most visited root action can no longer be overtaken in the simulations left (known
+        # from c_iter, or estimated from the simulation rate so far under a time_budget)
+        self.early_stop = early_stop
+
+        # root parallelization: split the simulations of a search between `workers` independent searches (this
+        # process and workers - 1 worker processes, see parallel.py) and sum their root visit counts.  Budgets
+        # other than c_iter apply to each search.  Every search but this process's mixes worker_noise Dirichlet
+        # noise into its root priors, otherwise the (deterministic) searches would all grow the same tree
+        self.workers = workers
+        self.worker_noise = worker_noise
+
+        # (epsilon, seed): mix epsilon of Dirichlet(0.3) noise drawn with seed into the root priors
+        self.root_noise = root_noise
+
 class MCTSLogger:
     def __init__(self, name='mcts-logger', log_level=logging.DEBUG):
         self.logger = logging.getLogger(name)
@@ -77,197 +292,418 @@ class MCTSLogger:
         ch.setFormatter(formatter)
         self.logger.addHandler(ch)
 
+        # checked before building any message, so a disabled logger costs one attribute lookup per call
+        self.enabled = True
+
     def select(self):
-        self.logger.debug("\n# --- SELECT --- #\n")
+        if self.enabled:
+            self.logger.debug("\n# --- SELECT --- #\n")
 
     def expand(self):
-        self.logger.debug("\n# --- EXPAND --- #\n")
+        if self.enabled:
+            self.logger.debug("\n# --- EXPAND --- #\n")
 
     def backup(self):
-        self.logger.debug("\n# --- BACKUP --- #\n")
+        if self.enabled:
+            self.logger.debug("\n# --- BACKUP --- #\n")
 
-    def log_select(self, node: MCTSNode, edge: MCTSEdge):
-
-        for i, e in enumerate(node.edges):
-            self.logger.debug(f"Edge {i}:\n N: {e.N}\n W: {e.W}\n Q: {e.Q}\n P: {e.P}")
+    def log_ucb(self, ucb: np.ndarray):
+        if self.enabled:
+            self.logger.debug(f"UCB: {ucb}")
 
+    def log_select(self, tree: MCTSTree, node: int, edge: int):
+        if not self.enabled:
+            return
+        self.log_expand(tree, node)
         self.logger.debug(f"SELECTED EDGE {edge}")
 
-    def log_expand(self, node: MCTSNode):
-        for i, e in enumerate(node.edges):
-            self.logger.debug(f"Edge {i}:\n N: {e.N}\n W: {e.W}\n Q: {e.Q}\n P: {e.P}")
+    def log_expand(self, tree: MCTSTree, node: int):
+        if not self.enabled:
+            return
+        for i, e in enumerate(range(tree.first_edge[node], tree.first_edge[node] + tree.n_edges[node])):
+            self.logger.debug(f"Edge {i}:\n N: {tree.N[e]}\n W: {tree.W[e]}\n Q: {tree.Q[e]}\n P: {tree.P[e]}")
 
     def log_backup(self, params):
         pass
 
-    # A bit of a hack, but it works...
     def disable_logging(self):
+        self.enabled = False
         self.logger.setLevel(logging.CRITICAL)
 
     def enable_logging(self):
+        self.enabled = True
         self.logger.setLevel(logging.DEBUG)
 
 # Global logging object
 mcts_logger = MCTSLogger()
 
-def select_edge(node: MCTSNode, config: MCTSConfig, game: Game):
+def select_edge(tree: MCTSTree, node: int, config: MCTSConfig) -> int:
     # Calculate UCB score for all child edges, choose edge with highest value
-    ucb = torch.tensor([b.Q + config.c_puct*b.P*(np.sqrt(node.visits - b.N)/(1+b.N)) for b in node.edges])
-
-    # Force illegal moves to -inf
-    mask = torch.zeros(game.graph.x.shape[0])
-    edges_from_current = game.graph.edge_index[0] == game.current_node
-    directly_connected_nodes = game.graph.edge_index[1, edges_from_current]
-    mask[directly_connected_nodes] = 1
+    # - only legal moves have edges, so there is nothing to mask and this is O(out-degree)
+    edges = tree.edges(node)
+    N = tree.N[edges]
+    ucb = tree.Q[edges] + config.c_puct*tree.P[edges]*(np.sqrt(tree.visits[node] - N)/(1 + N))
+
+    idx = int(np.argmax(ucb))
+
+    mcts_logger.log_ucb(ucb)
+    mcts_logger.log_select(tree, node, idx)
+
+    return edges.start + idx
+
+def legal_actions(game: Game):
+    """Target nodes (ascending, so UCB ties break towards the lowest node id) and rewards of every outward edge from the current node"""
+    return game.index.neighbours(game.current_node)
+
+def reward_stats(rewards: np.ndarray, n_nodes: int):
+    """
+    mu and sigma of the rewards over every POSSIBLE action (one per graph node), non-edges count as a reward of 0
+    - mean and std of W(s,a)? thats what I'm going with...
+    - TODO: verify if random sampling is better than fully calculating
+    """
+    all_rewards = np.zeros(n_nodes, dtype=np.float64)
+    all_rewards[:len(rewards)] = rewards
+    return np.mean(all_rewards), np.std(all_rewards)
+
+def backup(tree: MCTSTree, path: List[int], r_estim: float):
+    """
+    Propagate a leaf estimate back up the search path (root -> leaf order of edge ids)
+    - r accumulates the raw edge rewards from the leaf upwards, and each edge is credited with r normalized by
+      the mu/sigma of the node it leaves from
+    """
+    if not path:
+        return
+    edges = np.asarray(path[::-1], dtype=np.int64)
+    parents = tree.parent[edges]
+
+    r = r_estim + np.cumsum(tree.r[edges], dtype=np.float64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        r_prime = (r - tree.mu[parents])/tree.sigma[parents]
+
+    tree.visits[parents] += 1
+    tree.W[edges] += r_prime
+    tree.N[edges] += 1
+    tree.Q[edges] = tree.W[edges]/tree.N[edges]
+
+def add_virtual_loss(tree: MCTSTree, path: List[int], n_vl: int):
+    """Count every edge on a pending path as n_vl extra visits that lost (-1 each), steering other selections away from it"""
+    edges = np.asarray(path, dtype=np.int64)
+    tree.N[edges] += n_vl
+    tree.W[edges] -= n_vl
+    tree.visits[tree.parent[edges]] += n_vl
+    tree.Q[edges] = tree.W[edges]/tree.N[edges]
+
+def remove_virtual_loss(tree: MCTSTree, path: List[int], n_vl: int):
+    edges = np.asarray(path, dtype=np.int64)
+    tree.N[edges] -= n_vl
+    tree.W[edges] += n_vl
+    tree.visits[tree.parent[edges]] -= n_vl
+    N = tree.N[edges]
+    tree.Q[edges] = np.where(N > 0, tree.W[edges]/np.maximum(N, 1), 0.)
+
+def select_leaf(tree: MCTSTree, config: MCTSConfig, game: Game):
+    """Walk from the root down to a leaf, returns the leaf, the edges taken and the game state at the leaf"""
+    node: int = tree.root
+    scratch_game: Game = game.clone()
+    search_path: List[int] = []
+
+    mcts_logger.select()
+
+    # - an expanded node without any legal moves is a dead end, treated like a terminal state
+    while tree.expanded[node] and tree.n_edges[node]:
+        edge = select_edge(tree, node, config)
+
+        # We create a tensor (representing a PyG graph edge) and use it to update our scratch_game
+        next_state, reward, terminal = scratch_game.step(torch.tensor([tree.state[node], tree.action[edge]]))
+
+        # Update current node, a new child of a transposed (non-terminal) state is linked to the state's existing node
+        key = None
+        if config.share_stats and tree.child[edge] == -1 and not scratch_game.is_terminal:
+            key = state_key(scratch_game)
+        node = tree.get_child(edge, key)
+        search_path.append(edge)
 
-    ucb[mask == 0] = float('-inf')
-
-    idx = torch.argmax(ucb).item()
-    edge = node.edges[idx]
-
-    mcts_logger.logger.debug(f"UCB: {ucb}")
-    mcts_logger.log_select(node, idx)
+        if scratch_game.is_terminal:
+            break
+
+    return node, search_path, scratch_game
+
+def expand_leaves(tree: MCTSTree, leaves, network: GCN, stats: SearchStats = None):
+    """
+    Evaluate and expand every distinct non-terminal, unexpanded leaf, using one network call for all of them
+    - leaves whose state is in the tree's TranspositionTable are expanded from it without a network call
+    :return: max(v) of each expanded leaf, keyed by tree node
+    """
+    t = time.perf_counter() if stats is not None else 0.
+    pending = {}
+    cached = {}
+    for node, _, scratch_game in leaves:
+        if not scratch_game.is_terminal and not tree.expanded[node] and node not in pending and node not in cached:
+            entry = tree.table.get(state_key(scratch_game)) if tree.table is not None else None
+            if entry is not None:
+                cached[node] = (scratch_game, entry)
+            else:
+                pending[node] = scratch_game
+
+    v_max = {}
+    for node, (scratch_game, (priors, v)) in cached.items():
+        actions, rewards = legal_actions(scratch_game)
+        mu, sigma = reward_stats(rewards, scratch_game.graph.x.shape[0])
+        tree.expand(node, actions, priors, rewards, mu, sigma)
+        v_max[node] = v
+    if not pending:
+        if stats is not None:
+            stats.lap('expand', t)
+        return v_max
+
+    # p and v are the vector outputs of our GCN model's forward pass
+    # - they are the same shape as game.graph.x i.e. (# of nodes, 1)
+    # - imagine we "added" an edge from the current node to each other node, and then assigned a p and v value of 0 for all 
+    #   of these new edges (that do not exist in the real graph).  We do this as the network requires a consistent output shape
+    games: List[Game] = list(pending.values())
+    if stats is not None:
+        t = stats.lap('expand', t)
+    if len(games) == 1:
+        p, v = network(games[0])
+        p, v = p.unsqueeze(0), v.unsqueeze(0)
+    else:
+        # every leaf shares the graph topology, only the visited flags in x and the current node differ
+        graph = games[0].graph
+        x = torch.stack([g.graph.x for g in games])
+        current_nodes = torch.tensor([g.current_node for g in games])
+        p, v = network(x, graph.edge_index, graph.edge_attr, current_nodes)
+    tree.network_calls += 1
+    if stats is not None:
+        t = stats.lap('evaluate', t)
+        stats.network_calls += 1
+        stats.leaves_evaluated += len(games)
+
+    for (node, scratch_game), p_k, v_k in zip(pending.items(), p, v):
+        # one edge per legal action, with the corresponding p-value from our network p output
+        # - mu and sigma are still taken over every POSSIBLE action, as the network output is
+        actions, rewards = legal_actions(scratch_game)
+        mu, sigma = reward_stats(rewards, scratch_game.graph.x.shape[0])
+        priors = p_k.numpy()[actions]
+        tree.expand(node, actions, priors, rewards, mu, sigma)
+        v_max[node] = v_k.max().item()
+        if tree.table is not None:
+            tree.table.put(state_key(scratch_game), priors, v_max[node])
+
+        # Log previous node and expanded edges
+        mcts_logger.log_expand(tree, node)
+
+    if stats is not None:
+        stats.lap('expand', t)
+    return v_max
+
+def add_root_noise(tree: MCTSTree, epsilon: float, seed: int, alpha: float = 0.3):
+    edges = tree.edges(tree.root)
+    noise = np.random.default_rng(seed).dirichlet(np.full(edges.stop - edges.start, alpha))
+    tree.P[edges] = (1 - epsilon)*tree.P[edges] + epsilon*noise
+
+def root_policy(config: MCTSConfig, actions: np.ndarray, N: np.ndarray, visits: int, n_nodes: int) -> torch.Tensor:
+    """The improved policy over every graph node from the root's legal actions and their visit counts"""
+    rest = visits - N
+    with np.errstate(divide='ignore', invalid='ignore'):
+        policy = np.where(rest != 0, np.power(N/rest, 1/config.tau), 1.) # HACK: what should this else be?
+
+    # Scatter the root's legal moves into the full action space, 0 out illegal moves
+    p = torch.zeros(n_nodes)
+    p[actions] = torch.tensor(policy, dtype=torch.float)
+    p[p == 0] = float('-inf')
 
-    return edge
+    return F.softmax(p, dim=0)
 
-def backup(path, args):
-    # TODO: replace the backup in mcts to be a function, can use the search_path to do this fairly easily
-    # - I'm lazy
-    pass
+def root_parallel_mcts(config: MCTSConfig, game: Game, network: GCN, tree: MCTSTree = None, return_tree: bool = False,
+                       stats: SearchStats = None):
+    """mcts with config.workers > 1, see MCTSConfig.workers, the tree returned is this process's"""
+    pool = get_pool(network, config.workers - 1, game)
+
+    share = copy.copy(config)
+    share.workers = 1
+    if config.c_iter is not None:
+        share.c_iter = config.c_iter/config.workers
+    pending = []
+    for k in range(1, config.workers):
+        worker = copy.copy(share)
+        worker.logging = False
+        worker.root_noise = (config.worker_noise, k) if config.worker_noise else None
+        pending.append(pool.submit(worker, game))
+
+    _, tree = mcts(share, game, network, tree=tree, return_tree=True, stats=stats)
+
+    # sum the root visit counts of every search, by action
+    edges = tree.edges(tree.root)
+    actions = tree.action[edges]
+    N = tree.N[edges].astype(np.int64)
+    visits, simulations = int(tree.visits[tree.root]), tree.simulations
+    for result in pending:
+        worker_actions, worker_N, worker_visits, worker_simulations, worker_calls = result.get()
+        if len(actions) and len(worker_actions):
+            N += worker_N[np.searchsorted(worker_actions, actions)]
+        visits += worker_visits
+        simulations += worker_simulations
+        if stats is not None:
+            stats.simulations += worker_simulations
+            stats.network_calls += worker_calls
+    tree.simulations = simulations
+
+    policy = root_policy(config, actions, N, visits, game.graph.x.shape[0])
+    if return_tree:
+        return policy, tree
+    return policy
+
+def stop_reason(config: MCTSConfig, tree: MCTSTree, done: int, n_simulations: int, deadline: float, calls: int,
+                loop_start: float):
+    """Why the search should stop before its next round ('simulations', 'time', 'nodes', 'calls', 'decided'), or None"""
+    if n_simulations is not None and done >= n_simulations:
+        return 'simulations'
+    # at least one simulation, so there is a policy to return
+    if not done:
+        return None
+    now = time.perf_counter()
+    if deadline is not None and now >= deadline:
+        return 'time'
+    if config.node_budget is not None and len(tree) >= config.node_budget:
+        return 'nodes'
+    if config.call_budget is not None and calls >= config.call_budget:
+        return 'calls'
+
+    if config.early_stop:
+        N = tree.N[tree.edges(tree.root)]
+        if len(N) <= 1:
+            return 'decided'
+        remaining = n_simulations - done if n_simulations is not None else float('inf')
+        if deadline is not None:
+            remaining = min(remaining, (deadline - now)*done/max(now - loop_start, 1e-9))
+        first, second = np.partition(N, len(N) - 2)[-2:][::-1]
+        if first - second > remaining:
+            return 'decided'
+    return None
 
 @torch.no_grad
-def mcts(config: MCTSConfig, game: Game, network: GCN):
-    
+def mcts(config: MCTSConfig, game: Game, network: GCN, tree: MCTSTree = None, return_tree: bool = False,
+         stats: SearchStats = None):
+    """
+    Search from the game's current state and return the improved policy over every graph node
+    :param tree: a tree from an earlier search to keep searching, e.g. MCTSTree.subtree of the previous move's tree.
+                 Its root must be the game's current state; the visits it already has count towards the budget
+    :param return_tree: also return the search tree, (policy, tree)
+    :param stats: a SearchStats to count this search's phase times, simulations, network calls, ... into
+    The number of simulations run and the reason the search stopped are left in tree.simulations / tree.stop_reason
+    """
+    if config.workers > 1:
+        return root_parallel_mcts(config, game, network, tree, return_tree, stats)
+
+    start = time.perf_counter()
+
     if not config.logging:
         mcts_logger.disable_logging()
     else: 
         mcts_logger.enable_logging()
 
-    root = MCTSNode(None, game.get_state()) # HACK: Only keep this while game state is randomly initialized
+    # exported inference models only take state stacks, they always go through a GCNEngine
+    if GCNEngine.supports(network) and (config.precompute or not isinstance(network, GCN)):
+        network = GCNEngine(network, game.graph)
+
+    if tree is None or tree.state[tree.root] != game.get_state():
+        tree = MCTSTree(game.get_state()) # HACK: Only keep this while game state is randomly initialized
+    if config.transpositions and tree.table is None:
+        tree.table = TranspositionTable(config.tt_capacity)
+    if config.share_stats and not tree.transposed:
+        tree.transposed[state_key(game)] = tree.root
+    root = tree.root
     n_actions = game.get_n_actions()
+    n_simulations = max(math.ceil(config.c_iter*n_actions) - tree.visits[root], 1) if config.c_iter is not None else None
+    deadline = start + config.time_budget if config.time_budget is not None else None
+    calls = tree.network_calls
+    batched = config.batch_size > 1
+    if stats is not None:
+        stats.lap('setup', start)
     
-    for _ in range(config.c_iter*n_actions):
-        node: MCTSNode = root
-        scratch_game: Game = game.clone()
-        search_path: List[MCTSNode] = [node]
-        
-        # --- SELECT --- #
-        mcts_logger.select()
+    noise_pending = config.root_noise is not None
 
-        while node.expanded:
-            edge = select_edge(node, config, scratch_game)
+    done = 0
+    loop_start = time.perf_counter()
+    while True:
+        if noise_pending and tree.expanded[root]:
+            add_root_noise(tree, *config.root_noise)
+            noise_pending = False
 
-            # Update current node
-            prev_node: MCTSNode = deepcopy(node.node)
-            node: MCTSNode = edge.next
-            search_path.append(node)
+        tree.stop_reason = stop_reason(config, tree, done, n_simulations, deadline, tree.network_calls - calls, loop_start)
+        if tree.stop_reason is not None:
+            break
+        t = time.perf_counter() if stats is not None else 0.
 
-            # We create a tensor (representing a PyG graph edge) and use it to update our scratch_game
-            next_state, reward, terminal = scratch_game.step(torch.tensor([prev_node, node.node]))
-
-            if scratch_game.is_terminal:
-                break
+        # --- SELECT --- #
+        # - with batch_size > 1 several leaves are selected before any is evaluated, the virtual loss on the
+        #   pending paths makes the later selections of a batch explore elsewhere
+        leaves = []
+        for _ in range(min(config.batch_size, n_simulations - done) if n_simulations is not None else config.batch_size):
+            leaf = select_leaf(tree, config, game)
+            if batched:
+                add_virtual_loss(tree, leaf[1], config.virtual_loss)
+            leaves.append(leaf)
+        done += len(leaves)
+        if stats is not None:
+            stats.lap('select', t)
+            stats.simulations += len(leaves)
+            stats.max_depth = max(stats.max_depth, max(len(search_path) for _, search_path, _ in leaves))
 
         # --- EXPAND --- #
         mcts_logger.expand()
+        v_max = expand_leaves(tree, leaves, network, stats)
 
-        if not scratch_game.is_terminal:
-            # p and v are the vector outputs of our GCN model's forward pass
-            # - they are the same shape as game.graph.x i.e. (# of nodes, 1)
-            # - imagine we "added" an edge from the current node to each other node, and then assigned a p and v value of 0 for all 
-            #   of these new edges (that do not exist in the real graph).  We do this as the network requires a consistent output shape
-            p, v = network(scratch_game)
-
-            # in this loop, we assign the corresponding p-value (from our network p output) for each edge (i.e. for each POSSIBLE action, NOT the action space)
-            # - since UCB forces illegal moves to -inf, we guarantee SELECT will not choose them regardless of their value
-            reward_list = []
-            for i, action in enumerate(scratch_game.get_total_action_space()):
-                
-                next_state, reward, terminal = scratch_game.simulate_step(action)
-
-                # create a MCTSNode that will represent the new leaf node
-                # - awkward looking because MCTSNode and MCTSEdge have a recursive dependence
-                state_from_action = MCTSNode(None, next_state)
-                
-                # initialize the new edge with probabilty, parent (current state), child node, reward
-                edge = MCTSEdge(p.view(-1)[i].item(), node, state_from_action, reward)
-                
-                # set the new edge as the parent of the new leaf node
-                state_from_action.parent_edge = edge
-                node.edges.append(edge)
-                reward_list.append(reward)
-                
-            # calculate mu, sigma
-            # - mean and std of W(s,a)? thats what I'm going with...
-            # - TODO: verify if random sampling is better than fully calculating
-            node.mu = np.mean(reward_list)
-            node.sigma = np.std(reward_list)
-            node.expanded = True
-
-            # Log previous node and expanded edges
-            mcts_logger.log_expand(node)
-        
         # --- BACKUP --- #
         mcts_logger.backup()
-        if scratch_game.is_terminal:
-            # r_estim = 0 if s is a terminal state (from paper)
-            r_estim = 0
-        else:
-            r_estim = node.mu + node.sigma*max(v)
-            
-        r = r_estim
-        while node != root: # BUG: this is currently not updating correctly
-            action = node.parent_edge
-            node = action.parent_node
-            node.visits += 1
-            
-            r = r + action.r
-            r_prime = (r - node.mu)/node.sigma
-            action.W += r_prime
-            action.N += 1
-            action.Q = action.W/action.N
+        t = time.perf_counter() if stats is not None else 0.
+        for node, search_path, scratch_game in leaves:
+            if batched:
+                remove_virtual_loss(tree, search_path, config.virtual_loss)
+
+            if scratch_game.is_terminal or not tree.n_edges[node]:
+                # r_estim = 0 if s is a terminal state (from paper)
+                r_estim = 0.
+            else:
+                r_estim = tree.mu[node] + tree.sigma[node]*v_max[node]
+
+            backup(tree, search_path, r_estim)
+        if stats is not None:
+            stats.lap('backup', t)
               
     # -- end loop --
-    
-    policy: List[float] = [0.]*len(root.edges) # HACK: should be n_actions, not sure why I'm getting an error
-    for i, a in enumerate(root.edges):
-        policy[i] = pow(a.N/(root.visits-a.N), 1/config.tau) if (root.visits-a.N) else 1. # HACK: what should this else be?
+    tree.simulations = done
     
     # -- uncomment for debug --
-    # visualize_mcts(root)
-    
-    # 0 out illegal moves
-    p = torch.tensor(policy)
-    mask = torch.zeros(game.graph.x.shape[0])
-    edges_from_current = game.graph.edge_index[0] == game.current_node
-    directly_connected_nodes = game.graph.edge_index[1, edges_from_current]
-    mask[directly_connected_nodes] = 1
-    p: torch.Tensor = mask * p.t()
-    p[p == 0] = float('-inf')
+    # visualize_mcts(tree)
 
-    return F.softmax(p, dim=0)
+    root_edges = tree.edges(root)
+    policy = root_policy(config, tree.action[root_edges], tree.N[root_edges], tree.visits[root], game.graph.x.shape[0])
+    if stats is not None:
+        stats.end_search(start, tree)
+    if return_tree:
+        return policy, tree
+    return policy
 
-def visualize_mcts(root_node: MCTSNode):
+def visualize_mcts(tree: MCTSTree):
     G = nx.DiGraph()
     
-    def add_nodes_edges(node: MCTSNode, depth=0):  # Add depth parameter
-        node_id = id(node)
-        # Include node.node in the attributes for G.add_node
-        G.add_node(node_id, visits=node.visits, mu=node.mu, depth=depth, label=node.node)  # Add label attribute
-        if node.parent_edge is not None:
-            parent_id = id(node.parent_edge.parent_node)
-            G.add_edge(parent_id, node_id, weight=node.parent_edge.P)
-        for edge in node.edges:
-            next_node = edge.next
-            next_node_id = id(next_node)
-            # No need to add the node again if it's already been added, just update or ensure its existence
-            if next_node_id not in G:
-                G.add_node(next_node_id, visits=next_node.visits, mu=next_node.mu, label=next_node.node)  # Also add label here
-            G.add_edge(node_id, next_node_id, weight=edge.P)
-            add_nodes_edges(next_node, depth + 1)  # Increment depth for child nodes
-    
-    # Start the recursive process
-    add_nodes_edges(root_node)
+    # Walk the allocated part of the tree breadth first, tracking depth
+    depth = {tree.root: 0}
+    G.add_node(tree.root, visits=tree.visits[tree.root], mu=tree.mu[tree.root], depth=0, label=tree.state[tree.root])
+    frontier = [tree.root]
+    while frontier:
+        node = frontier.pop(0)
+        if not tree.expanded[node]:
+            continue
+        for edge in range(tree.first_edge[node], tree.first_edge[node] + tree.n_edges[node]):
+            child = tree.child[edge]
+            if child == -1:
+                continue
+            depth[child] = depth[node] + 1
+            G.add_node(child, visits=tree.visits[child], mu=tree.mu[child], depth=depth[child], label=tree.state[child])
+            G.add_edge(node, child, weight=tree.P[edge])
+            frontier.append(child)
     
     # Custom layout: Assign positions based on the depth and the order of nodes at each depth
     pos = {}
@@ -289,15 +725,6 @@ def visualize_mcts(root_node: MCTSNode):
     else:
         print("Graph is empty.")
 
-def test_expand():
-    pass
-
-def test_select():
-    pass
-
-def test_backup():
-    pass
-
 if __name__ == '__main__':
     config = MCTSConfig(3)
     graph = create_random_graph(5, 15)
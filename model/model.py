@@ -1,7 +1,9 @@
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
+from torch_geometric.data import Data
 from torch_geometric.nn import GraphConv
+from torch_geometric.utils import softmax as segment_softmax
 
 from game import Game
 
@@ -27,26 +29,26 @@ class GCN(nn.Module):
         # policy vector output layer
         self.policy_conv = GraphConv(hidden_size, output_size)
 
-    def illegal_moves_mask(self, game: Game):
-        # we set the p and v value of an illegal move to -inf
-        # - this guarantees the move will not be chosen by SELECT, so we can safely add it as an MCTS Node
-
-        mask = torch.zeros(game.graph.x.shape[0])
-        
-        # Find the indices of edges that emanate from the current node
-        edges_from_current = game.graph.edge_index[0] == game.current_node
-        
-        # Find the target nodes of those edges
-        directly_connected_nodes = game.graph.edge_index[1, edges_from_current]
-        
-        # Set the mask to 1 for directly connected nodes
-        mask[directly_connected_nodes] = 1
-
-        return mask
-
-    def forward(self, game: Game):
-        x, edge_index, edge_attr = game.graph.x, game.graph.edge_index, game.graph.edge_attr
+    @staticmethod
+    def legal_moves_mask(edge_index: torch.Tensor, current_nodes: torch.Tensor, num_nodes: int, batch: torch.Tensor = None):
+        """
+        Bool mask over nodes that is True for the legal moves of each graph, i.e. the targets of the edges leaving
+        that graph's current node.  Illegal moves get p = v = 0, which guarantees SELECT will never choose them
+        :param current_nodes: (# of graphs,) current node of each graph, indexed over all nodes of the batch
+        :param batch: graph of each node, None for a single graph
+        """
+        src, dst = edge_index
+        owner = batch[src] if batch is not None else torch.zeros_like(src)
+        legal = torch.zeros(num_nodes, dtype=torch.bool, device=edge_index.device)
+        legal[dst[src == current_nodes[owner]]] = True
+        return legal
 
+    def conv(self, x, edge_index, edge_attr):
+        """
+        Shared conv stack, returns the raw (unmasked) policy and value outputs
+        - x is either (# of nodes, n_features) or a stack of states over the same graph (K, # of nodes, n_features),
+          GraphConv propagates along the node dimension so the K states share a single pass over edge_index
+        """
         # Layer 1, input
         x = self.conv_in(x, edge_index, edge_attr)
         x = F.relu(x)
@@ -59,18 +61,61 @@ class GCN(nn.Module):
         p = self.policy_conv(x, edge_index, edge_attr)
         v = self.value_conv(x, edge_index, edge_attr)
 
-        # Apply a mask to 0-out illegal move policy + value
-        mask = self.illegal_moves_mask(game)
-        p: torch.Tensor = mask * p.t()
-        v: torch.Tensor = mask * v.t()
-
-        # Set zero'd policy to -inf to force softmax to 0
-        p[p == 0] = float('-inf')
-
-        # Apply softmax to policy vector to convert logits to probability
-        p = F.softmax(p, dim=1)
+        return p, v
 
-        return p.view(-1), v.view(-1) # HACK: is cloning here correct?
+    def forward(self, data, edge_index=None, edge_attr=None, current_nodes=None, batch=None):
+        """
+        Masked policy (softmax over the legal moves of each graph) and value for one or many game states
+        Accepts any of
+        - a Game: p and v are (# of nodes,)
+        - a PyG Data or Batch with a `state` attribute, the current node of each graph (indexed within its graph):
+          p and v are flat over every node of the batch
+        - tensors x, edge_index, edge_attr, current_nodes and an optional batch vector, where x is either
+            (# of nodes, n_features), current_nodes indexed over all nodes: p and v are flat over every node, or
+            a stack of K states of the same graph (K, # of nodes, n_features), current_nodes (K,): p and v are (K, # of nodes)
+        """
+        if isinstance(data, Game):
+            x, edge_index, edge_attr = data.graph.x, data.graph.edge_index, data.graph.edge_attr
+            current_nodes = torch.tensor([data.current_node])
+        elif isinstance(data, Data):
+            x, edge_index, edge_attr = data.x, data.edge_index, data.edge_attr
+            batch = data.batch
+            state = torch.as_tensor(data.state).view(-1)
+            current_nodes = state + data.ptr[:-1] if batch is not None else state
+        else:
+            x = data
+
+        p, v = self.conv(x, edge_index, edge_attr)
+        p, v = p[..., 0], v[..., 0]
+
+        if x.dim() == 3:
+            return self.mask_states(p, v, edge_index, current_nodes)
+
+        n_graphs = current_nodes.numel()
+        legal = self.legal_moves_mask(edge_index, current_nodes, x.shape[0], batch)
+        p = self._masked_softmax(p, legal, batch, n_graphs)
+        return p, v*legal
+
+    @staticmethod
+    def mask_states(p: torch.Tensor, v: torch.Tensor, edge_index: torch.Tensor, current_nodes: torch.Tensor):
+        """Masked policy and value for raw (K, # of nodes) outputs of K states of the same graph"""
+        # flatten the K states into K disjoint graphs of n nodes
+        k, n = p.shape
+        rows, cols = (edge_index[0].unsqueeze(0) == current_nodes.view(-1, 1)).nonzero(as_tuple=True)
+        legal = torch.zeros(k, n, dtype=torch.bool, device=p.device)
+        legal[rows, edge_index[1, cols]] = True
+        batch = torch.arange(k, device=p.device).repeat_interleave(n)
+        p = GCN._masked_softmax(p.reshape(-1), legal.view(-1), batch, k).view(k, n)
+        return p, v*legal
+
+    @staticmethod
+    def _masked_softmax(logits: torch.Tensor, legal: torch.Tensor, batch: torch.Tensor, n_graphs: int):
+        # softmax over each graph's legal entries, illegal entries (and graphs without legal moves) are 0
+        idx = legal.nonzero(as_tuple=True)[0]
+        owner = batch[idx] if batch is not None else torch.zeros_like(idx)
+        p = torch.zeros_like(logits)
+        p[idx] = segment_softmax(logits[idx], owner, num_nodes=n_graphs)
+        return p
 
 class GCNLoss(nn.Module):
     def __init__(self):
@@ -84,16 +129,25 @@ class GCNLoss(nn.Module):
         """
         return (z_prime - v_a)**2
     
-    def cross_entropy(self, p: torch.Tensor, pi: torch.Tensor):
+    def cross_entropy(self, p: torch.Tensor, pi: torch.Tensor, batch: torch.Tensor = None):
         """
         Cross entropy loss function. Compares the 
         :param p: policy vector (what's provided initially by the neural network)
         :param pi: enhanced policy vector (refined policy vector from the MCTS)
+        :param batch: for a batch of graphs, the graph of each entry of the (flat) p and pi
         """
         if len(p) != len(pi):
             raise Exception("Length of policy vector (p) does not match length of enhanced policy vector (pi)")
-        return torch.mean(-torch.sum(pi * torch.log(p), 1))
+        if batch is None:
+            return torch.mean(-torch.sum(pi * torch.log(p), 1))
+
+        # illegal moves have p = 0 and pi = 0, clamp so they contribute 0 instead of 0 * -inf
+        terms = -pi * torch.log(p.clamp_min(1e-12))
+        per_graph = torch.zeros(int(batch.max()) + 1, dtype=terms.dtype, device=terms.device).index_add_(0, batch, terms)
+        return per_graph.mean()
         
-    def forward(self, z_prime, v_a, p, pi):
-        return self.mse(z_prime, v_a) + self.cross_entropy(p, pi)
+    def forward(self, z_prime, v_a, p, pi, batch: torch.Tensor = None):
+        if batch is None:
+            return self.mse(z_prime, v_a) + self.cross_entropy(p, pi)
+        return torch.mean(self.mse(z_prime, v_a)) + self.cross_entropy(p, pi, batch)
     
\ No newline at end of file
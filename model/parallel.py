@@ -0,0 +1,85 @@
+'''
+parallel - worker processes for root-parallel MCTS (MCTSConfig.workers > 1)
+
+A search's selection and backup are Python, so threads would serialize on the GIL: the extra searches of a move run
+in a pool of processes instead, each holding its own copy of the network and of the game's graph and adjacency
+index (both handed over once, when the pool starts).  Each call then only ships the config and the game's state:
+start node, current node and visited bitmap.
+
+Pools are kept per (network, worker count) for the life of the process, so only the first move on a graph pays for
+starting them; a search on another graph replaces the pool.  Workers keep the network as it was when their pool
+started, call close_pools() after changing its weights.
+'''
+
+import multiprocessing as mp
+
+import numpy as np
+import torch
+
+from game import Game
+
+# Per-process network and a game on the pool's graph, set by _worker_init
+_worker_network = None
+_worker_game: Game = None
+
+def _worker_threads():
+    """Initializer step of every worker process: one torch thread per process, the parallelism comes from the processes"""
+    torch.set_num_threads(1)
+
+def _worker_init(network, game: Game):
+    global _worker_network, _worker_game
+
+    _worker_threads()
+    _worker_network = network
+    _worker_game = game.clone()
+
+def game_state(game: Game):
+    """What a worker needs besides the graph to rebuild the game: (start node, current node, packed visited bitmap)"""
+    return game.start_node, game.current_node, np.packbits(game.graph.x[:, 0].numpy() > 0)
+
+def _worker_search(config, state):
+    """One search in a worker, returns the root's (actions, N, visits), simulations run and network calls"""
+    from mcts import mcts
+
+    start_node, current_node, packed = state
+    visited = np.unpackbits(packed, count=_worker_game.graph.x.shape[0]).astype(bool)
+    game = _worker_game.clone()
+    game.graph.x[:, 0] = torch.from_numpy(visited.astype(np.float32))
+    game.start_node, game.current_node = start_node, current_node
+    game.visited = set(np.flatnonzero(visited).tolist())
+    game.is_terminal = False
+
+    _, tree = mcts(config, game, _worker_network, return_tree=True)
+    edges = tree.edges(tree.root)
+    return tree.action[edges].copy(), tree.N[edges].copy(), int(tree.visits[tree.root]), tree.simulations, tree.network_calls
+
+class SearchPool:
+    def __init__(self, network, n_workers: int, game: Game):
+        self.network = network # also keeps id(network) from being reused while the pool exists
+        self.index = game.index # the graph the workers hold, shared by every clone of the game
+        self.n_workers = n_workers
+        context = mp.get_context('fork') if 'fork' in mp.get_all_start_methods() else mp.get_context()
+        self.pool = context.Pool(n_workers, initializer=_worker_init, initargs=(network, game))
+
+    def submit(self, config, game: Game):
+        return self.pool.apply_async(_worker_search, (config, game_state(game)))
+
+    def close(self):
+        self.pool.terminate()
+        self.pool.join()
+
+_pools = {}
+
+def get_pool(network, n_workers: int, game: Game) -> SearchPool:
+    """The pool for network on game's graph, replacing the pool of an earlier graph"""
+    key = (id(network), n_workers)
+    if key in _pools and _pools[key].index is not game.index:
+        _pools.pop(key).close()
+    if key not in _pools:
+        _pools[key] = SearchPool(network, n_workers, game)
+    return _pools[key]
+
+def close_pools():
+    for pool in _pools.values():
+        pool.close()
+    _pools.clear()
@@ -0,0 +1,107 @@
+'''
+rollout - bounded policy rollouts, K walkers sampled in one batched network call per step
+
+Each walker follows the policy from a start node until it steps onto a node it has already visited, which closes a
+cycle.  Closed cycles are scored by their summed reward (edge_attr, as in Game) and the walker respawns, so the
+batch stays full until the step or time budget runs out.  Sampling uses a seeded generator, so for a given graph,
+model and step budget the result is deterministic.
+'''
+
+import time
+
+import torch
+from torch_geometric.data import Data
+
+from game import GraphIndex
+from engine import GCNEngine
+
+class RolloutConfig:
+    def __init__(self, k=16, max_steps=64, time_budget=None, min_cycle=3, seed=0):
+        # number of walkers, i.e. states per network call
+        self.k = k
+
+        # budget: network calls, and optionally wall clock seconds (checked between steps)
+        self.max_steps = max_steps
+        self.time_budget = time_budget
+
+        # shortest cycle (in edges) worth returning, 2 would be going back and forth along a single pair
+        self.min_cycle = min_cycle
+        self.seed = seed
+
+@torch.no_grad()
+def batched_rollouts(network, graph: Data, config: RolloutConfig, start: int = None):
+    """
+    Best closed cycle found by K parallel policy rollouts within the budget
+    Returns (cycle, reward, steps): cycle as a closed node path (first == last) or None if no walker closed a long
+    enough cycle, its summed reward, and the number of network calls made
+    :param network: a GCN or exported inference model (wrapped in a GCNEngine for the duration) or anything with GCNEngine's call signature
+    :param start: node every walker starts from, random (seeded) nodes if None
+    """
+    n = graph.num_nodes
+    # no walker could take a single step
+    if n == 0 or graph.edge_index.shape[1] == 0:
+        return None, float('-inf'), 0
+
+    index = GraphIndex(graph)
+    if GCNEngine.supports(network):
+        network = GCNEngine(network, graph)
+    generator = torch.Generator().manual_seed(config.seed)
+    deadline = time.perf_counter() + config.time_budget if config.time_budget is not None else None
+
+    k = config.k
+    x = torch.zeros(k, n, 1)
+    current = torch.zeros(k, dtype=torch.long)
+    # per walker bookkeeping goes through NumPy views of x and current, element access on tensors is far slower
+    visited, current_np = x.numpy()[..., 0], current.numpy()
+    paths = [None]*k
+    # cumulative reward up to each node of the walker's path
+    returns = [None]*k
+
+    def spawn(i):
+        s = start if start is not None else int(torch.randint(n, (1,), generator=generator))
+        visited[i] = 0.
+        visited[i, s] = 1.
+        current_np[i] = s
+        paths[i] = [s]
+        returns[i] = [0.]
+
+    for i in range(k):
+        spawn(i)
+
+    best, best_reward, steps = None, float('-inf'), 0
+    while steps < config.max_steps and (deadline is None or time.perf_counter() < deadline):
+        p, _ = network(x, graph.edge_index, graph.edge_attr, current)
+        steps += 1
+
+        # moves back onto the last min_cycle - 1 nodes of a walker's path would close a cycle too short to keep
+        recent = [(i, node) for i, path in enumerate(paths) for node in path[-(config.min_cycle - 1):]] if config.min_cycle > 1 else []
+        if recent:
+            rows, cols = zip(*recent)
+            p[list(rows), list(cols)] = 0.
+
+        # walkers at a dead end (no legal move left) get a dummy distribution and are respawned below
+        dead = p.sum(1) <= 0
+        p[dead] = 1.
+        moves = torch.multinomial(p, 1, generator=generator).view(-1).tolist()
+
+        for i, (v, is_dead) in enumerate(zip(moves, dead.tolist())):
+            if is_dead:
+                spawn(i)
+                continue
+
+            u = int(current_np[i])
+            r = returns[i][-1] + float(index.weight[index.find(u, v)])
+            if visited[i, v] > 0:
+                # closes a cycle back to v
+                first = paths[i].index(v)
+                reward = r - returns[i][first]
+                if len(paths[i]) - first >= config.min_cycle and reward > best_reward:
+                    best, best_reward = paths[i][first:] + [v], reward
+                spawn(i)
+            else:
+                paths[i].append(v)
+                returns[i].append(r)
+                visited[i, v] = 1.
+                current_np[i] = v
+
+    return best, best_reward, steps
@@ -1,19 +1,27 @@
-import copy
 import random
 import math
 import os
+import time
+import traceback
+import argparse
+import multiprocessing as mp
 
+import numpy as np
 import torch
 from torch_geometric.data import Data
+from torch_geometric.loader import DataLoader
 
 import sys
 sys.path.insert(1, 'utils')
 
 from graphutils import create_random_graph
 
-from model import GCN
+from model import GCN, GCNLoss
 from game import Game
 from mcts import MCTSConfig, mcts
+from parallel import _worker_threads
+from dataset import ShardWriter, ShardReader
+from inference import load_model
 
 @torch.no_grad
 def eval(model: GCN):
@@ -57,7 +65,7 @@ def eval(model: GCN):
 
     print(f"Total Reward: {total_reward}")
 
-def generate_data(network: GCN, graph: Data):
+def generate_data(network: GCN, graph: Data, reuse_tree: bool = True):
     """
     Self-play Data Generation
     Require: Network f_θ, Initial graph G_0
@@ -79,26 +87,35 @@ def generate_data(network: GCN, graph: Data):
             Replace (s, a, π) with (s, a, π, z')
         end for
         return records
+
+    Only the visited flags change between the states of a game, so rather than a copy of the graph per step this
+    returns the records alongside the visited bitmap of the state each record was taken in (same order).
+    The graph topology is the one passed in, a full Data can be rebuilt with dataset.materialize.
+
+    With reuse_tree, each search continues from the subtree of the previous search under the chosen action
+    (statistics included), so it only runs the simulations needed to top that subtree up to the budget.
     """
 
     game = Game(graph)
     print(f"----- Initialized Game -----\n Edge Index: {game.graph.edge_index.shape}\n Edge Attr: {game.graph.edge_attr.shape}\n x: {game.graph.x.shape}\n Starting Node: {game.start_node}\n")
 
     records = []
-    graphs = []
+    visited = []
 
     config = MCTSConfig(1000, logging=False)
-    network = GCN(1, 1)
 
     i = 0
     total_rewards = 0.0
-    while not game.get_is_terminal():
+    tree = None
+    # a node without outward edges is a dead end, the game stops there as it would at a terminal state
+    while not game.get_is_terminal() and game.get_out_degree() > 0:
         #print(i, f"visited: {game.visited}")
-        pi = mcts(config, game, network)
+        pi, tree = mcts(config, game, network, tree=tree, return_tree=True)
         action = torch.multinomial(pi, 1).item()
-        current_state = copy.deepcopy(game.current_node) # TODO: these deepcopies might be unneccessary
+        tree = tree.subtree(action) if reuse_tree else None
+        current_state = game.current_node
+        visited.append((game.graph.x[:, 0] > 0).numpy().copy())
         state, reward, terminal = game.step(torch.tensor([current_state, action]))
-        graphs.append(copy.deepcopy(game.graph))
         records.append((current_state, action, pi, reward))
         #print(f"action: {action}")
         total_rewards += reward
@@ -107,8 +124,8 @@ def generate_data(network: GCN, graph: Data):
     z = 0
     # reward_list = torch.tensor([])
     final_records = []
-    final_graphs = []
-    for G, R in zip(reversed(graphs), reversed(records)):
+    final_visited = []
+    for V, R in zip(reversed(visited), reversed(records)):
         s, a, p, r = R
         # reward_list = torch.cat((reward_list, torch.tensor([r])), 0)
         z += r
@@ -117,45 +134,176 @@ def generate_data(network: GCN, graph: Data):
         # z_prime = (z - torch.mean(reward_list).item()) / torch.std(reward_list).item() if (not torch.std(reward_list).isnan().item()) and (torch.std(reward_list).item() != 0) else 0
         z_prime = total_rewards # HACK: Now, we use cumulative rewards
         final_records.append((s, a, p, z_prime))
-        final_graphs.append(G)
+        final_visited.append(V)
+
+    return final_records, final_visited
+
+def random_selfplay_graph():
+    # HACK: these parameters are pretty arbitrary atm...
+    n_nodes = random.randint(10, 100)
+    n_edges = random.randint(n_nodes, math.floor((n_nodes - 1)*n_nodes*(1/2))) # ranges from one edge per node to fully connected
+    return create_random_graph(n_nodes, n_edges)
+
+def run_datagen(niter: int, model_path: str = "model/model_b2.pth", dset_path: str = "model/dset4", shard_size: int = 4096):
+
+    # Replace with path to the current best model (a pickled GCN or an exported inference artifact)
+    nn = load_model(model_path)
+
+    # Append generated data to the sharded dataset
+    # - TODO: fix this path logic using __file__
+    # - for now, replace with a new directory name for the desired dataset location
+    with ShardWriter(dset_path, shard_size) as writer:
+        for i in range(niter):
+            try:
+                print(f'# ---- Iteration {i} ---- #')
+                G = random_selfplay_graph()
+                records, visited = generate_data(nn, G)
+                writer.add_game(G, records, visited)
+            except Exception:
+                print(f'Iteration {i} failed:\n{traceback.format_exc()}')
+                continue
+
+# --- Parallel self-play --- #
 
-    return final_records, final_graphs
+# Per-process network, loaded once by _selfplay_worker_init
+_worker_network: GCN = None
 
-def run_datagen(niter: int):
+def _selfplay_worker_init(model_path: str):
+    global _worker_network
+
+    _worker_threads()
+    _worker_network = load_model(model_path)
+
+def _selfplay_game(args):
+    i, seed = args
+
+    # every game gets its own seed, so results do not depend on how games are scheduled across workers
+    random.seed(seed)
+    np.random.seed(seed)
+    torch.manual_seed(seed)
+
+    try:
+        G = random_selfplay_graph()
+        records, visited = generate_data(_worker_network, G)
+        return i, G, records, visited, None
+    except Exception:
+        return i, None, None, None, traceback.format_exc()
+
+def run_datagen_parallel(niter: int, n_workers: int = None, model_path: str = "model/model_b2.pth",
+                         dset_path: str = "model/dset4", seed: int = 0, shard_size: int = 4096):
+    """
+    Self-play data generation across a pool of worker processes
+    - each worker loads the network once and plays whole games (create_random_graph + generate_data), records are
+      streamed back to this process as games finish and written from here
+    - returns the throughput counters: games, records, failures, elapsed seconds, games/sec and records/sec
+    """
+    n_workers = n_workers or os.cpu_count()
+    stats = {"games": 0, "records": 0, "failures": 0}
 
-    # Replace with path to the current best model
-    nn = torch.load("model/model_b2.pth")
+    start = time.perf_counter()
+    with mp.Pool(n_workers, initializer=_selfplay_worker_init, initargs=(model_path,)) as pool, \
+         ShardWriter(dset_path, shard_size) as writer:
+        games = ((i, seed + i) for i in range(niter))
+        for i, G, records, visited, error in pool.imap_unordered(_selfplay_game, games):
+            if error is not None:
+                stats["failures"] += 1
+                print(f'Game {i} failed:\n{error}')
+                continue
 
-    for i in range(niter):
-        try:
-            print(f'# ---- Iteration {i} ---- #')
-            dset = {"X": [], "Y": []}
+            writer.add_game(G, records, visited)
 
-            # HACK: these parameters are pretty arbitrary atm...
-            n_nodes = random.randint(10, 100)
-            n_edges = random.randint(n_nodes, math.floor((n_nodes - 1)*n_nodes*(1/2))) # ranges from one edge per node to fully connected
+            stats["games"] += 1
+            stats["records"] += len(records)
+            elapsed = time.perf_counter() - start
+            print(f'# ---- Game {i} ({stats["games"]}/{niter}) | {stats["games"]/elapsed:.3f} games/sec | {stats["records"]/elapsed:.2f} records/sec ---- #')
 
-            G = create_random_graph(n_nodes, n_edges)
-            
-            records, graphs = generate_data(nn, G)
+    stats["elapsed"] = time.perf_counter() - start
+    stats["games_per_sec"] = stats["games"]/stats["elapsed"]
+    stats["records_per_sec"] = stats["records"]/stats["elapsed"]
+    return stats
 
-            dset["X"] = dset["X"] + graphs
-            dset["Y"] = dset["Y"] + records
+# --- Training --- #
 
-            # Dump generated data into existing data file
-            # - TODO: fix this path logic using __file__
-            # - for now, replace with a new file name for the desired dataset location
-            if not os.path.exists('model/dset4.pth'):
-                torch.save(dset, 'model/dset4.pth')
-            else:
-                existing_dset = torch.load('model/dset4.pth')
-                existing_dset["X"] = existing_dset["X"] + dset['X']
-                existing_dset["Y"] = existing_dset["Y"] + dset['Y']
-                torch.save(existing_dset, 'model/dset4.pth')
-        except:
-            continue
+def save_checkpoint(model: GCN, path: str):
+    # same pickled-module format the backend loads, written to a temporary file first so a crash can't corrupt it
+    tmp = path + '.tmp'
+    torch.save(model, tmp)
+    os.replace(tmp, path)
+
+def run_training(dset_path: str = "model/dset4", model_path: str = "model/model_b3.pth", init_path: str = None,
+                 epochs: int = 10, batch_size: int = 64, num_workers: int = 0, lr: float = 1e-3, log_every: int = 50):
+    """
+    Train the GCN on self-play shards
+    - records are collated into PyG Batches of batch_size graphs and the whole batch goes through the GCN in one
+      pass, the policy is masked and softmaxed per graph
+    - the model is checkpointed to model_path after every epoch
+    :param init_path: checkpoint to start from, a fresh GCN otherwise
+    """
+    dataset = ShardReader(dset_path)
+    loader = DataLoader(dataset, batch_size=batch_size, shuffle=True, num_workers=num_workers,
+                        persistent_workers=num_workers > 0)
+    print(f"----- Training on {len(dataset)} records from {dset_path} -----")
+
+    model: GCN = torch.load(init_path, weights_only=False) if init_path else GCN(1, 1)
+    optimizer = torch.optim.Adam(model.parameters(), lr=lr)
+    loss_fn = GCNLoss()
+
+    for epoch in range(epochs):
+        model.train()
+        total_loss, samples = 0.0, 0
+        start = time.perf_counter()
+        for step, batch in enumerate(loader):
+            p, v = model(batch)
+
+            # value of the action taken from each record's state
+            v_a = v[batch.ptr[:-1] + batch.action]
+            loss = loss_fn(batch.z, v_a, p, batch.pi, batch.batch)
+
+            optimizer.zero_grad()
+            loss.backward()
+            optimizer.step()
+
+            total_loss += loss.item()*batch.num_graphs
+            samples += batch.num_graphs
+            if log_every and step % log_every == 0:
+                print(f" step {step} | loss {loss.item():.4f} | {samples/(time.perf_counter() - start):.1f} samples/sec")
+
+        elapsed = time.perf_counter() - start
+        print(f"# ---- Epoch {epoch} | loss {total_loss/max(samples, 1):.4f} | {samples/elapsed:.1f} samples/sec ---- #")
+        save_checkpoint(model, model_path)
+
+    return model
 
 if __name__ == '__main__':
-    run_datagen(1000)
+    parser = argparse.ArgumentParser(description="Self-play data generation and training")
+    commands = parser.add_subparsers(dest='command')
+
+    datagen = commands.add_parser('datagen', help='generate self-play data (the default)')
+    datagen.add_argument('--niter', type=int, default=1000, help='number of self-play games')
+    datagen.add_argument('--workers', type=int, default=1, help='worker processes, more than 1 uses run_datagen_parallel')
+    datagen.add_argument('--model', default="model/model_b2.pth")
+    datagen.add_argument('--out', default="model/dset4", help='sharded dataset directory')
+    datagen.add_argument('--shard-size', type=int, default=4096, help='records per shard file')
+    datagen.add_argument('--seed', type=int, default=0)
+
+    train = commands.add_parser('train', help='train the GCN on self-play data')
+    train.add_argument('--data', default="model/dset4", help='sharded dataset directory')
+    train.add_argument('--out', default="model/model_b3.pth", help='checkpoint to write')
+    train.add_argument('--init', default=None, help='checkpoint to start from')
+    train.add_argument('--epochs', type=int, default=10)
+    train.add_argument('--batch-size', type=int, default=64)
+    train.add_argument('--workers', type=int, default=0, help='DataLoader worker processes')
+    train.add_argument('--lr', type=float, default=1e-3)
+
+    args = parser.parse_args()
+    if args.command is None:
+        args = parser.parse_args(['datagen'])
+
+    if args.command == 'train':
+        run_training(args.data, args.out, args.init, args.epochs, args.batch_size, args.workers, args.lr)
+    elif args.workers > 1:
+        print(run_datagen_parallel(args.niter, args.workers, args.model, args.out, args.seed, args.shard_size))
+    else:
+        run_datagen(args.niter, args.model, args.out, args.shard_size)
 
     # network = GCN(1, 1)
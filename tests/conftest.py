@@ -0,0 +1,8 @@
+import os
+import sys
+
+# the modules import each other flat (from game import Game, ...), as the scripts do with their sys.path inserts
+# - model/ goes first, so `model` is model/model.py rather than the model/ package
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+for directory in ('api', 'utils', 'model'):
+    sys.path.insert(0, os.path.join(ROOT, directory))
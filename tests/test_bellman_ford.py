@@ -0,0 +1,43 @@
+import networkx as nx
+import numpy as np
+import pytest
+import torch
+
+from bellman_ford import find_negative_cycle
+from graphutils import create_random_graph
+
+def random_costs(seed: int):
+    """Seeded random graph with costs mostly positive, so only some of the graphs have a negative cycle"""
+    rng = np.random.default_rng(seed)
+    n = int(rng.integers(2, 30))
+    graph = create_random_graph(n, int(rng.integers(1, n*(n - 1) + 1)), seed=rng)
+    graph.edge_attr = torch.from_numpy(rng.uniform(-0.15, 1, (graph.edge_index.shape[1], 1)))
+    return graph
+
+def to_networkx(graph):
+    G = nx.DiGraph()
+    G.add_nodes_from(range(graph.num_nodes))
+    for (u, v), cost in zip(graph.edge_index.t().tolist(), graph.edge_attr.view(-1).tolist()):
+        G.add_edge(u, v, weight=cost)
+    return G
+
+@pytest.mark.parametrize('seed', range(200))
+def test_matches_networkx(seed):
+    graph = random_costs(seed)
+    cycle = find_negative_cycle(graph)
+    assert (cycle is not None) == nx.negative_edge_cycle(to_networkx(graph))
+    if cycle is None:
+        return
+
+    # a simple closed path along the edges it reports, with their total cost, which is negative
+    edge_index, cost = graph.edge_index.numpy(), graph.edge_attr.view(-1).numpy()
+    assert cycle.nodes[0] == cycle.nodes[-1]
+    assert len(set(cycle.nodes[:-1])) == len(cycle.nodes) - 1 == len(cycle)
+    for (u, v), e in zip(zip(cycle.nodes, cycle.nodes[1:]), cycle.edges):
+        assert (edge_index[0, e], edge_index[1, e]) == (u, v)
+    assert cycle.cost == pytest.approx(cost[cycle.edges].sum())
+    assert cycle.cost < 0
+
+def test_both_outcomes_covered():
+    found = sum(find_negative_cycle(random_costs(seed)) is not None for seed in range(200))
+    assert 20 < found < 180
@@ -0,0 +1,62 @@
+import numpy as np
+import torch
+from torch_geometric.data import Data
+
+from dataset import ShardReader, ShardWriter, import_legacy_dset
+from graphutils import create_random_graph
+
+def random_game(rng, n_nodes, n_records):
+    """A graph and n_records (s, a, π, z') records with their visited bitmaps"""
+    graph = create_random_graph(n_nodes, 3*n_nodes, seed=rng)
+    records, visited = [], []
+    for _ in range(n_records):
+        pi = torch.from_numpy(rng.dirichlet(np.ones(n_nodes))).float()
+        records.append((int(rng.integers(n_nodes)), int(rng.integers(n_nodes)), pi, float(rng.normal())))
+        visited.append(rng.random(n_nodes) < 0.3)
+    return graph, records, visited
+
+def assert_record(data, graph, record, visited):
+    s, a, pi, z = record
+    assert (data.state, data.action) == (s, a)
+    assert torch.equal(data.pi, pi) and data.z == np.float32(z)
+    assert torch.equal(data.x.view(-1), torch.from_numpy(visited).float())
+    assert torch.equal(data.edge_index, graph.edge_index) and torch.equal(data.edge_attr, graph.edge_attr)
+
+def test_round_trip_across_shards(tmp_path):
+    rng = np.random.default_rng(0)
+    # node counts that aren't multiples of 8, so the packed bitmaps have padding
+    games = [random_game(rng, n, k) for n, k in [(10, 4), (13, 3), (21, 5), (9, 2)]]
+    with ShardWriter(str(tmp_path), shard_size=6) as writer:
+        for game in games[:3]:
+            writer.add_game(*game)
+    # a later writer appends to the same dataset
+    with ShardWriter(str(tmp_path)) as writer:
+        writer.add_game(*games[3])
+
+    expected = [(graph, record, v) for graph, records, visited in games for record, v in zip(records, visited)]
+    reader = ShardReader(str(tmp_path))
+    assert len(reader.manifest["shards"]) == 3
+    assert len(reader) == len(expected) == 14
+
+    for i, (graph, record, visited) in enumerate(expected):
+        assert_record(reader[i], graph, record, visited)
+    for data, (graph, record, visited) in zip(reader, expected):
+        assert_record(data, graph, record, visited)
+    assert_record(reader[-1], *expected[-1])
+    assert not list(tmp_path.glob('*.tmp'))
+
+def test_import_legacy_dset(tmp_path):
+    rng = np.random.default_rng(1)
+    X, Y = [], []
+    for n in (10, 17):
+        graph, records, visited = random_game(rng, n, 3)
+        for record, v in zip(records, visited):
+            X.append(Data(x=torch.from_numpy(v).float().view(-1, 1), edge_index=graph.edge_index, edge_attr=graph.edge_attr))
+            Y.append(record)
+    torch.save({"X": X, "Y": Y}, tmp_path/'dset.pth')
+
+    import_legacy_dset(str(tmp_path/'dset.pth'), str(tmp_path/'shards'), shard_size=4)
+    reader = ShardReader(str(tmp_path/'shards'))
+    assert len(reader) == len(Y) and len(reader.manifest["shards"]) == 2
+    for data, G, record in zip(reader, X, Y):
+        assert_record(data, G, record, G.x[:, 0].numpy() > 0)
@@ -0,0 +1,36 @@
+import numpy as np
+import pytest
+import torch
+
+from engine import GCNEngine
+from game import Game
+from graphutils import create_random_graph
+from model import GCN
+
+@pytest.mark.parametrize('seed', range(5))
+def test_engine_matches_the_gcn_along_a_game(seed):
+    torch.manual_seed(seed)
+    gcn = GCN(1, 1).eval()
+    rng = np.random.default_rng(seed)
+    game = Game(create_random_graph(25, 150, seed=seed), 0)
+    # built once at the start state, later states go through the incremental first layer
+    engine = GCNEngine(gcn, game.graph)
+
+    states, currents = [], []
+    while not game.get_is_terminal() and game.get_out_degree() > 0:
+        with torch.no_grad():
+            p_ref, v_ref = gcn(game)
+        p, v = engine(game)
+        assert torch.allclose(p, p_ref, atol=1e-6) and torch.allclose(v, v_ref, atol=1e-5)
+
+        states.append((game.graph.x.clone(), p_ref, v_ref))
+        currents.append(game.current_node)
+        targets, _ = game.index.neighbours(game.current_node)
+        game.step(torch.tensor([game.current_node, int(rng.choice(targets))]))
+    assert len(states) > 1
+
+    # the same states as one stack
+    x = torch.stack([x for x, _, _ in states])
+    p, v = engine(x, game.graph.edge_index, game.graph.edge_attr, torch.tensor(currents))
+    assert torch.allclose(p, torch.stack([p for _, p, _ in states]), atol=1e-6)
+    assert torch.allclose(v, torch.stack([v for _, _, v in states]), atol=1e-5)
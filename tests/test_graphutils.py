@@ -0,0 +1,19 @@
+import pytest
+
+from graphutils import create_market_graph
+
+@pytest.mark.parametrize('seed', range(20))
+def test_planted_cycles_hold(seed):
+    # many long cycles on a small market, overlapping ones would be likely without the rejection
+    graph, cycles = create_market_graph(4, 4, num_cycles=4, cycle_length=6, profit=0.01, seed=seed)
+    weights = dict(zip(map(tuple, graph.edge_index.t().tolist()), graph.edge_attr.view(-1).tolist()))
+
+    edges = [(u, v) for cycle in cycles for u, v in zip(cycle, cycle[1:])]
+    assert len(cycles) == 4 and len(set(edges)) == len(edges) == 4*6
+    for cycle in cycles:
+        assert sum(weights[u, v] for u, v in zip(cycle, cycle[1:])) == pytest.approx(0.01, abs=1e-5)
+
+def test_too_many_cycles():
+    # 3 cycles of 4 edges need 12 of the 8 edges of a 2 x 2 market
+    with pytest.raises(ValueError):
+        create_market_graph(2, 2, num_cycles=3, cycle_length=4, seed=0)
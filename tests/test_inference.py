@@ -0,0 +1,43 @@
+import pytest
+import torch
+
+from engine import GCNEngine
+from graphutils import create_random_graph
+from inference import export, load_model
+from model import GCN
+
+@pytest.fixture
+def gcn():
+    torch.manual_seed(0)
+    return GCN(1, 1).eval()
+
+def saved(gcn, path, format):
+    if format == 'pickle':
+        torch.save(gcn, path)
+    elif format == 'bare_state_dict':
+        torch.save(gcn.state_dict(), path)
+    else:
+        export(gcn, path, format)
+    return path
+
+@pytest.mark.parametrize('format', ['script', 'state_dict', 'bare_state_dict', 'pickle'])
+def test_every_format_matches_the_gcn(gcn, tmp_path, format):
+    network = load_model(saved(gcn, str(tmp_path/'model.pt'), format))
+
+    graph = create_random_graph(30, 200, seed=0)
+    x = (torch.rand(4, 30, 1) < 0.3).float()
+    current = torch.tensor([0, 3, 7, 29])
+    with torch.no_grad():
+        p_ref, v_ref = GCNEngine(gcn, graph)(x, graph.edge_index, graph.edge_attr, current)
+        p, v = GCNEngine(network, graph)(x, graph.edge_index, graph.edge_attr, current)
+        assert torch.allclose(p, p_ref, atol=1e-6) and torch.allclose(v, v_ref, atol=1e-5)
+        if format != 'pickle':
+            # exported models also evaluate state stacks by themselves
+            p, v = network(x, graph.edge_index, graph.edge_attr, current)
+            assert torch.allclose(p, p_ref, atol=1e-6) and torch.allclose(v, v_ref, atol=1e-5)
+
+def test_not_a_model(tmp_path):
+    path = str(tmp_path/'other.pt')
+    torch.save({"weights": torch.zeros(3)}, path)
+    with pytest.raises(ValueError, match='not a model'):
+        load_model(path)
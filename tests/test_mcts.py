@@ -0,0 +1,194 @@
+import time
+
+import numpy as np
+import pytest
+import torch
+from torch_geometric.data import Data
+
+from game import Game
+from model import GCN
+from mcts import MCTSConfig, MCTSTree, TranspositionTable, mcts, state_key
+
+# 6 nodes, every node has out-edges, weights chosen by hand
+EDGES = [(0, 1, 0.5), (0, 2, -0.2), (0, 3, 0.1), (1, 2, 0.3), (1, 4, -0.7), (2, 0, 0.2), (2, 3, 0.9), (2, 5, -0.1),
+         (3, 1, 0.4), (3, 4, 0.6), (4, 0, -0.3), (4, 5, 0.8), (5, 0, 0.05), (5, 3, -0.5)]
+
+def small_graph():
+    return Data(x=torch.zeros(6, 1), edge_index=torch.tensor([(u, v) for u, v, _ in EDGES]).t(),
+                edge_attr=torch.tensor([[w] for _, _, w in EDGES]))
+
+def network():
+    torch.manual_seed(0)
+    return GCN(1, 1).eval()
+
+def root_visits(tree):
+    edges = tree.edges(tree.root)
+    return dict(zip(tree.action[edges].tolist(), tree.N[edges].tolist()))
+
+# policy and root visit counts of the object-based search the array-backed MCTSTree replaced, on small_graph from
+# node 0 with network()
+@pytest.mark.parametrize('c_iter, c_puct, policy, visits', [
+    (5, 1.5, [0., 1., 0., 0., 0., 0.], {1: 9, 2: 0, 3: 0}),
+    (20, 50., [0., 0.312707, 0.312707, 0.374586, 0., 0.], {1: 12, 2: 12, 3: 15}),
+    (20, 1000., [0., 0.314503, 0.353028, 0.332469, 0., 0.], {1: 12, 2: 14, 3: 13}),
+])
+def test_matches_the_object_tree_search(c_iter, c_puct, policy, visits):
+    pi, tree = mcts(MCTSConfig(c_iter, logging=False, c_puct=c_puct), Game(small_graph(), 0), network(), return_tree=True)
+    assert pi.tolist() == pytest.approx(policy, abs=1e-6)
+    assert root_visits(tree) == visits
+    assert tree.visits[tree.root] == sum(visits.values())
+
+def legal(game, node):
+    targets, _ = game.index.neighbours(node)
+    return set(targets.tolist())
+
+def assert_consistent(tree):
+    """Every visit in the tree is a finished simulation's: no virtual loss or in-flight visit is left over"""
+    n_edges = tree.n_edges_total
+    N, W, Q = tree.N[:n_edges], tree.W[:n_edges], tree.Q[:n_edges]
+    assert (N >= 0).all() and (tree.visits[:len(tree)] >= 0).all()
+    assert (W[N == 0] == 0).all() and (Q[N == 0] == 0).all()
+    assert np.allclose(Q[N > 0], W[N > 0]/N[N > 0])
+    for node in np.flatnonzero(tree.expanded[:len(tree)]):
+        assert tree.visits[node] == tree.N[tree.edges(node)].sum()
+
+@pytest.mark.parametrize('batch_size', [2, 4, 7])
+def test_batched_search(batch_size):
+    game = Game(small_graph(), 0)
+    config = MCTSConfig(10, logging=False, c_puct=50., batch_size=batch_size, transpositions=False)
+    pi, tree = mcts(config, game, network(), return_tree=True)
+
+    assert tree.simulations == 10*game.get_n_actions()
+    assert float(pi.sum()) == pytest.approx(1.)
+    assert set(torch.nonzero(pi).view(-1).tolist()) <= legal(game, 0)
+    assert_consistent(tree)
+    # the first batch's leaves are all the (unexpanded) root, every later simulation backs up through it once
+    assert tree.visits[tree.root] == tree.simulations - batch_size
+
+def test_subtree_keeps_the_child_statistics():
+    game = Game(small_graph(), 0)
+    _, tree = mcts(MCTSConfig(20, logging=False, c_puct=50.), game, network(), return_tree=True)
+
+    for action in (1, 2, 3):
+        edge = tree.edges(tree.root).start + int(np.flatnonzero(tree.action[tree.edges(tree.root)] == action)[0])
+        child = tree.child[edge]
+        sub = tree.subtree(action)
+
+        assert sub.root == 0 and sub.state[sub.root] == action and sub.parent_edge[sub.root] == -1
+        assert sub.visits[sub.root] == tree.visits[child]
+        assert sub.mu[sub.root] == tree.mu[child] and sub.sigma[sub.root] == tree.sigma[child]
+        for name in ('N', 'W', 'Q', 'P', 'action'):
+            assert np.array_equal(getattr(sub, name)[sub.edges(sub.root)], getattr(tree, name)[tree.edges(child)])
+        # every node's edges point back to it
+        for node in np.flatnonzero(sub.expanded[:len(sub)]):
+            assert (sub.parent[sub.edges(node)] == node).all()
+        assert_consistent(sub)
+
+    assert tree.subtree(4) is None # not a legal action from 0
+
+def test_game_with_tree_reuse_stays_legal():
+    torch.manual_seed(0)
+    game, net, tree = Game(small_graph(), 0), network(), None
+    config = MCTSConfig(10, logging=False, c_puct=50.)
+    reused = 0
+    while not game.get_is_terminal() and game.get_out_degree() > 0:
+        # a reused tree's visits count towards the budget
+        visits = int(tree.visits[tree.root]) if tree is not None else 0
+        reused += visits > 0
+        pi, tree = mcts(config, game, net, tree=tree, return_tree=True)
+        if visits:
+            assert tree.simulations == max(10*game.get_n_actions() - visits, 1)
+        action = torch.multinomial(pi, 1).item()
+        assert action in legal(game, game.current_node)
+        tree = tree.subtree(action)
+        game.step(torch.tensor([game.current_node, action]))
+        if tree is not None:
+            assert tree.state[tree.root] == game.current_node
+    assert reused
+
+def test_transposition_table_evicts_the_least_recently_used():
+    table = TranspositionTable(capacity=2)
+    table.put('a', np.array([1.]), 0.1)
+    table.put('b', np.array([2.]), 0.2)
+    assert table.get('a')[1] == 0.1 # 'a' is now the most recent, 'b' goes first
+    table.put('c', np.array([3.]), 0.3)
+
+    assert len(table) == 2
+    assert table.get('b') is None
+    assert table.get('a')[1] == 0.1 and table.get('c')[1] == 0.3
+    assert (table.hits, table.misses) == (3, 1)
+
+def test_state_key_is_the_current_node_and_visited_set():
+    game = Game(small_graph(), 0)
+    other = game.clone()
+    game.step(torch.tensor([0, 1]))
+    game.step(torch.tensor([1, 2]))
+    assert state_key(game) != state_key(other)
+    other.step(torch.tensor([0, 1]))
+    other.step(torch.tensor([1, 2]))
+    assert state_key(game) == state_key(other)
+
+def test_search_hits_the_transposition_table():
+    game, net = Game(small_graph(), 0), network()
+    config = MCTSConfig(20, logging=False, c_puct=50.)
+    pi, tree = mcts(config, game, net, return_tree=True)
+    assert len(tree.table) == tree.network_calls
+
+    # the same search on a new tree sharing the table gets every evaluation from it
+    fresh = MCTSTree(game.get_state())
+    fresh.table = tree.table
+    misses = tree.table.misses
+    pi_fresh, fresh = mcts(config, game, net, tree=fresh, return_tree=True)
+    assert fresh.network_calls == 0 and fresh.table.misses == misses
+    assert torch.equal(pi_fresh, pi)
+
+@pytest.mark.parametrize('share_stats', [False, True])
+def test_share_stats(share_stats):
+    # at this budget the search reaches one state along two paths
+    game = Game(small_graph(), 0)
+    config = MCTSConfig(50, logging=False, c_puct=50., share_stats=share_stats)
+    _, tree = mcts(config, game, network(), return_tree=True)
+    children = tree.child[:tree.n_edges_total]
+    children = children[children != -1]
+
+    if share_stats:
+        # both paths lead to the same tree node, which was only evaluated once
+        assert len(set(children.tolist())) == len(children) - 1
+        assert tree.table.hits == 0
+    else:
+        # only the priors are cached, each path gets its own node
+        assert not tree.transposed
+        assert len(set(children.tolist())) == len(children) == len(tree) - 1
+        assert tree.table.hits == 1
+    assert len(tree.table) == tree.network_calls
+
+def test_time_budget():
+    budget = 0.2
+    start = time.perf_counter()
+    _, tree = mcts(MCTSConfig(None, logging=False, time_budget=budget), Game(small_graph(), 0), network(),
+                   return_tree=True)
+    # the deadline is checked between simulations, one simulation on this graph takes well under the slack
+    assert time.perf_counter() - start < budget + 0.1
+    assert tree.stop_reason == 'time'
+    assert tree.simulations > 1
+
+def test_anytime_budgets():
+    game = Game(small_graph(), 0)
+    _, tree = mcts(MCTSConfig(50, logging=False, node_budget=10), game, network(), return_tree=True)
+    assert tree.stop_reason == 'nodes' and len(tree) >= 10 and tree.simulations < 50*game.get_n_actions()
+
+    _, tree = mcts(MCTSConfig(50, logging=False, call_budget=5), game, network(), return_tree=True)
+    assert tree.stop_reason == 'calls' and tree.network_calls == 5
+
+    with pytest.raises(ValueError):
+        MCTSConfig(None)
+
+def test_early_stop():
+    game = Game(small_graph(), 0)
+    pi, tree = mcts(MCTSConfig(20, logging=False), game, network(), return_tree=True)
+    pi_early, early = mcts(MCTSConfig(20, logging=False, early_stop=True), game, network(), return_tree=True)
+
+    assert tree.stop_reason == 'simulations' and early.stop_reason == 'decided'
+    assert early.simulations < tree.simulations
+    # it only stops once the most visited action can't change
+    assert int(pi_early.argmax()) == int(pi.argmax())
@@ -0,0 +1,33 @@
+import pytest
+import torch
+
+from game import Game
+from mcts import MCTSConfig, SearchStats, mcts
+from parallel import close_pools, get_pool
+from test_mcts import legal, network, small_graph
+
+@pytest.fixture(autouse=True)
+def pools():
+    yield
+    close_pools()
+
+def test_root_parallel_search():
+    game, net = Game(small_graph(), 0), network()
+    stats = SearchStats()
+    config = MCTSConfig(20, logging=False, c_puct=50., workers=2)
+    pi, tree = mcts(config, game, net, return_tree=True, stats=stats)
+
+    # every worker's visits end up in the policy, which covers exactly the root's legal actions
+    assert set(torch.nonzero(pi).view(-1).tolist()) == legal(game, 0)
+    assert float(pi.sum()) == pytest.approx(1.)
+    # each search runs half of c_iter, tree.simulations is their sum
+    assert tree.simulations == 20*game.get_n_actions()
+    assert stats.simulations == tree.simulations
+
+def test_pools_are_kept_per_graph():
+    game, net = Game(small_graph(), 0), network()
+    pool = get_pool(net, 1, game)
+    assert get_pool(net, 1, game.clone()) is pool
+
+    other = get_pool(net, 1, Game(small_graph(), 0))
+    assert other is not pool and get_pool(net, 1, game) is not pool
@@ -0,0 +1,17 @@
+import torch
+from torch_geometric.data import Data
+
+from graphutils import create_random_graph
+from model import GCN
+from rollout import RolloutConfig, batched_rollouts
+
+def test_empty_graphs_find_nothing():
+    network = GCN(1, 1).eval()
+    for n in (0, 5):
+        graph = Data(x=torch.zeros(n, 1), edge_index=torch.zeros(2, 0, dtype=torch.long), edge_attr=torch.zeros(0, 1))
+        assert batched_rollouts(network, graph, RolloutConfig()) == (None, float('-inf'), 0)
+
+def test_rollouts_are_deterministic():
+    network = GCN(1, 1).eval()
+    graph = create_random_graph(20, 120, seed=0)
+    assert batched_rollouts(network, graph, RolloutConfig()) == batched_rollouts(network, graph, RolloutConfig())
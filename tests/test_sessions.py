@@ -0,0 +1,56 @@
+import numpy as np
+import pytest
+
+from sessions import MarketSession
+
+def edges_by_id(session: MarketSession, graph):
+    """(source id, target id) -> edge_attr of every edge of one of the session's graphs"""
+    src, dst = session.nodes.ids[graph.edge_index.numpy()]
+    return dict(zip(zip(src.tolist(), dst.tolist()), graph.edge_attr.view(-1).tolist()))
+
+def links(pairs: dict):
+    return [{"source": u, "target": v, "weight": rate} for (u, v), rate in pairs.items()]
+
+@pytest.mark.parametrize('seed', range(20))
+def test_deltas_match_a_fresh_build(seed):
+    rng = np.random.default_rng(seed)
+    ids = rng.choice(1000, size=40, replace=False).tolist()
+    def random_pair():
+        u, v = rng.choice(ids, size=2, replace=False).tolist()
+        return (min(u, v), max(u, v))
+
+    pairs = {random_pair(): float(rng.uniform(0.5, 2)) for _ in range(30)}
+    session = MarketSession.from_payload([links(pairs), [{"id": i} for i in ids[:20]]])
+
+    for _ in range(30):
+        rates = {random_pair(): float(rng.uniform(0.5, 2)) for _ in range(rng.integers(0, 6))}
+        existing = list(pairs)
+        rates.update({existing[i]: float(rng.uniform(0.5, 2)) for i in rng.integers(len(existing), size=rng.integers(0, 3))})
+        removed = [existing[i] for i in rng.integers(len(existing), size=rng.integers(0, 4))] + [random_pair()]
+
+        session.update(links(rates), [{"source": u, "target": v} for u, v in removed])
+        for pair in removed:
+            pairs.pop(pair, None)
+        pairs.update(rates)
+
+    fresh = MarketSession.from_payload([links(pairs), [{"id": i} for i in session.nodes.ids.tolist()]])
+    assert session.n_edges == fresh.n_edges == 2*len(pairs)
+    for graph in ('market_graph', 'rate_graph', 'model_graph'):
+        assert edges_by_id(session, getattr(session, graph)()) == edges_by_id(fresh, getattr(fresh, graph)())
+
+def test_removing_an_unknown_pair_changes_nothing():
+    from rollout import RolloutConfig, batched_rollouts
+    from model import GCN
+
+    rng = np.random.default_rng(0)
+    ids = list(range(1, 13))
+    pairs = {(u, v): float(rng.uniform(0.5, 2)) for u in ids for v in ids if u < v and rng.random() < 0.4}
+    session = MarketSession.from_payload([links(pairs), [{"id": i} for i in ids]])
+    network = GCN(1, 1).eval()
+    n_nodes, n_edges = session.n_nodes, session.n_edges
+    path = batched_rollouts(network, session.model_graph(), RolloutConfig())
+
+    # neither end known, one end known
+    session.update(removed=[{"source": 999, "target": 998}, {"source": 1, "target": 997}])
+    assert (session.n_nodes, session.n_edges) == (n_nodes, n_edges)
+    assert batched_rollouts(network, session.model_graph(), RolloutConfig()) == path
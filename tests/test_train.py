@@ -0,0 +1,101 @@
+import contextlib
+import io
+import random
+
+import numpy as np
+import pytest
+import torch
+from torch_geometric.data import Batch, Data
+
+from graphutils import create_random_graph
+from inference import export, load_model
+from dataset import ShardReader, ShardWriter
+from model import GCN, GCNLoss
+from train import generate_data, run_training
+
+def count_calls(network):
+    """Counter of the network's policy layer calls, hit both by its own forward and through a GCNEngine"""
+    calls = [0]
+    def hook(module, inputs, output):
+        calls[0] += 1
+    network.policy_conv.lin_rel.register_forward_hook(hook)
+    return calls
+
+def play(network):
+    random.seed(0)
+    np.random.seed(0)
+    torch.manual_seed(0)
+    with contextlib.redirect_stdout(io.StringIO()):
+        return generate_data(network, create_random_graph(6, 16, seed=0))
+
+def test_generate_data_uses_the_given_network():
+    network = GCN(1, 1).eval()
+    calls = count_calls(network)
+    records, visited = play(network)
+    assert len(records) == len(visited) > 0
+    assert calls[0] > 0
+
+def test_generate_data_uses_an_exported_network(tmp_path):
+    path = str(tmp_path/'gcn.sd')
+    export(GCN(1, 1), path, format='state_dict')
+    network = load_model(path)
+    calls = count_calls(network)
+    play(network)
+    assert calls[0] > 0
+
+def random_records(rng, n_nodes, n_records):
+    """A random graph and (s, a, π, z') records whose π and a are over the legal moves of s, with visited bitmaps"""
+    graph = create_random_graph(n_nodes, 3*n_nodes, seed=rng)
+    src, dst = graph.edge_index.numpy()
+    records, visited = [], []
+    for s in rng.choice(np.unique(src), size=n_records):
+        targets = dst[src == s]
+        pi = torch.zeros(n_nodes)
+        pi[targets] = torch.from_numpy(rng.dirichlet(np.ones(len(targets)))).float()
+        records.append((int(s), int(rng.choice(targets)), pi, float(rng.uniform(-1, 1))))
+        v = rng.random(n_nodes) < 0.3
+        v[s] = True
+        visited.append(v)
+    return graph, records, visited
+
+def test_batched_loss_is_the_mean_of_per_sample_losses():
+    torch.manual_seed(0)
+    model, loss_fn = GCN(1, 1), GCNLoss()
+    rng = np.random.default_rng(0)
+    data = []
+    for n_nodes in (7, 12, 20):
+        graph, [(s, a, pi, z)], [v] = random_records(rng, n_nodes, 1)
+        data.append(Data(x=torch.from_numpy(v).float().view(-1, 1), edge_index=graph.edge_index,
+                         edge_attr=graph.edge_attr, state=s, action=a, pi=pi, z=z))
+
+    # one sample at a time, the loss run_training minimizes for a single record
+    losses = []
+    for d in data:
+        p, v = model(d)
+        losses.append((d.z - v[d.action])**2 - torch.sum(d.pi*torch.log(p.clamp_min(1e-12))))
+
+    # the same records as one batch, as in run_training
+    batch = Batch.from_data_list(data)
+    p, v = model(batch)
+    loss = loss_fn(batch.z, v[batch.ptr[:-1] + batch.action], p, batch.pi, batch.batch)
+    assert loss.item() == pytest.approx(torch.stack(losses).mean().item(), rel=1e-5)
+
+def test_run_training_takes_a_step(tmp_path):
+    rng = np.random.default_rng(1)
+    with ShardWriter(str(tmp_path/'dset'), shard_size=8) as writer:
+        for n_nodes in (8, 15):
+            writer.add_game(*random_records(rng, n_nodes, 5))
+    assert len(ShardReader(str(tmp_path/'dset'))) == 10
+
+    torch.manual_seed(0)
+    init = GCN(1, 1)
+    torch.save(init, tmp_path/'init.pth')
+    with contextlib.redirect_stdout(io.StringIO()):
+        model = run_training(str(tmp_path/'dset'), str(tmp_path/'model.pth'), str(tmp_path/'init.pth'), epochs=1,
+                             batch_size=4, log_every=0)
+
+    saved = torch.load(tmp_path/'model.pth', weights_only=False)
+    for name, tensor in init.state_dict().items():
+        assert torch.isfinite(saved.state_dict()[name]).all()
+        assert torch.equal(saved.state_dict()[name], model.state_dict()[name])
+    assert any(not torch.equal(tensor, model.state_dict()[name]) for name, tensor in init.state_dict().items())
@@ -1,4 +1,4 @@
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useRef } from 'react';
 import axios from 'axios';
 import DisplayGraph from './DisplayGraph.jsx'
 import './KrakenAPIStyles.css';
@@ -10,6 +10,7 @@ const KrakenAPI = () => {
   const [nodesObject, setNodesObject] = useState([]);
   const [path, setPath] = useState([]);
   const [showPath, setShowPath] = useState(false);
+  const [noCycle, setNoCycle] = useState(false);
   const [nodeIdMap, setNodeIdMap] = useState({});
   const [animationRunning, setAnimationRunning] = useState(false);
 
@@ -39,6 +40,46 @@ const KrakenAPI = () => {
     }
   }
 
+  // Backend session holding our graph, and the rates last sent to it keyed by "sourceId-targetId"
+  const sessionId = useRef(null);
+  const sentRates = useRef({});
+
+  // Posts the full graph once to open a session, after that only the links whose rate changed (or that disappeared)
+  const postToSession = async (postData) => {
+    // **UPDATE ENDPOINT WHEN USING/TESTING** 
+    const endpoint = 'http://127.0.0.1:5000/sessions';
+    const headers = {'Content-Type': 'application/json'};
+    const linkData = postData[0];
+    const rateKey = link => `${link.source.id}-${link.target.id}`;
+
+    if (sessionId.current) {
+      const current = new Set(linkData.map(rateKey));
+      const changed = linkData.filter(link => sentRates.current[rateKey(link)] !== link.weight);
+      const removed = Object.keys(sentRates.current).filter(key => !current.has(key));
+      try {
+        const response = await axios.patch(`${endpoint}/${sessionId.current}`, {
+          rates: changed.map(link => ({source: link.source.id, target: link.target.id, weight: link.weight})),
+          removed: removed.map(key => {
+            const [source, target] = key.split('-');
+            return {source: Number(source), target: Number(target)};
+          }),
+        }, {headers});
+
+        changed.forEach(link => { sentRates.current[rateKey(link)] = link.weight; });
+        removed.forEach(key => { delete sentRates.current[key]; });
+        return response.data.path;
+      } catch (error) {
+        // the backend dropped our session, open a new one below
+        if (error.response?.status !== 404) throw error;
+      }
+    }
+
+    const response = await axios.post(endpoint, postData, {headers});
+    sessionId.current = response.data.session;
+    sentRates.current = Object.fromEntries(linkData.map(link => [rateKey(link), link.weight]));
+    return response.data.path;
+  }
+
   const postCombinedData = async () => {
 
     const linkData = linksObject.map(link => {
@@ -62,16 +103,12 @@ const KrakenAPI = () => {
 
     const postData = [linkData, nodeData]
     try{
-      // **UPDATE ENDPOINT WHEN USING/TESTING** 
-      const response = await axios.post('http://127.0.0.1:5000/process-graph', postData, {
-        headers: {
-          'Content-Type': 'application/json',
-        }
-      });
-      const responsePath = response.data;
+      const responsePath = await postToSession(postData);
       const newPath = [];
+      // The backend's answer for a market is deterministic, asking again would only get the same "no cycle":
+      // keep the last path and let the next request (the next button press) try again
+      setNoCycle(!responsePath);
       if (!responsePath){
-        postCombinedData();
         return;
       } else {
           responsePath.forEach(val => {
@@ -209,6 +246,11 @@ const KrakenAPI = () => {
         ) : (
           <></>
         )}
+        {(showPath && noCycle) ? (
+          <p>No arbitrage cycle found in the current market.</p>
+        ) : (
+          <></>
+        )}
         {/* Return to Homepage button */}
         <a href="/">
           <button>
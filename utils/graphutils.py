@@ -13,17 +13,46 @@ import matplotlib.pyplot as plt
 import numpy as np
 
 class Graph:
+    """
+    Undirected graph built edge by edge, every edge is stored in both directions
+    - edges are appended to lists and the Data is only assembled when it is read, so building a graph is O(E)
+      instead of re-concatenating the whole edge tensor on every add_edge
+    """
     def __init__(self):
-        self.data = Data(x = None, edge_index = None, edge_attr = None)    
+        self.nodes = {} # name -> index
+        self._src, self._dst, self._weight = [], [], []
+        self._data = None
+
     def add_node(self, name):
-        self.graph.add_node(name)
-    
+        if name not in self.nodes:
+            self.nodes[name] = len(self.nodes)
+
+    def _index(self, node):
+        return self.nodes[node] if node in self.nodes else node
+
     def add_edge(self, u, v, weight=1):
-        # u, v are nodes
-        edge_index = torch.tensor([[u, v], [v, u]], dtype=torch.long)
-        edge_attr = torch.tensor([weight, weight], dtype=torch.float)  
-        self.data.edge_index = torch.cat([self.data.edge_index, edge_index], dim=1) if self.data.edge_index is not None else edge_index
-        self.data.edge_attr = torch.cat([self.data.edge_attr, edge_attr]) if self.data.edge_attr is not None else edge_attr
+        # u, v are node indices or names
+        u, v = self._index(u), self._index(v)
+        self._src += [u, v]
+        self._dst += [v, u]
+        self._weight += [weight, weight]
+        self._data = None
+
+    def add_edges(self, u, v, weight):
+        """Add many edges at once, u, v and weight are equally long sequences of node indices / weights"""
+        u, v, weight = np.asarray(u).tolist(), np.asarray(v).tolist(), np.asarray(weight, dtype=float).tolist()
+        self._src += [x for pair in zip(u, v) for x in pair]
+        self._dst += [x for pair in zip(v, u) for x in pair]
+        self._weight += [x for w in weight for x in (w, w)]
+        self._data = None
+
+    @property
+    def data(self) -> Data:
+        if self._data is None:
+            edge_index = torch.tensor([self._src, self._dst], dtype=torch.long) if self._src else None
+            edge_attr = torch.tensor(self._weight, dtype=torch.float) if self._weight else None
+            self._data = Data(x=None, edge_index=edge_index, edge_attr=edge_attr)
+        return self._data
 
 class GraphGenerator:
     def __init__(self, min_weight=1.0, max_weight=10.0, max_nodes=26):
@@ -57,16 +86,11 @@ class GraphGenerator:
             node_name = self._generate_node_name(i)
             graph.add_node(node_name)
 
-        # Add edges
-        all_possible_edges = [(u, v) for u in range(num_nodes) for v in range(num_nodes) if u != v]
-        random.shuffle(all_possible_edges)  # Shuffle to randomize edge selection
-
-        for _ in range(num_edges):
-            if not all_possible_edges:
-                break  # Break if there are no more possible edges to add
-            u, v = all_possible_edges.pop()
-            weight = random.uniform(self.min_weight, self.max_weight)
-            graph.add_edge(u, v, weight)
+        # Add edges, distinct (u, v) pairs drawn in one call
+        num_edges = min(num_edges, num_nodes*(num_nodes - 1))
+        u, v = sample_edges(num_nodes, num_edges, np.random.default_rng(random.getrandbits(64)))
+        weight = [random.uniform(self.min_weight, self.max_weight) for _ in range(num_edges)]
+        graph.add_edges(u, v, weight)
 
         return graph
 
@@ -94,36 +118,103 @@ class GraphGenerator:
 
         return graph
 
-def create_random_graph(num_nodes, num_edges, num_node_features=1):
-    # Initialize an empty set for unique edges
-    unique_edges = set()
-    
-    # Keep generating edges until we have the desired number of unique edges
-    while len(unique_edges) < num_edges:
-        # Generate a random edge
-        edge = tuple(np.random.choice(range(num_nodes), size=2, replace=False))
-        
-        # Check for self-loop (we already avoid it by using replace=False)
-        # and if it's not already in the set, add the edge
-        if edge[0] != edge[1]:
-            unique_edges.add(edge)
-    
-    # Convert the set of edges to a NumPy array
-    edge_list = np.array(list(unique_edges)).T
-    
-    # Convert to PyTorch tensor
-    edge_index = torch.tensor(edge_list, dtype=torch.long)
-    
+def _rng(seed) -> np.random.Generator:
+    # seed None draws the generator's seed from the global NumPy state, so np.random.seed still makes graphs
+    # reproducible, an int or a Generator is used as is
+    if seed is None:
+        seed = np.random.randint(2**32, dtype=np.int64)
+    return np.random.default_rng(seed)
+
+def sample_edges(num_nodes, num_edges, rng: np.random.Generator) -> np.ndarray:
+    """
+    num_edges distinct directed edges without self-loops, as a (2, num_edges) array sorted by (source, target)
+    - drawn without replacement from the n(n-1) off-diagonal entries of the n x n adjacency matrix in one call:
+      entry k is the (k mod (n-1))-th possible target of source k // (n-1), skipping the source itself
+    """
+    n_pairs = num_nodes*(num_nodes - 1)
+    if num_edges > n_pairs:
+        raise ValueError(f"{num_edges} edges do not fit in a graph of {num_nodes} nodes (at most {n_pairs})")
+    k = np.sort(rng.choice(n_pairs, size=num_edges, replace=False))
+    u, r = np.divmod(k, num_nodes - 1)
+    v = r + (r >= u)
+    return np.stack((u, v))
+
+def create_random_graph(num_nodes, num_edges, num_node_features=1, seed=None):
+    """
+    Random directed graph of num_edges distinct edges (no self-loops) with edge weights uniform on [-1, 1]
+    :param seed: int or np.random.Generator, None draws from the global np.random state
+    """
+    rng = _rng(seed)
+    edge_index = torch.from_numpy(sample_edges(num_nodes, num_edges, rng))
+
     # Initialize node features to 0
     x = torch.zeros((num_nodes, num_node_features), dtype=torch.float)
 
     # Random edge weights - uniform on [-1, 1]
-    attr = (-2)*torch.rand((num_edges, 1)) + 1
+    attr = torch.from_numpy(rng.uniform(-1, 1, (num_edges, 1)).astype(np.float32))
 
-    # Create the PyG Data object
-    data = Data(x=x, edge_index=edge_index, edge_attr=attr)
-    
-    return data
+    return Data(x=x, edge_index=edge_index, edge_attr=attr)
+
+def create_market_graph(num_base, num_quote, num_cycles=1, cycle_length=4, profit=0.01, spread=0.002, noise=0.001,
+                        num_node_features=1, seed=None):
+    """
+    Market-like graph: every base currency (nodes 0..num_base-1) trades against every quote currency (the rest),
+    both directions, with log(rate) as edge weight (so a cycle's summed weight is its log return)
+    - each currency has a log value and a rate is the ratio of values less the spread, perturbed by noise, so cycles
+      lose about spread per edge
+    - num_cycles arbitrage cycles are planted: cycle_length edges alternating base -> quote -> base ... whose weights
+      are set to sum to +profit.  The cycles share no edge (they may share nodes), so planting one never changes
+      another's weights
+    Returns (Data, cycles), cycles being the planted cycles as closed node lists
+    """
+    if cycle_length % 2 or cycle_length < 2 or cycle_length//2 > min(num_base, num_quote):
+        raise ValueError(f"cycle_length must be even and at most {2*min(num_base, num_quote)}")
+    if num_cycles*cycle_length > 2*num_base*num_quote:
+        raise ValueError(f"{num_cycles} edge-disjoint cycles of length {cycle_length} need more than the "
+                         f"{2*num_base*num_quote} edges of the graph")
+    rng = _rng(seed)
+    num_nodes = num_base + num_quote
+    value = rng.normal(0, 1, num_nodes)
+
+    base, quote = np.meshgrid(np.arange(num_base), np.arange(num_base, num_nodes), indexing='ij')
+    base, quote = base.reshape(-1), quote.reshape(-1)
+    # base -> quote at 2i, quote -> base at 2i + 1
+    src = np.stack((base, quote), axis=1).reshape(-1)
+    dst = np.stack((quote, base), axis=1).reshape(-1)
+    weight = value[src] - value[dst] - spread + rng.normal(0, noise, len(src))
+
+    cycles = []
+    planted = np.zeros(len(src), dtype=bool)
+    attempts = 0
+    while len(cycles) < num_cycles:
+        b = rng.choice(num_base, cycle_length//2, replace=False)
+        q = rng.choice(np.arange(num_base, num_nodes), cycle_length//2, replace=False)
+        nodes = np.stack((b, q), axis=1).reshape(-1)
+        u, v = nodes, np.roll(nodes, -1)
+        # slot of edge u -> v: pair (base, quote) is pair base*num_quote + quote - num_base
+        forward = u < num_base
+        pair = np.where(forward, u*num_quote + v - num_base, v*num_quote + u - num_base)
+        slot = 2*pair + ~forward
+
+        # reject a cycle through an edge of an earlier one, it would break that cycle's profit
+        if planted[slot].any():
+            attempts += 1
+            if attempts > 1000*num_cycles:
+                raise ValueError(f"could not place {num_cycles} edge-disjoint cycles of length {cycle_length}, "
+                                 f"use fewer or shorter cycles or a larger graph")
+            continue
+        planted[slot] = True
+
+        # values telescope around the cycle, so this sums to profit
+        weight[slot] = value[u] - value[v] + profit/cycle_length
+        cycles.append(nodes.tolist() + [int(nodes[0])])
+
+    data = Data(
+        x=torch.zeros((num_nodes, num_node_features), dtype=torch.float),
+        edge_index=torch.from_numpy(np.stack((src, dst))),
+        edge_attr=torch.from_numpy(weight.astype(np.float32)).view(-1, 1),
+    )
+    return data, cycles
 
 def print_graph(G, pos, node_labels=None, edge_labels=None, highlighted_nodes=None):
 